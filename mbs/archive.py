@@ -0,0 +1,122 @@
+__author__ = 'abdul'
+
+import mbs_logging
+
+from date_utils import date_now, date_minus_seconds
+from task import STATE_SUCCEEDED, STATE_CANCELED
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_ARCHIVE_AFTER_DAYS = 90
+
+# states of tasks that are archived
+ARCHIVED_STATES = [STATE_SUCCEEDED, STATE_CANCELED]
+
+# number of most recent log entries kept in archived tasks (all log entries
+# remain in the task_events collection)
+ARCHIVE_MAX_LOGS = 10
+
+# sourceStats fields kept in archived tasks
+ARCHIVED_STATS_FIELDS = ["dataSize", "storageSize", "fileSize", "indexSize",
+                         "objects", "collections", "databaseName", "host"]
+
+ARCHIVE_BATCH_SIZE = 500
+
+# archive collections are created with zlib block compression (WiredTiger)
+ARCHIVE_COLLECTION_OPTIONS = {
+    "storageEngine": {
+        "wiredTiger": {
+            "configString": "block_compressor=zlib"
+        }
+    }
+}
+
+###############################################################################
+# Cold archive of old task documents
+###############################################################################
+def archive_collection_name(collection_name):
+    return "%s_archive" % collection_name
+
+###############################################################################
+def get_archive_collection(database, collection_name):
+    """
+        Returns the archive collection of the specified task collection.
+        Creates it with compression if it does not exist
+    """
+    name = archive_collection_name(collection_name)
+    if name not in database.collection_names():
+        try:
+            database.create_collection(name, **ARCHIVE_COLLECTION_OPTIONS)
+        except Exception, e:
+            # already created or storage engine options not supported
+            logger.warning("Could not create compressed archive collection "
+                           "'%s': %s" % (name, e))
+
+    return database[name]
+
+###############################################################################
+def archive_tasks(database, collection_name,
+                  days=DEFAULT_ARCHIVE_AFTER_DAYS):
+    """
+        Moves SUCCEEDED/CANCELED tasks created more than days ago to the
+        archive collection of collection_name. Backups are archived only
+        once their target reference is expired (so that retention policies
+        still see them). Archived documents keep their ARCHIVE_MAX_LOGS most
+        recent log entries and a summary of their source stats.
+        Returns the number of archived tasks
+    """
+    collection = database[collection_name]
+    archive = get_archive_collection(database, collection_name)
+    cutoff = date_minus_seconds(date_now(), days * 24 * 60 * 60)
+    q = {
+        "state": {"$in": ARCHIVED_STATES},
+        "createdDate": {"$lt": cutoff},
+        "$or": [
+                {"targetReference": {"$exists": False}},
+                {"targetReference.expiredDate": {"$ne": None}}
+        ]
+    }
+
+    logger.info("Archiving %s tasks created before %s" %
+                (collection_name, cutoff))
+    archived_count = 0
+    while True:
+        docs = list(collection.find(q).limit(ARCHIVE_BATCH_SIZE))
+        if not docs:
+            break
+
+        for doc in docs:
+            # save() is idempotent in case a previous run was interrupted
+            archive.save(compact_task_document(doc))
+
+        collection.remove({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        archived_count += len(docs)
+
+    logger.info("Archived %s %s tasks" % (archived_count, collection_name))
+    return archived_count
+
+###############################################################################
+def compact_task_document(doc):
+    """
+        Trims the logs and summarizes the source stats of a task document
+    """
+    doc = dict(doc)
+    if doc.get("logs"):
+        doc["logs"] = doc["logs"][-ARCHIVE_MAX_LOGS:]
+
+    stats = doc.get("sourceStats")
+    if stats:
+        summary = dict((key, stats[key]) for key in ARCHIVED_STATS_FIELDS
+                       if key in stats)
+        if stats.get("repl", {}).get("me"):
+            summary["repl"] = {"me": stats["repl"]["me"]}
+        doc["sourceStats"] = summary
+
+    doc["archivedDate"] = date_now()
+    return doc
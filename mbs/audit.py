@@ -29,6 +29,7 @@ class AuditReport(MBSObject):
         self._total_success = 0
         self._total_failures = 0
         self._total_warnings = 0
+        self._top_failures = []
 
     ###########################################################################
     @property
@@ -127,9 +128,23 @@ class AuditReport(MBSObject):
     def total_warnings(self, total_warnings):
         self._total_warnings = total_warnings
 
+    ###########################################################################
+    @property
+    def top_failures(self):
+        """
+            Compact summary ({planId, description, totalFailures,
+            totalWarnings}) of the plans with the most failures. Set on
+            summary reports whose entries are stored separately
+        """
+        return self._top_failures
+
+    @top_failures.setter
+    def top_failures(self, top_failures):
+        self._top_failures = top_failures
+
     ###########################################################################
     def to_document(self, display_only=False):
-        return {
+        doc = {
             "_type": "AuditReport",
             "auditType": self.audit_type,
             "auditDate": self.audit_date,
@@ -141,6 +156,11 @@ class AuditReport(MBSObject):
             "totalWarnings": self.total_warnings,
             }
 
+        if self.top_failures:
+            doc["topFailures"] = self.top_failures
+
+        return doc
+
     ###########################################################################
     def _export_failures(self, display_only=False):
         return map(lambda entry: entry.to_document(display_only=display_only),
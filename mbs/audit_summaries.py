@@ -0,0 +1,246 @@
+__author__ = 'abdul'
+
+import mbs_logging
+
+from date_utils import (date_to_seconds, seconds_to_date, epoch_date,
+                        date_plus_seconds)
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+# _id of the document holding the first day from which summaries are complete
+COMPLETE_MARKER_ID = "completeSince"
+
+###############################################################################
+# AuditSummaryStore
+###############################################################################
+class AuditSummaryStore(object):
+    """
+        Materialized view of plan audits: one document per plan per day
+        (audit_summaries collection) holding the latest state and
+        error/warning counts of the backup of each of the plan's occurrences
+        of the day:
+        {
+            "_id": "<plan id>-<yyyymmdd>",
+            "planId": ...,
+            "date": <day>,
+            "occurrences": {
+                "<occurrence epoch seconds>": {
+                    "backupId": ..., "planOccurrence": ..., "state": ...,
+                    "errorCount": ..., "warningCount": ...
+                }
+            }
+        }
+        Maintained incrementally as backups are scheduled and change state.
+        Summaries only cover the days since the completeSince marker set by
+        rebuild(); days before it (e.g. before the store was enabled) must be
+        read from the backups collection
+    """
+    ###########################################################################
+    def __init__(self, collection):
+        self._collection = collection
+
+    ###########################################################################
+    def record_task(self, task):
+        """
+            Records the current state of a plan backup
+        """
+        plan = getattr(task, "plan", None)
+        plan_occurrence = getattr(task, "plan_occurrence", None)
+        if plan and plan_occurrence:
+            self.record(task.id, plan.id, plan_occurrence, task.state,
+                        error_count=task.error_count,
+                        warning_count=task.warning_count)
+
+    ###########################################################################
+    def record_documents(self, task_docs):
+        """
+            Records the state of plan backup documents
+        """
+        for doc in task_docs:
+            plan_doc = doc.get("plan")
+            if plan_doc and doc.get("planOccurrence"):
+                self.record(doc["_id"], plan_doc["_id"], doc["planOccurrence"],
+                            doc["state"],
+                            error_count=doc.get("errorCount") or 0,
+                            warning_count=doc.get("warningCount") or 0)
+
+    ###########################################################################
+    def record(self, backup_id, plan_id, plan_occurrence, state,
+               error_count=0, warning_count=0):
+        day = _day_of(plan_occurrence)
+        occurrence_key = "occurrences.%s" % date_to_seconds(plan_occurrence)
+        u = {
+            "$set": {
+                "planId": plan_id,
+                "date": day,
+                occurrence_key: {
+                    "backupId": backup_id,
+                    "planOccurrence": plan_occurrence,
+                    "state": state,
+                    "errorCount": error_count,
+                    "warningCount": warning_count
+                }
+            }
+        }
+        try:
+            self._collection.update({"_id": summary_id(plan_id, day)}, u,
+                                    upsert=True)
+        except Exception, e:
+            logger.error("AuditSummaryStore: Error while recording state of "
+                         "backup '%s': %s" % (backup_id, e))
+
+    ###########################################################################
+    def get_summaries(self, start_date, end_date=None, plan_ids=None):
+        """
+            Returns the summaries of the days from start_date to end_date
+            (excluded; defaults to the day after start_date)
+        """
+        end_date = end_date or seconds_to_date(date_to_seconds(start_date) +
+                                               24 * 60 * 60)
+        q = {
+            "date": {
+                "$gte": start_date,
+                "$lt": end_date
+            }
+        }
+        if plan_ids is not None:
+            q["planId"] = {"$in": plan_ids}
+
+        return list(self._collection.find(q))
+
+    ###########################################################################
+    def get_occurrence_states(self, start_date, end_date=None,
+                              plan_ids=None):
+        """
+            Returns a dict of (plan id, plan occurrence) => backup state doc
+            (_id, state, errorCount, warningCount) of all summaries (of the
+            specified plans if any) of the specified days
+        """
+        result = {}
+        for summary in self.get_summaries(start_date, end_date=end_date,
+                                          plan_ids=plan_ids):
+            for entry in summary.get("occurrences", {}).values():
+                result[(summary["planId"], entry["planOccurrence"])] = {
+                    "_id": entry["backupId"],
+                    "state": entry["state"],
+                    "errorCount": entry.get("errorCount") or 0,
+                    "warningCount": entry.get("warningCount") or 0
+                }
+
+        return result
+
+    ###########################################################################
+    def get_range_report(self, start_date, end_date=None, plan_ids=None):
+        """
+            Returns the number of plan occurrences per backup state of the
+            days from start_date to end_date (excluded; e.g. a week or a
+            month), overall and per plan. complete is false when summaries
+            do not cover start_date
+        """
+        end_date = end_date or seconds_to_date(date_to_seconds(start_date) +
+                                               24 * 60 * 60)
+        summaries = self.get_summaries(start_date, end_date=end_date,
+                                       plan_ids=plan_ids)
+        plan_summaries = {}
+        for summary in summaries:
+            plan_summaries.setdefault(summary["planId"], []).append(summary)
+
+        return {
+            "startDate": start_date,
+            "endDate": end_date,
+            "complete": self.covers(_day_of(start_date)),
+            "states": count_states(summaries),
+            "plans": [{
+                "planId": plan_id,
+                "states": count_states(plan_summaries[plan_id])
+            } for plan_id in sorted(plan_summaries.keys())]
+        }
+
+    ###########################################################################
+    def get_complete_since(self):
+        """
+            Returns the first day from which summaries are complete or None if
+            summaries were never rebuilt
+        """
+        marker = self._collection.find_one({"_id": COMPLETE_MARKER_ID})
+        return marker and marker["completeSince"]
+
+    ###########################################################################
+    def covers(self, day):
+        """
+            Whether summaries of the specified day are complete
+        """
+        complete_since = self.get_complete_since()
+        return complete_since is not None and day >= complete_since
+
+    ###########################################################################
+    def mark_complete_since(self, day):
+        self._collection.update({"_id": COMPLETE_MARKER_ID}, {
+            "_id": COMPLETE_MARKER_ID,
+            "completeSince": day
+        }, upsert=True)
+
+    ###########################################################################
+    def rebuild(self, backup_collection, since=None):
+        """
+            Rebuilds summaries from existing backups (created since the
+            specified date if any) then marks summaries complete from the
+            first full day rebuilt
+        """
+        q = {"planOccurrence": {"$exists": True}}
+        if since:
+            q["planOccurrence"] = {"$gte": since}
+        fields = {
+            "plan._id": 1,
+            "planOccurrence": 1,
+            "state": 1,
+            "errorCount": 1,
+            "warningCount": 1
+        }
+        count = 0
+        for doc in backup_collection.find(q, fields=fields,
+                                          sort=[("planOccurrence", 1)]):
+            self.record_documents([doc])
+            count += 1
+
+        logger.info("AuditSummaryStore: Rebuilt audit summaries from %s "
+                    "backups" % count)
+
+        if since:
+            complete_since = _day_of(since)
+            if complete_since < since:
+                complete_since = date_plus_seconds(complete_since,
+                                                   24 * 60 * 60)
+        else:
+            complete_since = epoch_date()
+        self.mark_complete_since(complete_since)
+
+        return count
+
+###############################################################################
+# HELPERS
+###############################################################################
+def summary_id(plan_id, day):
+    return "%s-%s" % (plan_id, day.strftime("%Y%m%d"))
+
+###############################################################################
+def _day_of(date):
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+###############################################################################
+def count_states(summaries):
+    """
+        Returns a dict of state => number of occurrences of the specified
+        summaries (e.g. a plan's summaries of a week)
+    """
+    counts = {}
+    for summary in summaries:
+        for entry in summary.get("occurrences", {}).values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+    return counts
@@ -1,8 +1,12 @@
 __author__ = 'abdul'
 
+import heapq
+
+from bson.objectid import ObjectId
 
 from mbs import get_mbs
 from audit import *
+from task import EVENT_TYPE_ERROR, EVENT_TYPE_WARNING
 import mbs_logging
 from date_utils import yesterday_date, datetime_to_string, date_plus_seconds
 
@@ -20,6 +24,13 @@ logger = mbs_logging.logger
 TYPE_PLAN_AUDIT = "PLAN_AUDIT"
 TYPE_SINGLE_PLAN_AUDIT = "SINGLE_PLAN_AUDIT"
 
+# number of plans listed in audit summaries/notification digests
+MAX_TOP_FAILURES = 20
+
+# number of plans whose backups (and their errors/warnings) are read and
+# audited at once. Bounds the memory used by plan audits
+AUDIT_PLAN_BATCH_SIZE = 500
+
 ###############################################################################
 # BackupAuditor
 # Creates an audit report about backups taken as of a specific day.
@@ -31,7 +42,12 @@ class BackupAuditor(object):
         pass
 
     ###########################################################################
-    def daily_audit_report(self, audit_date):
+    def daily_audit_report(self, audit_date, entry_writer=None):
+        """
+            entry_writer: AuditEntryWriter. When specified, report entries
+            are written as they are generated and the returned report is a
+            summary
+        """
         pass
 
     ###########################################################################
@@ -50,12 +66,15 @@ class PlanAuditor(BackupAuditor):
     ###########################################################################
     # plan auditing
     ###########################################################################
-    def daily_audit_report(self, audit_date):
+    def daily_audit_report(self, audit_date, entry_writer=None):
 
         logger.info("PlanAuditor: Generating %s audit report for '%s'" %
                     (TYPE_PLAN_AUDIT,  datetime_to_string(audit_date)))
 
         audit_end_date = date_plus_seconds(audit_date, 3600 * 24)
+        summary_store = get_mbs().audit_summary_store
+        use_summaries = bool(summary_store and
+                             summary_store.covers(audit_date))
         all_plans_report = AuditReport()
         all_plans_report.audit_date = audit_date
         all_plans_report.audit_type = TYPE_PLAN_AUDIT
@@ -63,33 +82,48 @@ class PlanAuditor(BackupAuditor):
         total_plans = 0
         failed_plan_reports = []
         all_warned_audits = []
+        total_failures = 0
         total_warnings = 0
-        for plan in get_mbs().plan_collection.find():
-            # skip recently added plans whose created date is after audit date
-            # and their next occurrence is not in auditing range
-            if (plan.created_date > audit_date and plan.next_occurrence and
-                plan.next_occurrence > audit_end_date) :
-                logger.info("PlanAuditor: Skipping auditing plan '%s' since"
-                            " its created date '%s' is later than audit date "
-                            "'%s'" % (plan.id,
-                                      datetime_to_string(plan.created_date),
-                                      datetime_to_string(audit_date)))
-                continue
-
-            plan_report = self._create_plan_audit_report(plan, audit_date)
-
-            if plan_report.has_failures():
+        # (total failures, plan id, compact failure) heap
+        top_failures = []
+        audit_plans = [plan for plan in
+                       get_mbs().plan_collection.find(lazy=True)
+                       if self._is_audited(plan, audit_date, audit_end_date)]
+        audit_backups = {}
+        for plan_index, plan in enumerate(audit_plans):
+            if plan_index % AUDIT_PLAN_BATCH_SIZE == 0:
+                plan_batch = audit_plans[plan_index:plan_index +
+                                                    AUDIT_PLAN_BATCH_SIZE]
+                audit_backups = self._get_audit_backups(
+                    audit_date, audit_end_date, plan_batch,
+                    use_summaries=use_summaries)
+
+            plan_report = self._create_plan_audit_report(plan, audit_date,
+                                                         audit_backups)
+
+            if entry_writer:
+                # stream plan reports out instead of accumulating them
+                if plan_report.has_failures() or plan_report.has_warnings():
+                    entry_writer.write(plan_report)
+                if plan_report.has_failures():
+                    _push_top_failure(top_failures, plan_report)
+            elif plan_report.has_failures():
                 failed_plan_reports.append(plan_report)
-            if plan_report.has_warnings():
+            elif plan_report.has_warnings():
                 # only append to warned audits if report doesn't have failures
-                if not plan_report.has_failures():
-                    all_warned_audits.extend(plan_report.warned_audits)
+                all_warned_audits.extend(plan_report.warned_audits)
 
+            if plan_report.has_failures():
+                total_failures += 1
+            if plan_report.has_warnings():
                 total_warnings += 1
 
             total_plans += 1
 
-        total_failures = len(failed_plan_reports)
+        if top_failures:
+            all_plans_report.top_failures = [
+                failure for count, plan_id, failure in
+                sorted(top_failures, reverse=True)]
 
         if failed_plan_reports:
             all_plans_report.failed_audits = failed_plan_reports
@@ -106,7 +140,22 @@ class PlanAuditor(BackupAuditor):
         return all_plans_report
 
     ###########################################################################
-    def _create_plan_audit_report(self, plan, audit_date):
+    def _is_audited(self, plan, audit_date, audit_end_date):
+        # skip recently added plans whose created date is after audit date
+        # and their next occurrence is not in auditing range
+        if (plan.created_date > audit_date and plan.next_occurrence and
+            plan.next_occurrence > audit_end_date) :
+            logger.info("PlanAuditor: Skipping auditing plan '%s' since"
+                        " its created date '%s' is later than audit date "
+                        "'%s'" % (plan.id,
+                                  datetime_to_string(plan.created_date),
+                                  datetime_to_string(audit_date)))
+            return False
+
+        return True
+
+    ###########################################################################
+    def _create_plan_audit_report(self, plan, audit_date, audit_backups):
 
         plan_report = PlanAuditReport()
         plan_report.plan = plan
@@ -118,7 +167,8 @@ class PlanAuditor(BackupAuditor):
         total_audits = 0
         total_warnings = 0
         for plan_occurrence in plan.natural_occurrences_as_of(audit_date):
-            audit_entry = self._audit_plan_occurrence(plan, plan_occurrence)
+            audit_entry = self._audit_plan_occurrence(plan, plan_occurrence,
+                                                      audit_backups)
             if audit_entry.failed():
                 failed_audits.append(audit_entry)
 
@@ -147,17 +197,16 @@ class PlanAuditor(BackupAuditor):
         return plan_report
 
     ###########################################################################
-    def _audit_plan_occurrence(self, plan, plan_occurrence):
-        backup = self._lookup_backup_by_plan_occurrence(plan,
-            plan_occurrence)
+    def _audit_plan_occurrence(self, plan, plan_occurrence, audit_backups):
+        backup_doc = audit_backups.get((plan.id, plan_occurrence))
 
         audit_entry = PlanAuditEntry()
 
-        if backup:
-            audit_entry.backup_id = backup.id
-            audit_entry.state = backup.state
-            audit_entry.errors = backup.get_errors()
-            audit_entry.warnings = backup.get_warnings()
+        if backup_doc:
+            audit_entry.backup_id = backup_doc["_id"]
+            audit_entry.state = backup_doc["state"]
+            audit_entry.errors = backup_doc["errors"]
+            audit_entry.warnings = backup_doc["warnings"]
         else:
             audit_entry.state = "NEVER SCHEDULED"
 
@@ -167,25 +216,156 @@ class PlanAuditor(BackupAuditor):
         return audit_entry
 
     ###########################################################################
-    def _lookup_backup_by_plan_occurrence(self, plan, plan_occurrence):
+    def _has_missing_occurrences(self, plan, audit_date, audit_backups):
+        for plan_occurrence in plan.natural_occurrences_as_of(audit_date):
+            if (plan.id, plan_occurrence) not in audit_backups:
+                return True
+        return False
+
+    ###########################################################################
+    def _get_audit_backups(self, audit_date, audit_end_date, plans,
+                           use_summaries=False):
+        """
+            Returns a dict of (plan id, plan occurrence) => backup document
+            (state, errors, warnings) of the backups of the specified plans
+            of the audit day. Reads the precomputed audit summaries if
+            use_summaries, otherwise uses one range query on planOccurrence.
+            Errors/warnings of the backups that have any are read with one
+            query on the events collection
+        """
+        c = get_mbs().backup_collection
+        plan_ids = [plan.id for plan in plans]
+        audit_backups = None
+        if use_summaries:
+            summary_store = get_mbs().audit_summary_store
+            audit_backups = summary_store.get_occurrence_states(
+                audit_date, end_date=audit_end_date, plan_ids=plan_ids)
+            for plan in plans:
+                if self._has_missing_occurrences(plan, audit_date,
+                                                 audit_backups):
+                    # summaries could have been dropped (recording errors
+                    # are not fatal) so read the backups instead
+                    logger.warning("PlanAuditor: Audit summaries of plan "
+                                   "'%s' are missing occurrences. Reading "
+                                   "backups of audit date '%s'" %
+                                   (plan.id, datetime_to_string(audit_date)))
+                    audit_backups = None
+                    break
+
+        if audit_backups is None:
+            audit_backups = self._read_audit_backups(audit_date,
+                                                     audit_end_date, plan_ids)
+
+        # errors/warnings of backups that logged any
+        logged_ids = [doc["_id"] for doc in audit_backups.values()
+                      if doc.get("errorCount") or doc.get("warningCount")]
+        events = c.get_tasks_events(logged_ids,
+                                    event_types=[EVENT_TYPE_ERROR,
+                                                 EVENT_TYPE_WARNING])
+        for doc in audit_backups.values():
+            backup_events = events.get(doc["_id"], [])
+            doc["errors"] = [event for event in backup_events
+                             if event.event_type == EVENT_TYPE_ERROR]
+            doc["warnings"] = [event for event in backup_events
+                               if event.event_type == EVENT_TYPE_WARNING]
+
+        logger.info("PlanAuditor: Read %s backups of %s plans of audit date "
+                    "'%s'" % (len(audit_backups), len(plans),
+                              datetime_to_string(audit_date)))
+
+        return audit_backups
 
+    ###########################################################################
+    def _read_audit_backups(self, audit_date, audit_end_date, plan_ids):
         q = {
-            "plan._id": plan._id,
-            "planOccurrence":plan_occurrence,
+            "planOccurrence": {
+                "$gte": audit_date,
+                "$lt": audit_end_date
+            },
+            "plan._id": {
+                "$in": plan_ids
             }
-        c = get_mbs().backup_collection
+        }
+        fields = {
+            "plan._id": 1,
+            "planOccurrence": 1,
+            "state": 1,
+            "errorCount": 1,
+            "warningCount": 1
+        }
+        audit_backups = {}
+        for doc in get_mbs().backup_collection.find_documents(q,
+                                                              fields=fields):
+            key = (doc["plan"]["_id"], doc["planOccurrence"])
+            audit_backups.setdefault(key, doc)
+
+        return audit_backups
 
-        return c.find_one(q)
 
+###############################################################################
+def _push_top_failure(top_failures, plan_report):
+    """
+        Keeps the MAX_TOP_FAILURES plans with the most failures in the
+        top_failures heap
+    """
+    plan = plan_report.plan
+    failure = {
+        "planId": plan.id,
+        "description": plan.description,
+        "totalFailures": plan_report.total_failures,
+        "totalWarnings": plan_report.total_warnings
+    }
+    item = (plan_report.total_failures, str(plan.id), failure)
+    if len(top_failures) < MAX_TOP_FAILURES:
+        heapq.heappush(top_failures, item)
+    else:
+        heapq.heappushpop(top_failures, item)
+
+###############################################################################
+# AuditEntryWriter
+###############################################################################
+class AuditEntryWriter(object):
+    """
+        Writes the entries (e.g. PlanAuditReports) of an audit as separate
+        documents keyed by audit id
+    """
+    ###########################################################################
+    def __init__(self, collection, audit_id):
+        self._collection = collection
+        self._audit_id = audit_id
+        self._entry_count = 0
+
+    ###########################################################################
+    @property
+    def entry_count(self):
+        return self._entry_count
+
+    ###########################################################################
+    def write(self, report):
+        doc = report.to_document(display_only=True)
+        doc["auditId"] = self._audit_id
+        plan = getattr(report, "plan", None)
+        if plan:
+            doc["planId"] = plan.id
+        self._collection.insert(doc)
+        self._entry_count += 1
 
 ###############################################################################
 class GlobalAuditor():
 
     ###########################################################################
-    def __init__(self, audit_collection, notification_handler=None):
+    def __init__(self, audit_collection, notification_handler=None,
+                 entries_collection=None, report_url=None):
+        """
+            entries_collection: when specified, audit entries are streamed to
+            it and audit reports are saved as compact summaries
+            report_url: base url of audit reports used in notifications
+        """
         self._auditors = []
         self._audit_collection = audit_collection
         self._notification_handler = notification_handler
+        self._entries_collection = entries_collection
+        self._report_url = report_url
 
     ###########################################################################
     def register_auditor(self, auditor):
@@ -195,9 +375,21 @@ class GlobalAuditor():
     def generate_daily_audit_reports(self, date):
         reports = []
         for auditor in self._auditors:
-            report = auditor.daily_audit_report(date)
+            audit_id = ObjectId()
+            entry_writer = None
+            if self._entries_collection is not None:
+                entry_writer = AuditEntryWriter(self._entries_collection,
+                                                audit_id)
+
+            report = auditor.daily_audit_report(date,
+                                                entry_writer=entry_writer)
             logger.info("GlobalAuditor: Saving audit report: \n%s" % report)
-            self._audit_collection.save_document(report.to_document())
+            report_doc = report.to_document()
+            report_doc["_id"] = audit_id
+            if entry_writer:
+                report_doc["entryCount"] = entry_writer.entry_count
+            self._audit_collection.save_document(report_doc)
+            report.id = audit_id
             reports.append(report)
 
         # send notification if specified
@@ -208,9 +400,64 @@ class GlobalAuditor():
     def generate_yesterday_audit_reports(self):
         self.generate_daily_audit_reports(yesterday_date())
 
+    ###########################################################################
+    def get_audit_report(self, audit_id, limit=None):
+        """
+            Returns the audit report document with its entries (if stored
+            separately)
+        """
+        audit_id = ObjectId(str(audit_id))
+        report_doc = self._audit_collection.find_documents({"_id": audit_id})
+        if not report_doc:
+            return None
+
+        result = {"report": report_doc[0]}
+        if self._entries_collection is not None:
+            cursor = self._entries_collection.find({"auditId": audit_id},
+                                                   sort=[("_id", 1)])
+            if limit:
+                cursor = cursor.limit(limit)
+            result["entries"] = list(cursor)
+
+        return result
+
     ###########################################################################
     def _send_notification(self, date, reports):
         subject = "Backup Audit Reports for %s" % datetime_to_string(date)
-        reports_str = map(str, reports)
+        if self._entries_collection is not None:
+            reports_str = map(self._report_digest, reports)
+        else:
+            reports_str = map(str, reports)
         message = "\n\n\n".join(reports_str)
         self._notification_handler.send_notification(subject, message)
+
+    ###########################################################################
+    def _report_digest(self, report):
+        """
+            Digest of a summary report: totals, plans with most failures and
+            a link to the full report
+        """
+        lines = [
+            "%s audit for %s: %s audits, %s succeeded, %s failed, %s warned" %
+            (report.audit_type, datetime_to_string(report.audit_date),
+             report.total_audits, report.total_success,
+             report.total_failures, report.total_warnings)
+        ]
+
+        if report.top_failures:
+            lines.append("")
+            lines.append("Plans with most failures:")
+            for failure in report.top_failures:
+                lines.append("  %s (%s): %s failures, %s warnings" %
+                             (failure["planId"], failure["description"],
+                              failure["totalFailures"],
+                              failure["totalWarnings"]))
+
+        lines.append("")
+        if self._report_url:
+            lines.append("Full report: %s/%s" %
+                         (self._report_url.rstrip("/"), report.id))
+        else:
+            lines.append("Full report: mbs audit-report %s" % report.id)
+
+        return "\n".join(lines)
@@ -0,0 +1,232 @@
+__author__ = 'abdul'
+
+import os
+import threading
+
+import mbs_logging
+
+from date_utils import date_now
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+MB = 1024 * 1024
+
+# S3 min part size (all parts except the last)
+MIN_PART_SIZE = 5 * MB
+DEFAULT_PART_SIZE = 16 * MB
+DEFAULT_MAX_PART_SIZE = 1024 * MB
+PART_SIZE_STEP = 8 * MB
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# max number of bytes that can be in flight at once
+DEFAULT_MEMORY_LIMIT = 512 * MB
+
+# a throughput sample within this ratio of the best is considered no worse
+THROUGHPUT_TOLERANCE = 0.05
+
+# a throughput sample this much below the best triggers a decrease
+THROUGHPUT_DROP = 0.25
+
+###############################################################################
+# MultipartAutotuner
+###############################################################################
+class MultipartAutotuner(object):
+    """
+        Tunes the part size and number of parts in flight for multi-part
+        uploads based on measured throughput, AIMD style:
+         - while aggregate throughput keeps up with the best seen so far,
+           add one part in flight (or grow the part size once in-flight parts
+           are maxed out or would exceed the memory limit)
+         - on failed parts or a throughput drop, halve the parts in flight
+        in_flight * part_size never exceeds memory_limit
+    """
+    ###########################################################################
+    def __init__(self, part_size=DEFAULT_PART_SIZE, in_flight=1,
+                 max_part_size=DEFAULT_MAX_PART_SIZE,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 memory_limit=DEFAULT_MEMORY_LIMIT):
+        self._max_part_size = max(MIN_PART_SIZE, max_part_size)
+        self._max_in_flight = max(1, max_in_flight)
+        self._memory_limit = max(MIN_PART_SIZE, memory_limit)
+
+        self._part_size = self._bound_part_size(part_size)
+        self._in_flight = 1
+        self._set_in_flight(in_flight)
+
+        self._best_throughput = None
+        self._lock = threading.Lock()
+
+        # totals since the tuner started
+        self._total_bytes = 0
+        self._total_part_time = 0
+
+    ###########################################################################
+    @property
+    def part_size(self):
+        return self._part_size
+
+    ###########################################################################
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    ###########################################################################
+    @property
+    def best_throughput(self):
+        """
+            Best aggregate throughput (bytes/second) measured
+        """
+        return self._best_throughput
+
+    ###########################################################################
+    def record_part(self, size, seconds):
+        """
+            Records a successful part upload of size bytes that took seconds
+        """
+        with self._lock:
+            seconds = max(seconds, 0.001)
+            self._total_bytes += size
+            self._total_part_time += seconds
+
+            # aggregate throughput = per-part throughput * parts in flight
+            throughput = (float(size) / seconds) * self._in_flight
+            best = self._best_throughput
+
+            if best is None or throughput >= best * (1 - THROUGHPUT_TOLERANCE):
+                self._best_throughput = max(best, throughput)
+                self._increase()
+            elif throughput < best * (1 - THROUGHPUT_DROP):
+                self._decrease()
+
+    ###########################################################################
+    def record_failure(self):
+        with self._lock:
+            self._decrease()
+            self._part_size = self._bound_part_size(self._part_size / 2)
+
+    ###########################################################################
+    def _increase(self):
+        if (self._in_flight < self._max_in_flight and
+                (self._in_flight + 1) * self._part_size <= self._memory_limit):
+            self._in_flight += 1
+        else:
+            part_size = self._bound_part_size(self._part_size +
+                                              PART_SIZE_STEP)
+            if self._in_flight * part_size <= self._memory_limit:
+                self._part_size = part_size
+
+    ###########################################################################
+    def _decrease(self):
+        self._set_in_flight(self._in_flight / 2)
+        # forget the best throughput so that we can climb again from here
+        self._best_throughput = None
+
+    ###########################################################################
+    def _set_in_flight(self, in_flight):
+        max_by_memory = max(1, self._memory_limit / self._part_size)
+        self._in_flight = max(1, min(in_flight, self._max_in_flight,
+                                     max_by_memory))
+
+    ###########################################################################
+    def _bound_part_size(self, part_size):
+        part_size = max(MIN_PART_SIZE, min(part_size, self._max_part_size))
+        # make sure that at least one part fits in memory
+        return min(part_size, self._memory_limit)
+
+    ###########################################################################
+    def get_settings(self):
+        return {
+            "partSize": self.part_size,
+            "inFlight": self.in_flight,
+            "throughputInMBPS": self.average_throughput_mbps()
+        }
+
+    ###########################################################################
+    def average_throughput_mbps(self):
+        if self._total_part_time:
+            per_part = float(self._total_bytes) / self._total_part_time
+            return round(per_part * self.in_flight / MB, 2)
+
+###############################################################################
+# FilePart
+###############################################################################
+class FilePart(object):
+    """
+        Read-only file like object for the byte range [offset, offset + size)
+        of a file. Used to upload variable size parts
+    """
+    ###########################################################################
+    def __init__(self, file_path, offset, size):
+        self._file = open(file_path, "rb")
+        self._offset = offset
+        self._size = size
+        self._file.seek(offset)
+
+    ###########################################################################
+    @property
+    def size(self):
+        return self._size
+
+    ###########################################################################
+    def read(self, size=-1):
+        remaining = self._size - self.tell()
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return ""
+        return self._file.read(size)
+
+    ###########################################################################
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.tell()
+        elif whence == os.SEEK_END:
+            offset += self._size
+
+        offset = max(0, min(offset, self._size))
+        self._file.seek(self._offset + offset)
+
+    ###########################################################################
+    def tell(self):
+        return self._file.tell() - self._offset
+
+    ###########################################################################
+    def close(self):
+        self._file.close()
+
+    ###########################################################################
+    def __enter__(self):
+        return self
+
+    ###########################################################################
+    def __exit__(self, *args):
+        self.close()
+
+###############################################################################
+# Tuning persistence
+###############################################################################
+def load_tuning(collection, key):
+    """
+        Returns the tuning settings last persisted for key or None
+    """
+    try:
+        return collection.find_one({"_id": key})
+    except Exception, e:
+        logger.warning("Unable to load upload tuning for '%s': %s" % (key, e))
+
+###############################################################################
+def save_tuning(collection, key, settings):
+    try:
+        doc = dict(settings)
+        doc["_id"] = key
+        doc["updatedDate"] = date_now()
+        collection.save(doc)
+    except Exception, e:
+        logger.warning("Unable to save upload tuning for '%s': %s" % (key, e))
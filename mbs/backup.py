@@ -6,6 +6,24 @@ from task import *
 # Backup
 ###############################################################################
 class Backup(MBSTask):
+
+    __slots__ = ("_name", "_description", "_source", "_source_stats",
+                 "_target", "_target_reference", "_plan", "_plan_occurrence",
+                 "_backup_rate_in_mbps")
+
+    PROPERTY_EXPORTERS = MBSTask.PROPERTY_EXPORTERS.copy()
+    PROPERTY_EXPORTERS.update({
+        "source": document_exporter("source"),
+        "target": document_exporter("target"),
+        "planOccurrence": attribute_exporter("plan_occurrence"),
+        "name": optional_attribute_exporter("name"),
+        "description": optional_attribute_exporter("description"),
+        "plan": document_exporter("plan"),
+        "targetReference": document_exporter("target_reference"),
+        "sourceStats": optional_attribute_exporter("source_stats"),
+        "backupRateInMBPS": optional_attribute_exporter("backup_rate_in_mbps")
+    })
+
     def __init__(self):
         # init fields
         MBSTask.__init__(self)
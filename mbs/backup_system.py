@@ -1,13 +1,12 @@
 __author__ = 'abdul'
 
-import time
 import mbs_logging
 import traceback
 import urllib
 import json
 import os
 
-from threading import Thread
+from threading import Thread, Event
 
 from flask import Flask
 from flask.globals import request
@@ -15,16 +14,25 @@ from utils import document_pretty_string, resolve_path
 
 import mbs_config
 
-from date_utils import date_now, date_minus_seconds, time_str_to_datetime_today
+from date_utils import (date_now, date_minus_seconds, date_plus_seconds,
+                        time_str_to_datetime_today, timedelta_total_seconds,
+                        string_to_datetime)
 from errors import *
 from auditors import GlobalAuditor
 from task import (STATE_SCHEDULED, STATE_IN_PROGRESS, STATE_FAILED,
-                  STATE_CANCELED, EVENT_STATE_CHANGE)
+                  STATE_CANCELED, EVENT_STATE_CHANGE, RESCHEDULE_PERIOD)
 
 from mbs import get_mbs
 from backup import Backup
 from restore import Restore
 from target import CloudBlockStorageSnapshotReference
+from plan_heap import PlanHeap
+from persistence import get_plans_backup_durations
+from load_leveling import LoadLevelingPolicy, load_leveling_report
+from capacity import capacity_report, get_plan_profiles, DEFAULT_HISTORY_DAYS
+from index_advisor import IndexAdvisor
+from archive import archive_tasks
+from mongo_utils import objectiditify
 
 ###############################################################################
 ########################                                #######################
@@ -44,9 +52,19 @@ logger = mbs_logging.logger
 MAX_BACKUP_WAIT_TIME = 5 * 60 * 60
 ONE_OFF_BACKUP_MAX_WAIT_TIME = 60
 
-# Minimum time before rescheduling a failed backup (5 minutes)
-RESCHEDULE_PERIOD = 5 * 60
-RESCHEDULE_PERIOD_MILLS = RESCHEDULE_PERIOD * 1000
+# plans due dates are reloaded from the database every 5 minutes to pick up
+# changes made outside of the backup system process
+PLAN_HEAP_SYNC_INTERVAL = 5 * 60
+
+# maintenance (notifications, plan generators, rescheduling, ...) runs every
+# MAINTENANCE_TICKS * sleep_time seconds
+MAINTENANCE_TICKS = 100
+
+# max number of backups inserted at once when scheduling plans in batch
+BACKUP_INSERT_BATCH_SIZE = 500
+
+# old tasks are archived (when archive_after_days is set) once a day
+ARCHIVE_INTERVAL = 24 * 60 * 60
 
 BACKUP_SYSTEM_STATUS_RUNNING = "running"
 BACKUP_SYSTEM_STATUS_STOPPING = "stopping"
@@ -66,6 +84,10 @@ class BackupSystem(Thread):
         self._plan_generators = []
         self._tick_count = 0
         self._stopped = False
+        self._plan_heap = PlanHeap()
+        self._plan_heap_synced_date = None
+        self._next_maintenance_date = None
+        self._wake_event = Event()
         self._command_port = command_port
         self._command_server = BackupSystemCommandServer(self)
 
@@ -77,6 +99,12 @@ class BackupSystem(Thread):
         self._global_auditor = None
         self._audit_schedule = None
         self._audit_next_occurrence = None
+        self._audit_report_url = None
+
+        self._load_leveling_policy = None
+
+        self._archive_after_days = None
+        self._next_archive_date = None
 
     ###########################################################################
     @property
@@ -114,14 +142,57 @@ class BackupSystem(Thread):
     def audit_schedule(self, schedule):
         self._audit_schedule = schedule
 
+    ###########################################################################
+    @property
+    def audit_report_url(self):
+        """
+            Optional base url of audit reports (e.g. the command server's
+            audit-report url) linked from audit notifications
+        """
+        return self._audit_report_url
+
+    @audit_report_url.setter
+    def audit_report_url(self, url):
+        self._audit_report_url = url
+
+    ###########################################################################
+    @property
+    def load_leveling_policy(self):
+        """
+            Optional LoadLevelingPolicy. When set, plans next occurrences are
+            spread within their allowed window instead of being scheduled at
+            their natural occurrences
+        """
+        return self._load_leveling_policy
+
+    @load_leveling_policy.setter
+    def load_leveling_policy(self, policy):
+        self._load_leveling_policy = policy
+
+    ###########################################################################
+    @property
+    def archive_after_days(self):
+        """
+            Optional. When set, SUCCEEDED/CANCELED backups and restores older
+            than archive_after_days are moved to their archive collections
+            once a day
+        """
+        return self._archive_after_days
+
+    @archive_after_days.setter
+    def archive_after_days(self, days):
+        self._archive_after_days = days
+
     ###########################################################################
     @property
     def global_auditor(self):
         if not self._global_auditor:
             ac = get_mbs().audit_collection
             nh = self.audit_notification_handler
-            self._global_auditor = GlobalAuditor(audit_collection=ac,
-                                                 notification_handler=nh)
+            self._global_auditor = GlobalAuditor(
+                audit_collection=ac, notification_handler=nh,
+                entries_collection=get_mbs().audit_entries_collection,
+                report_url=self.audit_report_url)
             # register auditors with global auditor
             if self.auditors:
                 for auditor in self.auditors:
@@ -143,7 +214,7 @@ class BackupSystem(Thread):
         while not self._stopped:
             try:
                 self._tick()
-                time.sleep(self._sleep_time)
+                self._wait_for_next_tick()
             except Exception, e:
                 self.error("Caught an error: '%s'.\nStack Trace:\n%s" %
                            (e, traceback.format_exc()))
@@ -158,105 +229,196 @@ class BackupSystem(Thread):
         # increase _generators_tick_counter
         self._tick_count += 1
 
+        now = date_now()
+        if (not self._plan_heap_synced_date or
+                now >= date_plus_seconds(self._plan_heap_synced_date,
+                                         PLAN_HEAP_SYNC_INTERVAL)):
+            self._sync_plan_heap()
+
         self._process_plans_considered_now()
 
-        # run those things every 100 ticks
-        if self._tick_count % 100 == 0:
+        # run those things every MAINTENANCE_TICKS * sleep_time seconds
+        if not self._next_maintenance_date:
+            self._next_maintenance_date = self._get_next_maintenance_date()
+        elif date_now() >= self._next_maintenance_date:
+            self._next_maintenance_date = self._get_next_maintenance_date()
             self._notify_on_past_due_scheduled_backups()
             self._notify_on_late_in_progress_backups()
             self._cancel_past_cycle_scheduled_backups()
             self._run_plan_generators()
             self._reschedule_in_cycle_failed_backups()
+            self._check_archive()
 
     ###########################################################################
-    def _process_plans_considered_now(self):
-        for plan in self._get_plans_to_consider_now():
-            try:
-                self._process_plan(plan)
-            except Exception, e:
-                logger.error("Error while processing plan '%s'. Cause: %s" %
-                             (plan.id, e))
-                self._notify_error(e)
+    def _check_archive(self):
+        if not self.archive_after_days:
+            return
+
+        if (not self._next_archive_date or
+                date_now() >= self._next_archive_date):
+            self._next_archive_date = date_plus_seconds(date_now(),
+                                                        ARCHIVE_INTERVAL)
+            self.archive_old_tasks(days=self.archive_after_days)
 
     ###########################################################################
-    def _process_plan(self, plan):
+    def archive_old_tasks(self, days):
         """
-        Schedule the plan if the following conditions apply
+            Moves SUCCEEDED/CANCELED backups and restores older than days to
+            their archive collections. Returns the number of archived tasks
+            per collection
         """
-        self.info("Processing plan '%s'" % plan._id)
-        # validate plan first
-        self.debug("Validating plan '%s'" % plan._id)
-
-        errors = plan.validate()
-        if errors:
-            err_msg = ("Plan '%s' is invalid.Please correct the following"
-                       " errors.\n%s" % (plan.id, errors))
-            raise InvalidPlanError(err_msg)
-            # TODO disable plan ???
-
-        now = date_now()
-        next_natural_occurrence = plan.next_natural_occurrence()
-
-
-        # CASE I: First time <==> No previous backups
-        # Only set the next occurrence here
-        if not plan.next_occurrence:
-            self.info("Plan '%s' has no previous backup. Setting next"
-                      " occurrence to '%s'" %
-                      (plan._id, next_natural_occurrence))
+        database = get_mbs().database
+        return dict((name, archive_tasks(database, name, days=days))
+                    for name in ["backups", "restores"])
 
-            self._set_plan_next_occurrence(plan)
+    ###########################################################################
+    def _get_next_maintenance_date(self):
+        return date_plus_seconds(date_now(),
+                                 MAINTENANCE_TICKS * self._sleep_time)
 
-        # CASE II: If there is a backup running (IN PROGRESS)
-        # ===> no op
-        elif self._plan_has_backup_in_progress(plan):
-            self.info("Plan '%s' has a backup that is currently in"
-                      " progress. Nothing to do now." % plan._id)
-        # CASE III: if time now is past the next occurrence
-        elif plan.next_occurrence <= now:
-            self.info("Plan '%s' next occurrence '%s' is greater than"
-                      " now. Scheduling a backup!!!" %
-                      (plan._id, plan.next_occurrence))
+    ###########################################################################
+    def _wait_for_next_tick(self):
+        """
+            Sleeps until the next wake date. Saving plans or stopping wakes
+            the backup system up
+        """
+        wake_date = self._get_next_wake_date()
+        sleep_seconds = timedelta_total_seconds(wake_date - date_now())
+        if sleep_seconds > 0:
+            self._wake_event.wait(sleep_seconds)
+        self._wake_event.clear()
 
-            self.schedule_new_backup(plan)
+    ###########################################################################
+    def _get_next_wake_date(self):
+        """
+            Returns the date when the next plan is due, the next maintenance
+            or the next plan heap sync; whichever comes first
+        """
+        wake_dates = [self._next_maintenance_date,
+                      date_plus_seconds(self._plan_heap_synced_date,
+                                        PLAN_HEAP_SYNC_INTERVAL)]
+        next_due_date = self._plan_heap.next_due_date()
+        if next_due_date:
+            wake_dates.append(next_due_date)
 
+        return min(d for d in wake_dates if d)
 
-        else:
-            self.info("Wooow. How did you get here!!!! Plan '%s' does"
-                      " not to be scheduled yet. next natural "
-                      "occurrence %s " % (plan._id,
-                                          next_natural_occurrence))
+    ###########################################################################
+    def _wake_up(self):
+        self._wake_event.set()
 
+    ###########################################################################
+    def _sync_plan_heap(self):
+        """
+            Reloads plans due dates (only ids and next occurrences are fetched)
+        """
+        fields = {"_id": 1, "nextOccurrence": 1}
+        plan_docs = get_mbs().plan_collection.find_documents(fields=fields)
+        self._plan_heap.load(plan_docs)
+        self._plan_heap_synced_date = date_now()
+        self.debug("Synced plan heap (%s plans)" % len(self._plan_heap))
 
     ###########################################################################
-    def _get_plans_to_consider_now(self):
+    def _process_plans_considered_now(self):
+        """
+            Processes plans that are due now according to the plan heap
         """
-        Returns list of plans that the scheduler should process at this time.
-        Those are:
-            1- Plans with no backups scheduled yet (next occurrence has not
-            been calculated yet)
+        now = date_now()
+        plan_ids = self._plan_heap.pop_due(now)
+        if not plan_ids:
+            return
 
-            2- Plans whose next occurrence is now or in the past
+        plans = None
+        try:
+            plans = get_mbs().plan_collection.find({"_id": {"$in": plan_ids}})
+            self._process_plans(plans)
+        except Exception, e:
+            logger.error("Error while processing %s plans. Cause: %s" %
+                         (len(plan_ids), e))
+            self._notify_error(e)
+
+        # plans still due (backup in progress or error) or not read: retry
+        # later (removed plans are not returned by the find and are dropped)
+        if plans is not None:
+            plan_ids = [plan.id for plan in plans]
+        retry_date = date_plus_seconds(now, self._sleep_time)
+        for plan_id in plan_ids:
+            if plan_id not in self._plan_heap:
+                self._plan_heap.update(plan_id, retry_date)
 
+    ###########################################################################
+    def _process_plans(self, plans):
+        """
+        Processes the specified due plans in batch:
+            1- Plans with no next occurrence only get it set
+            2- Plans with a backup in progress are skipped
+            3- Plans whose next occurrence is now or in the past get a new
+               backup scheduled
+        In progress backups are checked with a single query and new backups
+        are scheduled with bulk writes (see schedule_new_backups)
         """
         now = date_now()
-        q = {"$or": [
-                {"nextOccurrence": {"$exists": False}},
-                {"nextOccurrence": None},
-                {"nextOccurrence": {"$lte": now}}
-            ]
-        }
+        in_progress_plan_ids = self._get_plans_with_backup_in_progress(plans)
 
+        new_plans = []
+        due_plans = []
+        for plan in plans:
+            self.debug("Validating plan '%s'" % plan._id)
+            errors = plan.validate()
+            if errors:
+                err_msg = ("Plan '%s' is invalid.Please correct the following"
+                           " errors.\n%s" % (plan.id, errors))
+                logger.error(err_msg)
+                self._notify_error(InvalidPlanError(err_msg))
+                # TODO disable plan ???
+                continue
+
+            # CASE I: First time <==> No previous backups
+            # Only set the next occurrence here
+            if not plan.next_occurrence:
+                self.info("Plan '%s' has no previous backup. Setting next"
+                          " occurrence" % plan._id)
+                new_plans.append(plan)
+
+            # CASE II: If there is a backup running (IN PROGRESS)
+            # ===> no op
+            elif plan.id in in_progress_plan_ids:
+                self.info("Plan '%s' has a backup that is currently in"
+                          " progress. Nothing to do now." % plan._id)
+            # CASE III: if time now is past the next occurrence
+            elif plan.next_occurrence <= now:
+                self.info("Plan '%s' next occurrence '%s' is greater than"
+                          " now. Scheduling a backup!!!" %
+                          (plan._id, plan.next_occurrence))
+                due_plans.append(plan)
+            else:
+                self.info("Wooow. How did you get here!!!! Plan '%s' does"
+                          " not to be scheduled yet. next occurrence %s " %
+                          (plan._id, plan.next_occurrence))
+
+        if new_plans:
+            self._advance_plans_next_occurrence(new_plans)
+            self._save_plans_next_occurrence(new_plans)
 
-        return get_mbs().plan_collection.find(q)
+        self.schedule_new_backups(due_plans)
 
     ###########################################################################
-    def _plan_has_backup_in_progress(self, plan):
+    def _get_plans_with_backup_in_progress(self, plans):
+        """
+            Returns the set of ids of the specified plans that have a backup
+            in progress
+        """
+        if not plans:
+            return set()
+
         q = {
-            "plan.$id": plan._id,
+            "plan._id": {"$in": [plan.id for plan in plans]},
             "state": STATE_IN_PROGRESS
         }
-        return get_mbs().backup_collection.find_one(q) is not None
+        fields = {"_id": 0, "plan._id": 1}
+        backup_docs = get_mbs().backup_collection.find_documents(q,
+                                                                 fields=fields)
+        return set(doc["plan"]["_id"] for doc in backup_docs)
 
     ###########################################################################
     def _cancel_past_cycle_scheduled_backups(self):
@@ -286,13 +448,11 @@ class BackupSystem(Thread):
         """
 
         # select backups whose last log date is at least RESCHEDULE_PERIOD ago
-
-        where = ("(this.logs[this.logs.length-1].date.getTime() + %s) < "
-                 "new Date().getTime()" % RESCHEDULE_PERIOD_MILLS)
+        # (rescheduleAfter is maintained with every logged event)
         q = {
             "state": STATE_FAILED,
             "reschedulable": True,
-            "$where": where
+            "rescheduleAfter": {"$lt": date_now()}
         }
 
         for backup in get_mbs().backup_collection.find(q):
@@ -338,10 +498,14 @@ class BackupSystem(Thread):
         # if from_scratch is set then clear backup log
         if from_scratch:
             backup.logs = []
+            backup.logged_events = []
+            backup.error_count = 0
+            backup.warning_count = 0
             backup.try_count = 0
             backup.engine_guid = None
-            bc.update_task(backup, properties=["logs", "tryCount",
-                                               "engineGuid"])
+            bc.update_task(backup, properties=["logs", "loggedEvents",
+                                               "errorCount", "warningCount",
+                                               "tryCount", "engineGuid"])
 
         bc.update_task(backup, properties=["state", "tags"],
                        event_name=EVENT_STATE_CHANGE,
@@ -351,6 +515,58 @@ class BackupSystem(Thread):
     def schedule_new_backup(self, plan, one_time=False):
         self.info("Scheduling plan '%s'" % plan._id)
 
+        if one_time:
+            backup = self._build_backup(plan)
+        else:
+            plan_occurrence = self._get_plan_occurrence(plan)
+            self._advance_plans_next_occurrence([plan])
+            self._save_plans_next_occurrence([plan])
+            backup = self._build_backup(plan, plan_occurrence=plan_occurrence)
+
+        backup_doc = backup.to_document()
+        get_mbs().backup_collection.save_document(backup_doc)
+        # set the backup id from the saved doc
+        backup.id = backup_doc["_id"]
+
+        self.info("Scheduled backup \n%s" % backup)
+        return backup
+
+    ###########################################################################
+    def schedule_new_backups(self, plans):
+        """
+            Schedules a backup for each of the specified plans. Plans next
+            occurrences are advanced with one update per distinct next
+            occurrence and backups are inserted in bulk
+        """
+        if not plans:
+            return []
+
+        self.info("Scheduling %s plans" % len(plans))
+        plan_occurrences = [self._get_plan_occurrence(plan) for plan in plans]
+        self._advance_plans_next_occurrence(plans)
+        self._save_plans_next_occurrence(plans)
+
+        backups = [self._build_backup(plan, plan_occurrence=plan_occurrence)
+                   for plan, plan_occurrence in zip(plans, plan_occurrences)]
+
+        backup_docs = [backup.to_document() for backup in backups]
+        get_mbs().backup_collection.insert_documents(
+            backup_docs, batch_size=BACKUP_INSERT_BATCH_SIZE)
+
+        # set the backup ids from the inserted docs
+        for backup, backup_doc in zip(backups, backup_docs):
+            backup.id = backup_doc["_id"]
+
+        self.info("Scheduled %s backups" % len(backups))
+        return backups
+
+    ###########################################################################
+    def _build_backup(self, plan, plan_occurrence=None):
+        """
+            Builds a new scheduled backup for the plan. The backup is attached
+            to the plan only if plan_occurrence is specified (i.e. not a one
+            time backup)
+        """
         backup = Backup()
         backup.created_date = date_now()
         backup.strategy = plan.strategy
@@ -359,28 +575,83 @@ class BackupSystem(Thread):
         backup.tags = plan.generate_tags()
         backup.priority = plan.priority
         backup.change_state(STATE_SCHEDULED)
-        if not one_time:
-            backup.plan_occurrence = plan.next_occurrence
-            self._set_plan_next_occurrence(plan)
+        if plan_occurrence:
+            backup.plan_occurrence = plan_occurrence
             backup.plan = plan
-        backup_doc = backup.to_document()
-        get_mbs().backup_collection.save_document(backup_doc)
-        # set the backup id from the saved doc
-        backup.id = backup_doc["_id"]
+        backup.due_alert_at = backup_due_alert_at(backup)
 
-        self.info("Scheduled backup \n%s" % backup)
         return backup
 
     ###########################################################################
-    def _set_plan_next_occurrence(self, plan):
-        plan.next_occurrence = plan.next_natural_occurrence()
-        q = {"_id": plan.id}
-        u = {
-            "$set": {
-                "nextOccurrence": plan.next_occurrence
+    def _get_plan_occurrence(self, plan):
+        """
+            Returns the natural occurrence that the plan's next occurrence
+            stands for (they differ when load leveling is on)
+        """
+        return plan.schedule.last_natural_occurrence(plan.next_occurrence)
+
+    ###########################################################################
+    def _advance_plans_next_occurrence(self, plans):
+        """
+            Sets (in memory only) the next occurrence of the specified plans
+            to their next natural occurrence, leveled according to the load
+            leveling policy if any
+        """
+        policy = self.load_leveling_policy
+        durations = {}
+        if policy and plans:
+            durations = self._get_expected_durations(plans, policy)
+
+        for plan in plans:
+            next_occurrence = plan.next_natural_occurrence()
+            if policy:
+                next_occurrence = policy.level_occurrence(
+                    plan, next_occurrence,
+                    expected_duration=durations.get(plan.id))
+            plan.next_occurrence = next_occurrence
+
+    ###########################################################################
+    def _get_expected_durations(self, plans, policy):
+        since = date_minus_seconds(date_now(),
+                                   policy.history_days * 24 * 60 * 60)
+        return get_plans_backup_durations([plan.id for plan in plans], since)
+
+    ###########################################################################
+    def get_load_leveling_report(self, days=1):
+        """
+            Dry run of the load leveling policy (or a default one if none is
+            configured) over all plans for the next days
+        """
+        policy = self.load_leveling_policy or LoadLevelingPolicy()
+        plans = get_mbs().plan_collection.find()
+        durations = self._get_expected_durations(plans, policy)
+        return load_leveling_report(plans, policy,
+                                    expected_durations=durations, days=days)
+
+    ###########################################################################
+    def _save_plans_next_occurrence(self, plans):
+        """
+            Persists the next occurrence of the specified plans. Plans sharing
+            the same next occurrence are updated with a single multi update
+        """
+        plan_ids_by_occurrence = {}
+        for plan in plans:
+            plan_ids = plan_ids_by_occurrence.setdefault(plan.next_occurrence,
+                                                         [])
+            plan_ids.append(plan.id)
+
+        pc = get_mbs().plan_collection
+        for next_occurrence, plan_ids in plan_ids_by_occurrence.items():
+            q = {"_id": {"$in": plan_ids}}
+            u = {
+                "$set": {
+                    "nextOccurrence": next_occurrence
+                }
             }
-        }
-        get_mbs().plan_collection.update(spec=q, document=u)
+            pc.update_documents(q, u)
+
+        for plan in plans:
+            self._plan_heap.update(plan.id, plan.next_occurrence)
 
     ###########################################################################
     def save_plan(self, plan):
@@ -404,7 +675,13 @@ class BackupSystem(Thread):
             else:
                 self.info("Saving new plan: \n%s" % plan)
 
-            get_mbs().plan_collection.save_document(plan.to_document())
+            plan_doc = plan.to_document()
+            get_mbs().plan_collection.save_document(plan_doc)
+            plan.id = plan_doc["_id"]
+
+            # let the scheduler know about the plan's next occurrence
+            self._plan_heap.update(plan.id, plan.next_occurrence)
+            self._wake_up()
 
             self.info("Plan saved successfully")
         except Exception, e:
@@ -415,6 +692,7 @@ class BackupSystem(Thread):
     def remove_plan(self, plan):
         logger.info("Removing plan '%s' " % plan.id)
         get_mbs().plan_collection.remove_by_id(plan.id)
+        self._plan_heap.remove(plan.id)
 
     ###########################################################################
     def delete_backup(self, backup_id):
@@ -452,6 +730,47 @@ class BackupSystem(Thread):
         restore.id = restore_doc["_id"]
         return restore
 
+    ###########################################################################
+    def get_capacity_report(self, days=7, history_days=DEFAULT_HISTORY_DAYS):
+        """
+            Projects engine pools demand over the next days from all plans
+            schedules and their backups of the last history_days
+        """
+        plans = get_mbs().plan_collection.find()
+        since = date_minus_seconds(date_now(), history_days * 24 * 60 * 60)
+        profiles = get_plan_profiles(get_mbs().database,
+                                     [plan.id for plan in plans], since)
+
+        return capacity_report(plans, get_mbs().engines, profiles=profiles,
+                               load_leveling_policy=self.load_leveling_policy,
+                               days=days)
+
+    ###########################################################################
+    def get_index_advisor_report(self, apply=False):
+        """
+            Explains the recorded query shapes and reports the ones doing
+            collection scans or in memory sorts with the proposed indexes.
+            apply: creates the proposed indexes
+        """
+        return IndexAdvisor(get_mbs().database).get_report(apply=apply)
+
+    ###########################################################################
+    def get_audit_summary_report(self, start_date, end_date=None,
+                                 plan_ids=None):
+        """
+            Reports the number of plan occurrences per backup state of the
+            days from start_date to end_date (e.g. a week or a month) from
+            the audit summaries
+        """
+        audit_summary_store = get_mbs().audit_summary_store
+        if audit_summary_store is None:
+            raise MBSError("Audit summaries are not enabled (auditSummaries "
+                           "config option)")
+
+        return audit_summary_store.get_range_report(start_date,
+                                                    end_date=end_date,
+                                                    plan_ids=plan_ids)
+
     ###########################################################################
     def _check_audit(self):
         # TODO Properly run auditors as needed
@@ -507,41 +826,19 @@ class BackupSystem(Thread):
              If backup does not have a plan (i.e. one off)
              then it will check after 60 seconds.
         """
-        # query for backups whose scheduled date is before current date minus
-        # than max starvation time
-
-
-        where = ("(Math.min(%s, (this.plan.schedule.frequencyInSeconds / 2) * 1000) + "
-                    "this.createdDate.getTime()) < new Date().getTime()" %
-                 (MAX_BACKUP_WAIT_TIME * 1000))
-        one_off_starve_date = date_minus_seconds(date_now(),
-                                                 ONE_OFF_BACKUP_MAX_WAIT_TIME)
+        # query for backups whose max starvation time has passed
+        # (dueAlertAt is computed when the backup is scheduled)
         q = {
             "state": STATE_SCHEDULED,
-            "$or":[
-                # backups with plans starving query
-                {
-                    "$and":[
-                        {"plan": {"$exists": True}},
-                        {"$where": where}
-                    ]
-                },
-                # One off backups (no plan) starving query
-                {
-                    "$and":[
-                            {"plan": {"$exists": False}},
-                            {"createdDate": {"$lt": one_off_starve_date}}
-                    ]
-                 }
-            ]
+            "dueAlertAt": {"$lt": date_now()}
         }
 
-        starving_backups = get_mbs().backup_collection.find(q)
+        starving_count = get_mbs().backup_collection.count(q)
 
-        if starving_backups:
+        if starving_count:
             msg = ("You have %s scheduled backups that has past the maximum "
                    "waiting time (%s seconds)." %
-                   (len(starving_backups), MAX_BACKUP_WAIT_TIME))
+                   (starving_count, MAX_BACKUP_WAIT_TIME))
             self.info(msg)
 
 
@@ -564,12 +861,15 @@ class BackupSystem(Thread):
             }
         }
 
-        late_backups = get_mbs().backup_collection.find(q)
+        late_counts = get_mbs().backup_collection.count_by("engineGuid", q)
 
-        if late_backups:
+        if late_counts:
             msg = ("You have %s in-progress backups that has been running for"
-                   " more than the maximum waiting time (%s seconds)." %
-                   (len(late_backups), MAX_BACKUP_WAIT_TIME))
+                   " more than the maximum waiting time (%s seconds).\n%s" %
+                   (sum(late_counts.values()), MAX_BACKUP_WAIT_TIME,
+                    "\n".join("%s: %s" % (engine_guid, count)
+                              for engine_guid, count in
+                              sorted(late_counts.items()))))
             self.info(msg)
 
 
@@ -672,6 +972,7 @@ class BackupSystem(Thread):
         """
         self.info("Stopping backup system gracefully")
         self._stopped = True
+        self._wake_up()
 
     ###########################################################################
     def _do_get_status(self):
@@ -771,6 +1072,19 @@ class BackupSystemCommandServer(Thread):
                 return ("Error while trying to delete backup %s: %s" %
                         (backup_id, e))
 
+        ########## build audit report method
+        @flask_server.route('/audit-report/<audit_id>', methods=['GET'])
+        def audit_report(audit_id):
+            logger.info("Command Server: Received an audit-report command")
+            try:
+                limit = request.args.get("limit")
+                report = backup_system.global_auditor.get_audit_report(
+                    audit_id, limit=limit and int(limit))
+                return document_pretty_string(report)
+            except Exception, e:
+                return ("Error while trying to get audit report %s: %s" %
+                        (audit_id, e))
+
         ########## build restore method
         @flask_server.route('/restore-backup', methods=['POST'])
         def restore_backup():
@@ -790,6 +1104,44 @@ class BackupSystemCommandServer(Thread):
                         (backup_id, e))
 
 
+        ########## build capacity report method
+        @flask_server.route('/capacity-report', methods=['GET'])
+        def capacity_report():
+            logger.info("Command Server: Received a capacity-report command")
+            try:
+                days = int(request.args.get("days", 7))
+                report = backup_system.get_capacity_report(days=days)
+                return document_pretty_string(report)
+            except Exception, e:
+                return "Error while trying to get capacity report: %s" % e
+
+        ########## build index advisor method
+        @flask_server.route('/index-advisor', methods=['GET'])
+        def index_advisor():
+            logger.info("Command Server: Received an index-advisor command")
+            try:
+                apply = request.args.get("apply") == "true"
+                report = backup_system.get_index_advisor_report(apply=apply)
+                return document_pretty_string(report)
+            except Exception, e:
+                return "Error while trying to get index advisor report: %s" % e
+
+        ########## build audit summary method
+        @flask_server.route('/audit-summary', methods=['GET'])
+        def audit_summary():
+            logger.info("Command Server: Received an audit-summary command")
+            try:
+                end = request.args.get("end")
+                plan_ids = [objectiditify(plan_id) for plan_id in
+                            request.args.getlist("planId")] or None
+                report = backup_system.get_audit_summary_report(
+                    string_to_datetime(request.args.get("start")),
+                    end_date=end and string_to_datetime(end),
+                    plan_ids=plan_ids)
+                return document_pretty_string(report)
+            except Exception, e:
+                return "Error while trying to get audit summary report: %s" % e
+
         ########## build stop-command-server method
         @flask_server.route('/stop-command-server', methods=['GET'])
         def stop_command_server():
@@ -884,6 +1236,22 @@ def expire_backup(backup, expired_date):
         logger.info("Backup %s archived successfully!" % backup.id)
 
 
+###############################################################################
+def backup_due_alert_at(backup):
+    """
+        Returns the date after which a scheduled backup is considered past due:
+        createdDate + min(half the plan's period, MAX_BACKUP_WAIT_TIME) or
+        createdDate + ONE_OFF_BACKUP_MAX_WAIT_TIME for one off backups
+    """
+    if backup.plan:
+        schedule = backup.plan.schedule
+        max_wait = min(MAX_BACKUP_WAIT_TIME,
+                       schedule.max_acceptable_lag(backup.plan_occurrence))
+    else:
+        max_wait = ONE_OFF_BACKUP_MAX_WAIT_TIME
+
+    return date_plus_seconds(backup.created_date, max_wait)
+
 ###########################################################################
 
 def build_backup_source(uri):
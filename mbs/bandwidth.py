@@ -0,0 +1,279 @@
+__author__ = 'abdul'
+
+import time
+import threading
+
+import mbs_logging
+
+from base import MBSObject
+from date_utils import date_now
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+MB = 1024 * 1024
+
+# window (in seconds) over which current consumption rate is measured
+RATE_WINDOW = 10
+
+###############################################################################
+# TokenBucket
+###############################################################################
+class TokenBucket(object):
+    """
+        Thread safe token bucket. Tokens (bytes) are refilled at `rate` per
+        second up to `capacity`. consume() blocks until the requested tokens
+        are available
+    """
+    ###########################################################################
+    def __init__(self, rate, capacity):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+
+    ###########################################################################
+    def consume(self, tokens):
+        """
+            Consumes the specified number of tokens, sleeping as needed.
+            Returns the total time slept
+        """
+        slept = 0
+        while tokens > 0:
+            # never ask for more than the bucket can hold at once
+            amount = min(tokens, self._capacity)
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    tokens -= amount
+                    continue
+                wait = (amount - self._tokens) / self._rate
+
+            time.sleep(wait)
+            slept += wait
+
+        return slept
+
+    ###########################################################################
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._last_refill) *
+                                          self._rate)
+        self._last_refill = now
+
+###############################################################################
+# BandwidthLimiter
+###############################################################################
+class BandwidthLimiter(MBSObject):
+    """
+        Caps transfer throughput at maxRateInMBPS (megabytes per second)
+        using a token bucket that is shared by all threads drawing from this
+        limiter. Throttling is suspended within any of the offPeakWindows
+        ("HH:MM-HH:MM" in UTC, may wrap around midnight)
+    """
+    ###########################################################################
+    def __init__(self):
+        MBSObject.__init__(self)
+        self._max_rate_in_mbps = None
+        self._burst_size_in_mb = None
+        self._off_peak_windows = None
+        self._bucket = None
+        self._lock = threading.Lock()
+
+        # stats
+        self._total_bytes = 0
+        self._total_throttle_time = 0
+        self._window_start = time.time()
+        self._window_bytes = 0
+        self._last_window_rate = 0
+
+    ###########################################################################
+    @property
+    def max_rate_in_mbps(self):
+        return self._max_rate_in_mbps
+
+    @max_rate_in_mbps.setter
+    def max_rate_in_mbps(self, val):
+        self._max_rate_in_mbps = val
+        self._bucket = None
+
+    ###########################################################################
+    @property
+    def burst_size_in_mb(self):
+        """
+            Size of the token bucket. Defaults to one second worth of traffic
+        """
+        return self._burst_size_in_mb or self.max_rate_in_mbps
+
+    @burst_size_in_mb.setter
+    def burst_size_in_mb(self, val):
+        self._burst_size_in_mb = val
+        self._bucket = None
+
+    ###########################################################################
+    @property
+    def off_peak_windows(self):
+        return self._off_peak_windows
+
+    @off_peak_windows.setter
+    def off_peak_windows(self, val):
+        self._off_peak_windows = val
+
+    ###########################################################################
+    @property
+    def bucket(self):
+        if not self._bucket and self.max_rate_in_mbps:
+            self._bucket = TokenBucket(self.max_rate_in_mbps * MB,
+                                       self.burst_size_in_mb * MB)
+        return self._bucket
+
+    ###########################################################################
+    def is_off_peak(self, when=None):
+        if not self.off_peak_windows:
+            return False
+
+        when = when or date_now()
+        now_str = when.strftime("%H:%M")
+        for window in self.off_peak_windows:
+            start, end = [s.strip() for s in window.split("-")]
+            if start <= end:
+                if start <= now_str < end:
+                    return True
+            elif now_str >= start or now_str < end:
+                return True
+
+        return False
+
+    ###########################################################################
+    def throttle(self, nbytes):
+        """
+            Accounts for nbytes transferred and blocks as needed to stay
+            within the configured rate
+        """
+        if nbytes <= 0:
+            return
+
+        slept = 0
+        if self.bucket and not self.is_off_peak():
+            slept = self.bucket.consume(nbytes)
+
+        with self._lock:
+            self._total_bytes += nbytes
+            self._total_throttle_time += slept
+            self._window_bytes += nbytes
+            self._roll_window()
+
+    ###########################################################################
+    def _roll_window(self):
+        elapsed = time.time() - self._window_start
+        if elapsed >= RATE_WINDOW:
+            self._last_window_rate = self._window_bytes / elapsed
+            self._window_bytes = 0
+            self._window_start = time.time()
+
+    ###########################################################################
+    def get_stats(self):
+        with self._lock:
+            self._roll_window()
+            elapsed = time.time() - self._window_start
+            if self._window_bytes and elapsed:
+                rate = self._window_bytes / elapsed
+            elif elapsed < 2 * RATE_WINDOW:
+                rate = self._last_window_rate
+            else:
+                rate = 0
+
+            return {
+                "maxRateInMBPS": self.max_rate_in_mbps,
+                "offPeak": self.is_off_peak(),
+                "currentRateInMBPS": round(float(rate) / MB, 2),
+                "totalBytes": self._total_bytes,
+                "totalThrottleTimeInSeconds": round(self._total_throttle_time,
+                                                    2)
+            }
+
+    ###########################################################################
+    def to_document(self, display_only=False):
+        doc = {
+            "_type": "BandwidthLimiter",
+            "maxRateInMBPS": self.max_rate_in_mbps
+        }
+
+        if self._burst_size_in_mb:
+            doc["burstSizeInMB"] = self._burst_size_in_mb
+
+        if self.off_peak_windows:
+            doc["offPeakWindows"] = self.off_peak_windows
+
+        return doc
+
+###############################################################################
+# ThrottledTransfer
+###############################################################################
+class ThrottledTransfer(object):
+    """
+        Progress callback that draws the bytes transferred since the previous
+        call from a list of limiters. Compatible with boto's
+        cb(transferred, total) and cloudfiles' callback(transferred, total)
+    """
+    ###########################################################################
+    def __init__(self, limiters, callback=None):
+        self._limiters = limiters
+        self._callback = callback
+        self._transferred = 0
+
+    ###########################################################################
+    def __call__(self, transferred, total):
+        delta = transferred - self._transferred
+        self._transferred = transferred
+        for limiter in self._limiters:
+            limiter.throttle(delta)
+
+        if self._callback:
+            self._callback(transferred, total)
+
+###############################################################################
+# Limiter registry
+###############################################################################
+# the engine wide limiter (set by the running engine)
+_engine_limiter = None
+
+# limiters shared by all target objects pointing to the same container
+_shared_limiters = {}
+_shared_limiters_lock = threading.Lock()
+
+###############################################################################
+def set_engine_limiter(limiter):
+    global _engine_limiter
+    _engine_limiter = limiter
+
+###############################################################################
+def get_engine_limiter():
+    return _engine_limiter
+
+###############################################################################
+def get_shared_limiter(key, limiter):
+    """
+        Returns the limiter registered under key. The specified limiter gets
+        registered if none is or the registered one's config differs
+    """
+    with _shared_limiters_lock:
+        registered = _shared_limiters.get(key)
+        if registered is None or registered != limiter:
+            _shared_limiters[key] = limiter
+            registered = limiter
+        return registered
+
+###############################################################################
+def get_shared_limiters_stats():
+    with _shared_limiters_lock:
+        return dict(("%s:%s" % key, limiter.get_stats())
+                    for key, limiter in _shared_limiters.items())
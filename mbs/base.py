@@ -8,6 +8,9 @@ class MBSObject(object):
     """
     Represents The Object class that all MBS objects inherits
     """
+    # no per-instance __dict__ for subclasses that declare __slots__
+    __slots__ = ()
+
     ###########################################################################
     def __init__(self):
         pass
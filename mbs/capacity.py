@@ -0,0 +1,267 @@
+__author__ = 'abdul'
+
+from datetime import timedelta
+
+from task import STATE_SUCCEEDED
+from date_utils import (date_now, date_plus_seconds, date_to_seconds,
+                        timedelta_total_seconds)
+from load_leveling import median_duration, DEFAULT_EXPECTED_DURATION
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+MB = 1024 * 1024
+
+DEFAULT_HISTORY_DAYS = 14
+DEFAULT_RESOLUTION = 60 * 60
+
+DAY_SECONDS = 24 * 60 * 60
+
+# demand metrics tracked for each engine pool
+METRIC_WORKERS = "workers"
+METRIC_TEMP_DISK = "tempDisk"
+METRIC_UPLOAD = "upload"
+METRICS = [METRIC_WORKERS, METRIC_TEMP_DISK, METRIC_UPLOAD]
+
+###############################################################################
+# PlanProfile
+###############################################################################
+class PlanProfile(object):
+    """
+        Resource profile of a plan's backups derived from its recent
+        successful backups: expected duration, source data size (with linear
+        growth) and ratio of uploaded bytes to source data size
+    """
+    ###########################################################################
+    def __init__(self, backup_docs=None):
+        backup_docs = sorted(backup_docs or [], key=lambda d: d["endDate"])
+        self.expected_duration = (median_duration(backup_docs) or
+                                  DEFAULT_EXPECTED_DURATION)
+
+        sized = [doc for doc in backup_docs
+                 if doc.get("sourceStats", {}).get("dataSize")]
+        self.data_size = 0
+        self.data_size_date = None
+        self.growth_per_day = 0
+        self.upload_ratio = 1
+        if sized:
+            last = sized[-1]
+            self.data_size = last["sourceStats"]["dataSize"]
+            self.data_size_date = last["endDate"]
+            self.growth_per_day = _growth_per_day(sized)
+            file_size = last.get("targetReference", {}).get("fileSize")
+            if file_size:
+                self.upload_ratio = float(file_size) / self.data_size
+
+    ###########################################################################
+    def projected_data_size(self, date):
+        if not self.data_size_date:
+            return self.data_size
+        days = timedelta_total_seconds(date - self.data_size_date) / DAY_SECONDS
+        return max(0, self.data_size + self.growth_per_day * days)
+
+    ###########################################################################
+    def projected_upload_rate(self, date):
+        """
+            Average upload rate (bytes/second) over the backup duration
+        """
+        upload_size = self.projected_data_size(date) * self.upload_ratio
+        return upload_size / max(self.expected_duration, 1)
+
+###############################################################################
+def _growth_per_day(sized_docs):
+    """
+        Least squares slope of dataSize (bytes/day)
+    """
+    if len(sized_docs) < 2:
+        return 0
+    xs = [date_to_seconds(doc["endDate"]) / float(DAY_SECONDS)
+          for doc in sized_docs]
+    ys = [float(doc["sourceStats"]["dataSize"]) for doc in sized_docs]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if not var_x:
+        return 0
+    return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+
+###############################################################################
+def get_plan_profiles(database, plan_ids, since):
+    """
+        Returns a dict of plan id => PlanProfile built from the plans backups
+        that succeeded since the specified date. Uses a single query
+    """
+    q = {
+        "plan._id": {"$in": plan_ids},
+        "state": STATE_SUCCEEDED,
+        "endDate": {"$gte": since}
+    }
+    fields = {
+        "_id": 0,
+        "plan._id": 1,
+        "startDate": 1,
+        "endDate": 1,
+        "sourceStats.dataSize": 1,
+        "targetReference.fileSize": 1
+    }
+
+    docs_by_plan = {}
+    for doc in database["backups"].find(q, fields=fields):
+        docs_by_plan.setdefault(doc["plan"]["_id"], []).append(doc)
+
+    return dict((plan_id, PlanProfile(docs))
+                for plan_id, docs in docs_by_plan.items())
+
+###############################################################################
+# Engine pools
+###############################################################################
+def engine_can_process(engine, tags):
+    """
+        Same matching as the engine's task queue processor: tagged engines
+        take backups matching any of their tags, untagged engines take
+        untagged backups
+    """
+    if engine.tags:
+        return any(tags and tags.get(name) == value
+                   for name, value in engine.tags.items())
+    return not tags
+
+###############################################################################
+def get_engine_pools(engines, plans):
+    """
+        Groups plans by the set of engines that can process their backups.
+        Returns a list of (engines, plans); plans that no engine can process
+        are grouped with an empty engine list
+    """
+    pools = {}
+    for plan in plans:
+        tags = plan.generate_tags()
+        pool_engines = [engine for engine in engines
+                        if engine_can_process(engine, tags)]
+        key = tuple(engine.id for engine in pool_engines)
+        pools.setdefault(key, (pool_engines, []))[1].append(plan)
+
+    return pools.values()
+
+###############################################################################
+# Capacity report
+###############################################################################
+def capacity_report(plans, engines, profiles=None, load_leveling_policy=None,
+                    start_date=None, days=7, resolution=DEFAULT_RESOLUTION):
+    """
+        Projects per engine pool demand (concurrent workers, temp disk and
+        upload bandwidth) for the plans natural occurrences (leveled if a
+        policy is specified) over the next days and lists the windows where
+        worker demand exceeds the pool's max workers
+    """
+    profiles = profiles or {}
+    start_date = start_date or date_now()
+    end_date = start_date + timedelta(days=days)
+
+    pool_reports = []
+    for pool_engines, pool_plans in get_engine_pools(engines, plans):
+        intervals = []
+        for plan in pool_plans:
+            profile = profiles.get(plan.id) or PlanProfile()
+            duration = timedelta(seconds=profile.expected_duration)
+            for occurrence in plan.natural_occurrences_between(start_date,
+                                                               end_date):
+                if load_leveling_policy:
+                    occurrence = load_leveling_policy.level_occurrence(
+                        plan, occurrence,
+                        expected_duration=profile.expected_duration)
+                intervals.append((occurrence, occurrence + duration, {
+                    METRIC_WORKERS: 1,
+                    METRIC_TEMP_DISK: profile.projected_data_size(occurrence),
+                    METRIC_UPLOAD: profile.projected_upload_rate(occurrence)
+                }))
+
+        max_workers = sum(engine.max_workers for engine in pool_engines)
+        curve = get_demand_curve(intervals, start_date, end_date,
+                                 resolution=resolution)
+        pool_reports.append(_pool_report(pool_engines, pool_plans,
+                                         max_workers, curve, resolution))
+
+    return {
+        "startDate": start_date,
+        "endDate": end_date,
+        "resolutionInSeconds": resolution,
+        "pools": pool_reports
+    }
+
+###############################################################################
+def get_demand_curve(intervals, start_date, end_date,
+                     resolution=DEFAULT_RESOLUTION):
+    """
+        Returns the peak of each metric within each resolution seconds bucket
+        as a list of (bucket date, {metric: peak}). intervals is a list of
+        (start, end, {metric: demand})
+    """
+    events = []
+    for interval_start, interval_end, demand in intervals:
+        events.append((interval_start, 1, demand))
+        events.append((interval_end, -1, demand))
+    # ends sort before starts at the same date
+    events.sort(key=lambda e: (e[0], e[1]))
+
+    current = dict((metric, 0) for metric in METRICS)
+    curve = []
+    i = 0
+    bucket_start = start_date
+    while bucket_start < end_date:
+        bucket_end = date_plus_seconds(bucket_start, resolution)
+        while i < len(events) and events[i][0] <= bucket_start:
+            _apply_event(current, events[i])
+            i += 1
+        peak = dict(current)
+        while i < len(events) and events[i][0] < bucket_end:
+            _apply_event(current, events[i])
+            for metric in METRICS:
+                peak[metric] = max(peak[metric], current[metric])
+            i += 1
+
+        curve.append((bucket_start, peak))
+        bucket_start = bucket_end
+
+    return curve
+
+###############################################################################
+def _apply_event(current, event):
+    _, sign, demand = event
+    for metric in METRICS:
+        current[metric] += sign * demand.get(metric, 0)
+
+###############################################################################
+def _pool_report(engines, plans, max_workers, curve, resolution):
+    over_capacity = []
+    window = None
+    for date, peak in curve:
+        if engines and peak[METRIC_WORKERS] > max_workers:
+            if not window:
+                window = {"startDate": date, "peakWorkers": 0}
+                over_capacity.append(window)
+            window["endDate"] = date_plus_seconds(date, resolution)
+            window["peakWorkers"] = max(window["peakWorkers"],
+                                        peak[METRIC_WORKERS])
+        else:
+            window = None
+
+    def peak_of(metric):
+        return max([peak[metric] for _, peak in curve] or [0])
+
+    return {
+        "engines": [engine.id for engine in engines],
+        "engineTags": [engine.tags for engine in engines if engine.tags],
+        "maxWorkers": max_workers,
+        "plans": len(plans),
+        "peakWorkers": peak_of(METRIC_WORKERS),
+        "peakTempDiskInMB": round(peak_of(METRIC_TEMP_DISK) / MB, 2),
+        "peakUploadInMBps": round(peak_of(METRIC_UPLOAD) / MB, 2),
+        "overCapacityWindows": over_capacity,
+        "curve": [{
+            "date": date,
+            "workers": peak[METRIC_WORKERS],
+            "tempDiskInMB": round(peak[METRIC_TEMP_DISK] / MB, 2),
+            "uploadInMBps": round(peak[METRIC_UPLOAD] / MB, 2)
+        } for date, peak in curve]
+    }
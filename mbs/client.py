@@ -1,5 +1,7 @@
 __author__ = 'abdul'
 
+import urllib
+
 from netutils import fetch_url_json
 from errors import BackupSystemClientError
 ###############################################################################
@@ -44,6 +46,12 @@ class BackupSystemClient(object):
     def delete_backup(self, backup_id):
         return self._execute_command("delete-backup/%s" % backup_id)
 
+    ###########################################################################
+    def get_audit_report(self, audit_id, limit=None):
+        params = {"limit": limit} if limit else None
+        return self._execute_command("audit-report/%s" % audit_id,
+                                     params=params)
+
     ###########################################################################
     def restore_backup(self, backup_id, destination_uri,
                        source_database_name=None):
@@ -58,6 +66,27 @@ class BackupSystemClient(object):
         return self._execute_command("restore-backup", method="POST",
                                      data=data)
 
+    ###########################################################################
+    def get_capacity_report(self, days=None):
+        params = {"days": days} if days else None
+        return self._execute_command("capacity-report", params=params)
+
+    ###########################################################################
+    def get_index_advisor_report(self, apply=False):
+        params = {"apply": "true"} if apply else None
+        return self._execute_command("index-advisor", params=params)
+
+    ###########################################################################
+    def get_audit_summary_report(self, start, end=None, plan_ids=None):
+        """
+            start/end: days as yyyy.m.d strings
+        """
+        params = [("start", start)]
+        if end:
+            params.append(("end", end))
+        params.extend(("planId", plan_id) for plan_id in plan_ids or [])
+        return self._execute_command("audit-summary", params=params)
+
     ###########################################################################
     # HELPERS
     ###########################################################################
@@ -72,7 +101,8 @@ class BackupSystemClient(object):
             url += "/"
         url += command
 
-        #TODO add params to url
+        if params:
+            url += "?" + urllib.urlencode(params)
         return url
 
     ###########################################################################
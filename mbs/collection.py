@@ -1,66 +1,731 @@
 __author__ = 'abdul'
 
-from task import EVENT_TYPE_INFO
+from threading import Lock, Timer
+
+import mbs_logging
+
+from bson.dbref import DBRef
+from pymongo.collection import Collection
+from task import (EVENT_TYPE_INFO, EVENT_TYPE_ERROR, EVENT_TYPE_WARNING,
+                  MAX_RECENT_LOGS, event_date_fields)
 from utils import listify
+from archive import archive_collection_name
+from hydration import DocumentHydrator, camel_to_snake
+from config_snapshots import with_config_snapshot_field
 from makerpy.object_collection import ObjectCollection
 from mongo_utils import objectiditify
 
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+# max number of seconds task writes can be held in the write buffer
+DEFAULT_WRITE_FLUSH_INTERVAL = 10
+
+# number of locks serializing the flushes of tasks (by task id hash)
+FLUSH_LOCK_COUNT = 64
+
+# properties whose updates are written (with all buffered writes) right away
+DURABLE_PROPERTIES = ["state", "targetReference", "logTargetReference"]
+
+# event summary count property => counted event type
+EVENT_COUNT_PROPERTIES = {
+    "errorCount": EVENT_TYPE_ERROR,
+    "warningCount": EVENT_TYPE_WARNING
+}
+
+# fields identifying an event of the events collection
+EVENT_KEY_FIELDS = ["taskId", "taskCollection", "date", "name", "message"]
+
+# properties maintained with every logged event. A $set of any of them
+# (e.g. clearing logs) overrides previously buffered log entries
+EVENT_LOG_PROPERTIES = (["logs", "loggedEvents"] +
+                        EVENT_COUNT_PROPERTIES.keys())
+
 
 ###############################################################################
 # MBSObjectCollection class
 ###############################################################################
 class MBSObjectCollection(ObjectCollection):
     ###########################################################################
-    def __init__(self, collection, clazz=None, type_bindings=None):
+    def __init__(self, collection, clazz=None, type_bindings=None,
+                 query_recorder=None):
         # call super
         ObjectCollection.__init__(self, collection, clazz=clazz,
                                   type_bindings=type_bindings)
+        # underlying pymongo collection for reads that skip object hydration
+        self._pymongo_collection = collection
+        # QueryShapeRecorder (index advisor)
+        self._query_recorder = query_recorder
+        # all reads are hydrated with precompiled per type hydrators
+        self._maker = DocumentHydrator(type_bindings=type_bindings,
+                                       default_class=clazz)
 
     ###########################################################################
-    def get_by_id(self, task_id):
+    def get_by_id(self, task_id, fields=None, lazy=False):
         task_id = objectiditify(task_id)
         q = {
             "_id": task_id
         }
-        return self.find_one(q)
+        return self.find_one(q, fields=fields, lazy=lazy)
+
+    ###########################################################################
+    def find(self, query=None, sort=None, fields=None, lazy=False,
+             limit=None):
+        """
+            fields: mongo projection. Objects hydrated from a projection are
+                partial and should only be read (e.g. not passed to
+                update_task()).
+            lazy: returns LazyObject proxies that hydrate sub-documents on
+                first access
+        """
+        docs = self.find_documents(query, fields=_with_type_field(fields),
+                                   sort=sort, limit=limit)
+        return [self._make(doc, lazy=lazy) for doc in docs]
+
+    ###########################################################################
+    def find_one(self, query=None, fields=None, lazy=False):
+        result = self.find(query, fields=fields, lazy=lazy, limit=1)
+        if result:
+            return result[0]
+
+    ###########################################################################
+    def find_and_modify(self, query=None, sort=None, update=None, new=False):
+        self._record_query(query, sort=sort)
+        doc = self._pymongo_collection.find_and_modify(query=query, sort=sort,
+                                                       update=update, new=new)
+        if doc:
+            return self._make(doc)
+
+    ###########################################################################
+    def _make(self, doc, lazy=False):
+        self._dereference(doc)
+        if lazy:
+            return LazyObject(self._maker, doc)
+        else:
+            return self._maker.make(doc)
+
+    ###########################################################################
+    def _dereference(self, doc):
+        """
+            Replaces top level DBRefs (e.g. restore's sourceBackup) with the
+            referenced documents. Falls back to the archive collection for
+            documents that have been archived
+        """
+        database = self._pymongo_collection.database
+        for key, value in doc.items():
+            if isinstance(value, DBRef):
+                referenced = database.dereference(value)
+                if referenced is None:
+                    archive = database[archive_collection_name(
+                        value.collection)]
+                    referenced = archive.find_one({"_id": value.id})
+                doc[key] = referenced
+
+    ###########################################################################
+    def count(self, query=None):
+        """
+            Returns the number of documents matching query without fetching
+            them
+        """
+        self._record_query(query)
+        return self._pymongo_collection.find(query).count()
+
+    ###########################################################################
+    def count_by(self, field, query=None):
+        """
+            Returns a dict of field value => number of documents matching
+            query (server side aggregation)
+        """
+        # in-memory stores (simulations) have no usable aggregation framework
+        if not isinstance(self._pymongo_collection, Collection):
+            return self._count_by_client_side(field, query)
+
+        pipeline = [{"$group": {"_id": "$%s" % field, "count": {"$sum": 1}}}]
+        if query:
+            pipeline.insert(0, {"$match": query})
+
+        result = self._pymongo_collection.aggregate(pipeline)
+        return dict((doc["_id"], doc["count"]) for doc in result["result"])
+
+    ###########################################################################
+    def _count_by_client_side(self, field, query):
+        counts = {}
+        for doc in self._pymongo_collection.find(query, fields=[field]):
+            value = doc
+            for key in field.split("."):
+                value = value.get(key) if isinstance(value, dict) else None
+            counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    ###########################################################################
+    def find_documents(self, query=None, fields=None, sort=None, limit=None):
+        """
+            Returns raw documents (no object hydration). fields is a mongo
+            projection
+        """
+        self._record_query(query, sort=sort)
+        cursor = self._pymongo_collection.find(query, fields=fields, sort=sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        return list(cursor)
+
+    ###########################################################################
+    def update_documents(self, query, update):
+        """
+            Applies the update document to all documents matching query
+        """
+        self._record_query(query)
+        self._pymongo_collection.update(query, update, multi=True)
+
+    ###########################################################################
+    def _record_query(self, query, sort=None):
+        if self._query_recorder:
+            self._query_recorder.record(self._pymongo_collection.name, query,
+                                        sort=sort)
+
+    ###########################################################################
+    def find_ids(self, query=None, sort=None, limit=None):
+        docs = self.find_documents(query, fields={"_id": 1}, sort=sort,
+                                   limit=limit)
+        return [doc["_id"] for doc in docs]
+
+###############################################################################
+def _with_type_field(fields):
+    """
+        Makes sure that inclusion projections return the _type field needed
+        for hydration
+    """
+    if fields and 1 in fields.values():
+        fields = dict(fields)
+        fields["_type"] = 1
+    return fields
+
+###############################################################################
+# LazyObject
+###############################################################################
+class LazyObject(object):
+    """
+        Proxy to an object hydrated from a document without its sub-documents
+        (embedded documents and arrays, e.g. logs, plan, sourceStats).
+        A sub-document is hydrated on first access of its property. Calling
+        any method of the object (e.g. to_document()) hydrates all remaining
+        sub-documents first.
+    """
+    ###########################################################################
+    def __init__(self, maker, doc):
+        shallow_doc = {}
+        pending = {}
+        for key, value in doc.items():
+            if isinstance(value, (dict, list)):
+                pending[camel_to_snake(key)] = (key, value)
+            else:
+                shallow_doc[key] = value
+
+        object.__setattr__(self, "_lazy_maker", maker)
+        object.__setattr__(self, "_lazy_type", doc.get("_type"))
+        object.__setattr__(self, "_lazy_pending", pending)
+        object.__setattr__(self, "_lazy_target", maker.make(shallow_doc))
+
+    ###########################################################################
+    def _hydrate(self, name):
+        key, value = self._lazy_pending.pop(name)
+        partial = self._lazy_maker.make({"_type": self._lazy_type, key: value})
+        setattr(self._lazy_target, name, getattr(partial, name))
+
+    ###########################################################################
+    def _hydrate_all(self):
+        for name in self._lazy_pending.keys():
+            self._hydrate(name)
+
+    ###########################################################################
+    def __getattr__(self, name):
+        # only called for attributes not found on the proxy itself
+        if name in self._lazy_pending:
+            self._hydrate(name)
+        elif self._lazy_pending and _is_method(self._lazy_target, name):
+            self._hydrate_all()
+
+        return getattr(self._lazy_target, name)
+
+    ###########################################################################
+    def export_property(self, name, display_only=False):
+        # only hydrate the exported property
+        prop = camel_to_snake(name)
+        if prop in self._lazy_pending:
+            self._hydrate(prop)
+        return self._lazy_target.export_property(name,
+                                                 display_only=display_only)
+
+    ###########################################################################
+    def __setattr__(self, name, value):
+        self._lazy_pending.pop(name, None)
+        setattr(self._lazy_target, name, value)
+
+    ###########################################################################
+    @property
+    def __class__(self):
+        # make isinstance() checks see the proxied object's class
+        return self._lazy_target.__class__
+
+    ###########################################################################
+    def __str__(self):
+        self._hydrate_all()
+        return str(self._lazy_target)
+
+    ###########################################################################
+    def __repr__(self):
+        self._hydrate_all()
+        return repr(self._lazy_target)
+
+###############################################################################
+def _is_method(obj, name):
+    attr = getattr(type(obj), name, None)
+    return callable(attr) and not isinstance(attr, property)
 
 
 ###############################################################################
 # MBSTaskCollection class
 ###############################################################################
 class MBSTaskCollection(MBSObjectCollection):
+    """
+        Task updates are coalesced per task in a write buffer ($sets are
+        merged and log entries are pushed together) and written when:
+         - a durable property (e.g. state) is updated
+         - an END_* event is logged (checkpoints)
+         - flush=True is passed to update_task() or flush() is called
+         - the task's oldest buffered write is flush_interval seconds old
+        A flush_interval of 0/None disables buffering.
+
+        Task documents only keep their MAX_RECENT_LOGS most recent log
+        entries plus an event summary (loggedEvents, errorCount,
+        warningCount). All log entries are stored in the events collection.
+
+        When a config snapshot store is specified, the plan/source/target/
+        strategy of saved tasks are stored as deduplicated config snapshots
+        and expanded back on read.
+
+        task_collection_name: name tasks are recorded under in the events
+        collection (defaults to the collection's name). Archive collections
+        use the name of the collection their tasks were archived from.
+
+        When an audit summary store is specified, state changes of plan
+        tasks are recorded in their plan's audit summary.
+    """
     ###########################################################################
-    def __init__(self, collection, clazz=None, type_bindings=None):
+    def __init__(self, collection, clazz=None, type_bindings=None,
+                 events_collection=None,
+                 flush_interval=DEFAULT_WRITE_FLUSH_INTERVAL,
+                 config_snapshots=None, query_recorder=None,
+                 task_collection_name=None, audit_summaries=None):
         # call super
         MBSObjectCollection.__init__(self, collection, clazz=clazz,
-                                     type_bindings=type_bindings)
+                                     type_bindings=type_bindings,
+                                     query_recorder=query_recorder)
+        self._events_collection = events_collection
+        self._task_collection_name = task_collection_name or collection.name
+        self._audit_summaries = audit_summaries
+        self._flush_interval = flush_interval
+        self._config_snapshots = config_snapshots
+        # task id => _TaskWriteBuffer
+        self._write_buffers = {}
+        # guards _write_buffers. Never held during database writes
+        self._write_lock = Lock()
+        # serialize the flushes of each task so that its writes are never
+        # reordered
+        self._flush_locks = [Lock() for i in range(FLUSH_LOCK_COUNT)]
+
+    ###########################################################################
+    @property
+    def flush_interval(self):
+        return self._flush_interval
+
+    @flush_interval.setter
+    def flush_interval(self, val):
+        self._flush_interval = val
 
     ###########################################################################
     def update_task(self, task, properties=None, event_name=None,
-                    event_type=EVENT_TYPE_INFO, message=None, details=None):
+                    event_type=EVENT_TYPE_INFO, message=None, details=None,
+                    flush=None):
         """
-            Updates the specified properties of the specified MBSTask object
+            Updates the specified properties of the specified MBSTask object.
+            flush: True to write right away, None to let the write buffer
+            decide
         """
-        task_doc = task.to_document()
-        q = {
-            "_id": task.id
-        }
-
-        u = {}
-        # construct $set operator
+        # construct $set operator. Only the updated properties are serialized
+        set_doc = {}
         if properties:
             properties = listify(properties)
-            u["$set"] = {}
             for prop in properties:
-                u["$set"][prop] = task_doc.get(prop)
-
-
-        # construct the $push
+                set_doc[prop] = task.export_property(prop)
 
+        # construct the log entry to $push
+        log_doc = None
         if event_name or message:
             log_entry = task.log_event(name=event_name, event_type=event_type,
                                        message=message, details=details)
-            u["$push"] = {"logs": log_entry.to_document()}
+            log_doc = log_entry.to_document()
+            set_doc.update(event_date_fields(log_entry))
+
+        if flush is None:
+            flush = _is_durable_write(properties, event_name)
+
+        self._buffer_write(task.id, set_doc, log_doc, flush)
+
+        if self._audit_summaries and "state" in set_doc:
+            self._audit_summaries.record_task(task)
+
+    ###########################################################################
+    def flush(self, task=None):
+        """
+            Writes the buffered updates of the specified task (all tasks if
+            not specified)
+        """
+        with self._write_lock:
+            if task:
+                task_ids = [task.id]
+            else:
+                task_ids = self._write_buffers.keys()
 
+        for task_id in task_ids:
+            self._flush_task_buffer(task_id)
+
+
+    ###########################################################################
+    def find(self, query=None, sort=None, fields=None, lazy=False,
+             limit=None):
+        if self._config_snapshots:
+            fields = with_config_snapshot_field(fields)
+        return MBSObjectCollection.find(self, query, sort=sort, fields=fields,
+                                        lazy=lazy, limit=limit)
+
+    ###########################################################################
+    def _make(self, doc, lazy=False):
+        if self._config_snapshots:
+            self._config_snapshots.expand_document(doc)
+        return MBSObjectCollection._make(self, doc, lazy=lazy)
+
+    ###########################################################################
+    def find_and_modify(self, query=None, sort=None, update=None, new=False):
+        task = MBSObjectCollection.find_and_modify(self, query=query,
+                                                   sort=sort, update=update,
+                                                   new=new)
+        if (task and self._audit_summaries and
+                "state" in (update or {}).get("$set", {})):
+            self._audit_summaries.record_task(task)
+
+        return task
+
+    ###########################################################################
+    def save_document(self, doc):
+        self.normalize_documents([doc])
+        result = MBSObjectCollection.save_document(self, doc)
+        self.save_task_events([doc])
+        self.record_task_states([doc])
+        return result
+
+    ###########################################################################
+    def insert_documents(self, task_docs, batch_size=None):
+        """
+            Inserts new task documents (in batches of batch_size if
+            specified) the same way save_document() saves a single one: config
+            is normalized, log entries are copied to the events collection and
+            states are recorded in the audit summaries. Sets the _id of the
+            documents
+        """
+        if not task_docs:
+            return
+
+        self.normalize_documents(task_docs)
+        batch_size = batch_size or len(task_docs)
+        for i in range(0, len(task_docs), batch_size):
+            self._pymongo_collection.insert(task_docs[i:i + batch_size])
+        self.save_task_events(task_docs)
+        self.record_task_states(task_docs)
+
+    ###########################################################################
+    def record_task_states(self, task_docs):
+        """
+            Records the state of newly inserted task documents in the audit
+            summaries (if any)
+        """
+        if self._audit_summaries:
+            self._audit_summaries.record_documents(task_docs)
+
+    ###########################################################################
+    def normalize_documents(self, task_docs):
+        """
+            Moves (in place) the config of task documents about to be
+            inserted to config snapshots. No-op if there is no config
+            snapshot store
+        """
+        if self._config_snapshots:
+            for doc in task_docs:
+                self._config_snapshots.normalize_document(doc)
+
+    ###########################################################################
+    def save_task_events(self, task_docs):
+        """
+            Copies the log entries of newly inserted task documents to the
+            events collection
+        """
+        for doc in task_docs:
+            self.insert_task_events(doc["_id"], doc.get("logs"))
+
+    ###########################################################################
+    def insert_task_events(self, task_id, log_docs):
+        if self._events_collection is None or not log_docs:
+            return
+
+        self._events_collection.insert(self._event_documents(task_id,
+                                                             log_docs))
+
+    ###########################################################################
+    def upsert_task_events(self, task_id, log_docs):
+        """
+            Idempotent version of insert_task_events(): events are upserted on
+            EVENT_KEY_FIELDS so that events copied by an interrupted run are
+            not copied again
+        """
+        if self._events_collection is None or not log_docs:
+            return
+
+        for event_doc in self._event_documents(task_id, log_docs):
+            q = dict((key, event_doc.get(key)) for key in EVENT_KEY_FIELDS)
+            self._events_collection.update(q, event_doc, upsert=True)
+
+    ###########################################################################
+    def _event_documents(self, task_id, log_docs):
+        task_id = objectiditify(task_id)
+        task_collection = self._task_collection_name
+        event_docs = []
+        for log_doc in log_docs:
+            event_doc = dict(log_doc)
+            event_doc["taskId"] = task_id
+            event_doc["taskCollection"] = task_collection
+            event_docs.append(event_doc)
+
+        return event_docs
+
+    ###########################################################################
+    def get_tasks_events(self, task_ids, event_types=None):
+        """
+            Returns a dict of task id => logged events (EventLogEntry) of the
+            specified tasks, oldest first. Uses a single query
+        """
+        if self._events_collection is None or not task_ids:
+            return {}
+
+        q = {
+            "taskId": {"$in": [objectiditify(task_id)
+                               for task_id in task_ids]},
+            "taskCollection": self._task_collection_name
+        }
+        if event_types:
+            q["eventType"] = {"$in": event_types}
+
+        fields = {"_id": 0, "taskCollection": 0}
+        events = {}
+        for doc in self._events_collection.find(q, fields=fields,
+                                                sort=[("date", 1)]):
+            task_id = doc.pop("taskId")
+            events.setdefault(task_id, []).append(self._maker.make(doc))
+
+        return events
+
+    ###########################################################################
+    def _buffer_write(self, task_id, set_doc, log_doc, flush):
+        with self._write_lock:
+            write_buffer = self._write_buffers.get(task_id)
+            if not write_buffer:
+                write_buffer = _TaskWriteBuffer()
+                self._write_buffers[task_id] = write_buffer
+                if self.flush_interval and not flush:
+                    write_buffer.start_timer(self.flush_interval, self._expire,
+                                             task_id)
+
+            write_buffer.add(set_doc, log_doc)
+
+        if flush or not self.flush_interval:
+            self._flush_task_buffer(task_id)
+
+    ###########################################################################
+    def _expire(self, task_id):
+        # runs in the buffer's timer thread
+        try:
+            self._flush_task_buffer(task_id)
+        except Exception, e:
+            logger.error("Error while flushing buffered writes of task "
+                         "'%s': %s" % (task_id, e))
+
+    ###########################################################################
+    def _flush_task_buffer(self, task_id):
+        """
+            Writes the buffered updates of the task. Updates buffered while
+            writing go to a new buffer. If the write fails, the updates are
+            put back in the task's buffer (before any newer ones) and the
+            buffer timer is re-armed
+        """
+        with self._flush_lock(task_id):
+            with self._write_lock:
+                write_buffer = self._write_buffers.pop(task_id, None)
+                if not write_buffer:
+                    return
+                write_buffer.cancel_timer()
+
+            try:
+                if write_buffer.event_docs:
+                    self.insert_task_events(task_id, write_buffer.event_docs)
+                    # not inserted again if the update fails
+                    write_buffer.clear_event_docs()
+                u = write_buffer.to_update_document()
+                if u:
+                    self.update(spec={"_id": task_id}, document=u)
+            except Exception:
+                self._restore_write_buffer(task_id, write_buffer)
+                raise
+
+    ###########################################################################
+    def _restore_write_buffer(self, task_id, write_buffer):
+        with self._write_lock:
+            newer_buffer = self._write_buffers.get(task_id)
+            if newer_buffer:
+                newer_buffer.cancel_timer()
+                write_buffer.merge(newer_buffer)
+            self._write_buffers[task_id] = write_buffer
+            if self.flush_interval:
+                write_buffer.start_timer(self.flush_interval, self._expire,
+                                         task_id)
+
+    ###########################################################################
+    def _flush_lock(self, task_id):
+        return self._flush_locks[hash(str(task_id)) % FLUSH_LOCK_COUNT]
+
+###############################################################################
+def add_log_entries(u, log_docs):
+    """
+        Adds to update document u the operators that append log_docs to the
+        task's recent logs (capped to MAX_RECENT_LOGS) and maintain its event
+        summary. Event log properties that u already $sets are updated in
+        place instead (mongo does not allow two operators on the same field)
+    """
+    if not log_docs:
+        return u
+
+    set_doc = u.get("$set", {})
+    if "logs" in set_doc:
+        logs = (set_doc["logs"] or []) + log_docs
+        set_doc["logs"] = logs[-MAX_RECENT_LOGS:]
+    else:
+        u.setdefault("$push", {})["logs"] = {
+            "$each": log_docs,
+            "$slice": -MAX_RECENT_LOGS
+        }
+
+    names = []
+    for log_doc in log_docs:
+        name = log_doc.get("name")
+        if name and name not in names:
+            names.append(name)
+
+    if names and "loggedEvents" in set_doc:
+        logged_events = set_doc["loggedEvents"] or []
+        set_doc["loggedEvents"] = logged_events + [name for name in names
+                                                   if name not in
+                                                      logged_events]
+    elif names:
+        u.setdefault("$addToSet", {})["loggedEvents"] = {"$each": names}
+
+    for prop, event_type in EVENT_COUNT_PROPERTIES.items():
+        count = len([log_doc for log_doc in log_docs
+                     if log_doc.get("eventType") == event_type])
+        if not count:
+            continue
+        if prop in set_doc:
+            set_doc[prop] = (set_doc[prop] or 0) + count
+        else:
+            u.setdefault("$inc", {})[prop] = count
+
+    return u
+
+###############################################################################
+def _is_durable_write(properties, event_name):
+    if event_name and event_name.startswith("END_"):
+        return True
+
+    return bool(properties and
+                set(listify(properties)).intersection(DURABLE_PROPERTIES))
+
+###############################################################################
+# _TaskWriteBuffer
+###############################################################################
+class _TaskWriteBuffer(object):
+    """
+        Pending updates of a single task
+    """
+    ###########################################################################
+    def __init__(self):
+        self._set_doc = {}
+        # log entries to append to the task document
+        self._log_docs = []
+        # all buffered log entries (for the events collection)
+        self._event_docs = []
+        self._timer = None
+
+    ###########################################################################
+    @property
+    def event_docs(self):
+        return self._event_docs
+
+    ###########################################################################
+    def add(self, set_doc, log_doc=None):
+        self._set_doc.update(set_doc)
+        # $set values come from the in-memory task which already has the
+        # previously buffered entries
+        if set(set_doc.keys()).intersection(EVENT_LOG_PROPERTIES):
+            self._log_docs = []
+
+        if log_doc:
+            self._log_docs.append(log_doc)
+            self._event_docs.append(log_doc)
+
+    ###########################################################################
+    def merge(self, write_buffer):
+        """
+            Adds the updates of a more recent buffer of the same task
+        """
+        self._set_doc.update(write_buffer._set_doc)
+        if set(write_buffer._set_doc.keys()).intersection(
+                EVENT_LOG_PROPERTIES):
+            self._log_docs = []
+        self._log_docs.extend(write_buffer._log_docs)
+        self._event_docs.extend(write_buffer._event_docs)
+
+    ###########################################################################
+    def clear_event_docs(self):
+        self._event_docs = []
+
+    ###########################################################################
+    def start_timer(self, interval, callback, task_id):
+        self._timer = Timer(interval, callback, [task_id])
+        self._timer.daemon = True
+        self._timer.start()
+
+    ###########################################################################
+    def cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    ###########################################################################
+    def to_update_document(self):
+        u = {}
+        if self._set_doc:
+            u["$set"] = self._set_doc
 
-        self.update(spec=q, document=u)
+        return add_log_entries(u, self._log_docs)
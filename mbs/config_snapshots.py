@@ -0,0 +1,182 @@
+__author__ = 'abdul'
+
+import hashlib
+import json
+
+from collections import OrderedDict
+from threading import Lock
+
+from bson import json_util
+
+from date_utils import date_now
+from errors import MBSError
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+DEFAULT_CACHE_SIZE = 1000
+
+# task properties moved to config snapshots
+CONFIG_PROPERTIES = ["plan", "source", "target", "strategy"]
+
+# plan fields kept in the task document so that queries/indexes on them
+# (e.g. plan._id, plan.nextOccurrence) keep working
+PLAN_REFERENCE_FIELDS = ["_id", "nextOccurrence", "description"]
+
+# plan fields that change between occurrences and are not part of snapshots
+PLAN_VOLATILE_FIELDS = ["nextOccurrence"]
+
+###############################################################################
+# ConfigSnapshotStore
+###############################################################################
+class ConfigSnapshotStore(object):
+    """
+        Deduplicated store of the config (plan, source, target, strategy)
+        embedded in task documents. Snapshots are keyed by the hash of their
+        content so identical configs are stored once. Tasks keep a plan
+        reference (PLAN_REFERENCE_FIELDS) plus the snapshot hash
+        (configSnapshot) and are expanded back on read
+    """
+    ###########################################################################
+    def __init__(self, collection, cache_size=DEFAULT_CACHE_SIZE):
+        self._collection = collection
+        # snapshot hash => config document. Also tells saved snapshots
+        self._cache = LRUCache(cache_size)
+
+    ###########################################################################
+    def save_snapshot(self, config_doc):
+        """
+            Saves the config document (if not already saved) and returns its
+            hash
+        """
+        snapshot_hash = config_hash(config_doc)
+        if self._cache.get(snapshot_hash) is None:
+            self._collection.update({"_id": snapshot_hash}, {
+                "_id": snapshot_hash,
+                "config": config_doc,
+                "createdDate": date_now()
+            }, upsert=True)
+            self._cache.put(snapshot_hash, config_doc)
+
+        return snapshot_hash
+
+    ###########################################################################
+    def get_snapshot(self, snapshot_hash):
+        config_doc = self._cache.get(snapshot_hash)
+        if config_doc is None:
+            snapshot = self._collection.find_one({"_id": snapshot_hash})
+            if not snapshot:
+                raise MBSError("Config snapshot '%s' does not exist" %
+                               snapshot_hash)
+            config_doc = snapshot["config"]
+            self._cache.put(snapshot_hash, config_doc)
+
+        return config_doc
+
+    ###########################################################################
+    def normalize_document(self, task_doc):
+        """
+            Moves the config properties of the task document (in place) to a
+            snapshot
+        """
+        config_doc = {}
+        for prop in CONFIG_PROPERTIES:
+            if prop in task_doc:
+                config_doc[prop] = task_doc.pop(prop)
+
+        if not config_doc:
+            return task_doc
+
+        plan_doc = config_doc.get("plan")
+        if plan_doc:
+            task_doc["plan"] = dict((key, plan_doc[key])
+                                    for key in PLAN_REFERENCE_FIELDS
+                                    if key in plan_doc)
+            config_doc["plan"] = dict((key, value)
+                                      for key, value in plan_doc.items()
+                                      if key not in PLAN_VOLATILE_FIELDS)
+
+        task_doc["configSnapshot"] = self.save_snapshot(config_doc)
+        return task_doc
+
+    ###########################################################################
+    def expand_document(self, task_doc):
+        """
+            Puts back (in place) the config properties of a normalized task
+            document. Properties already in the document win
+        """
+        snapshot_hash = task_doc.pop("configSnapshot", None)
+        if not snapshot_hash:
+            return task_doc
+
+        config_doc = self.get_snapshot(snapshot_hash)
+        for prop, value in config_doc.items():
+            if prop == "plan" and "plan" in task_doc:
+                plan_doc = dict(value)
+                plan_doc.update(task_doc["plan"])
+                task_doc["plan"] = plan_doc
+            elif prop not in task_doc:
+                task_doc[prop] = value
+
+        return task_doc
+
+###############################################################################
+# LRUCache
+###############################################################################
+class LRUCache(object):
+    """
+        Thread safe dict with a max size that evicts least recently used
+        entries
+    """
+    ###########################################################################
+    def __init__(self, max_size):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    ###########################################################################
+    def get(self, key):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+            return value
+
+    ###########################################################################
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    ###########################################################################
+    def __len__(self):
+        return len(self._entries)
+
+###############################################################################
+# HELPERS
+###############################################################################
+def config_hash(config_doc):
+    """
+        Content hash of a config document (independent of key order)
+    """
+    content = json.dumps(config_doc, sort_keys=True,
+                         default=json_util.default)
+    return hashlib.sha1(content).hexdigest()
+
+###############################################################################
+def with_config_snapshot_field(fields):
+    """
+        Adds configSnapshot to inclusive projections on config properties so
+        that they can be expanded
+    """
+    if not fields or not any(fields.values()):
+        return fields
+
+    roots = set(key.split(".")[0] for key in fields.keys())
+    if roots.intersection(CONFIG_PROPERTIES):
+        fields = dict(fields)
+        fields["configSnapshot"] = 1
+
+    return fields
@@ -30,9 +30,13 @@ from date_utils import  timedelta_total_seconds, date_now, date_minus_seconds
 
 from task import (STATE_SCHEDULED, STATE_IN_PROGRESS, STATE_FAILED,
                   STATE_SUCCEEDED, STATE_CANCELED, EVENT_TYPE_ERROR,
-                  EVENT_STATE_CHANGE, state_change_log_entry)
+                  EVENT_STATE_CHANGE, state_change_log_entry,
+                  event_date_fields)
 
 from backup import Backup
+from collection import add_log_entries
+from bandwidth import set_engine_limiter, get_shared_limiters_stats
+from progress import get_active_transfers
 
 ###############################################################################
 # CONSTANTS
@@ -82,6 +86,7 @@ class BackupEngine(Thread):
         self._command_port = command_port
         self._command_server = EngineCommandServer(self)
         self._tags = None
+        self._bandwidth_limiter = None
         self._stopped = False
 
         # create the backup processor
@@ -145,6 +150,18 @@ class BackupEngine(Thread):
         tags = tags or {}
         self._tags = self._resolve_tags(tags)
 
+    ###########################################################################
+    @property
+    def bandwidth_limiter(self):
+        """
+            Optional BandwidthLimiter shared by all workers of this engine
+        """
+        return self._bandwidth_limiter
+
+    @bandwidth_limiter.setter
+    def bandwidth_limiter(self, val):
+        self._bandwidth_limiter = val
+
     ###########################################################################
     @property
     def command_port(self):
@@ -164,6 +181,10 @@ class BackupEngine(Thread):
         else:
             self.info("No tags configured")
 
+        if self.bandwidth_limiter:
+            self.info("Bandwidth limiter: %s" % self.bandwidth_limiter)
+            set_engine_limiter(self.bandwidth_limiter)
+
         ensure_dir(self._temp_dir)
         self._update_pid_file()
         # Start the command server
@@ -330,12 +351,20 @@ class BackupEngine(Thread):
         else:
             status = STATUS_RUNNING
 
+        bandwidth = {
+            "targets": get_shared_limiters_stats()
+        }
+        if self.bandwidth_limiter:
+            bandwidth["engine"] = self.bandwidth_limiter.get_stats()
+
         return {
             "status": status,
             "workers": {
                 "backups": self._backup_processor._worker_count,
                 "restores": self._restore_processor._worker_count
-            }
+            },
+            "bandwidth": bandwidth,
+            "transfers": get_active_transfers()
         }
 
     ###########################################################################
@@ -402,6 +431,8 @@ class TaskQueueProcessor(Thread):
                            (e, traceback.format_exc()))
                 self._engine._notify_error(e)
 
+        # write any buffered task updates
+        self._task_collection.flush()
         self.info("Exited main loop")
 
     ###########################################################################
@@ -509,7 +540,7 @@ class TaskQueueProcessor(Thread):
 
         total_crashed = 0
         msg = ("Engine crashed while task was in progress. Failing...")
-        for task in self._task_collection.find(q):
+        for task in self._task_collection.find(q, lazy=True):
             # fail task
             self.info("Recovery: Failing task %s" % task._id)
             task.reschedulable = True
@@ -535,9 +566,11 @@ class TaskQueueProcessor(Thread):
 
         log_entry = state_change_log_entry(STATE_IN_PROGRESS)
         q = self._get_scheduled_tasks_query()
+        log_doc = log_entry.to_document()
         u = {"$set" : { "state" : STATE_IN_PROGRESS,
-                        "engineGuid": self._engine.engine_guid},
-             "$push": {"logs":log_entry.to_document()}}
+                        "engineGuid": self._engine.engine_guid}}
+        u["$set"].update(event_date_fields(log_entry))
+        add_log_entries(u, [log_doc])
 
         # sort by priority except every third tick, we sort by created date to
         # avoid starvation
@@ -549,6 +582,8 @@ class TaskQueueProcessor(Thread):
         c = self._task_collection
 
         task = c.find_and_modify(query=q, sort=s, update=u, new=True)
+        if task:
+            c.insert_task_events(task.id, [log_doc])
 
         return task
 
@@ -574,14 +609,17 @@ class TaskQueueProcessor(Thread):
 
         msg = "Task failed and is past due. Cancelling..."
         log_entry = state_change_log_entry(STATE_CANCELED, message=msg)
-        u = {"$set" : { "state" : STATE_CANCELED},
-             "$push": {
-                 "logs": log_entry.to_document()
-             }
-        }
+        log_doc = log_entry.to_document()
+        u = {"$set" : { "state" : STATE_CANCELED}}
+        u["$set"].update(event_date_fields(log_entry))
+        add_log_entries(u, [log_doc])
 
-        return self._task_collection.find_and_modify(query=q, update=u,
+        task = self._task_collection.find_and_modify(query=q, update=u,
                                                      new=True)
+        if task:
+            self._task_collection.insert_task_events(task.id, [log_doc])
+
+        return task
 
     ###########################################################################
     def _get_scheduled_tasks_query(self):
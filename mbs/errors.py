@@ -308,6 +308,27 @@ class UploadedFileSizeMatchError(TargetUploadError, RetriableError):
                          (destination_path, container_name, dest_size,
                           file_size))
 
+###############################################################################
+class CompositeTargetPartialUploadError(TargetUploadError, RetriableError):
+    """
+        Raised when an upload to a composite target succeeded for some of the
+        child targets only. target_reference holds the references of the
+        uploads that succeeded so that they can be resumed from
+    """
+    ###########################################################################
+    def __init__(self, destination_path, container_name, target_reference,
+                 failures):
+        TargetUploadError.__init__(self, destination_path, container_name)
+        self._target_reference = target_reference
+        self._details = ("Upload of '%s' failed for %s target(s): %s" %
+                         (destination_path, len(failures),
+                          "; ".join(str(f) for f in failures)))
+
+    ###########################################################################
+    @property
+    def target_reference(self):
+        return self._target_reference
+
 ###############################################################################
 class TargetDeleteError(TargetError, RetriableError):
     pass
@@ -0,0 +1,154 @@
+__author__ = 'abdul'
+
+import re
+
+from makerpy.maker import Maker, resolve_class
+
+import mbs_logging
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# DocumentHydrator
+###############################################################################
+class DocumentHydrator(object):
+    """
+        Builds objects from documents with the same type bindings and
+        conventions as makerpy's Maker (camelCase document keys => snake_case
+        properties) but with a hydrator precompiled per registered _type:
+        classes are resolved once and document keys are mapped straight onto
+        the class's property setters. Classes that define
+        from_document(doc, hydrator) build themselves.
+        Types that cannot be resolved go through the generic Maker
+    """
+    ###########################################################################
+    def __init__(self, type_bindings=None, default_class=None):
+        self._maker = Maker(type_bindings=type_bindings)
+        self._default_hydrator = (default_class and
+                                  _ClassHydrator(default_class))
+        # _type => _ClassHydrator
+        self._hydrators = {}
+        for type_name, class_path in (type_bindings or {}).items():
+            try:
+                clazz = resolve_class(class_path)
+            except Exception, e:
+                logger.warning("DocumentHydrator: Could not resolve '%s' "
+                               "(%s). Falling back to the generic maker" %
+                               (class_path, e))
+                continue
+            self._hydrators[type_name] = _ClassHydrator(clazz)
+
+    ###########################################################################
+    def make(self, doc):
+        if "_type" in doc:
+            hydrator = self._hydrators.get(doc["_type"])
+        else:
+            hydrator = self._default_hydrator
+
+        if hydrator:
+            return hydrator.hydrate(doc, self)
+        else:
+            return self._maker.make(doc)
+
+    ###########################################################################
+    def make_value(self, value):
+        if isinstance(value, dict):
+            if "_type" in value:
+                return self.make(value)
+            else:
+                return dict((key, self.make_value(val))
+                            for key, val in value.iteritems())
+        elif isinstance(value, list):
+            return [self.make_value(val) for val in value]
+        else:
+            return value
+
+###############################################################################
+# _ClassHydrator
+###############################################################################
+class _ClassHydrator(object):
+    """
+        Hydrator of a single class. Setters are looked up once per document
+        key
+    """
+    ###########################################################################
+    def __init__(self, clazz):
+        self._clazz = clazz
+        # only if declared by the class itself (not by a base class)
+        self._from_document = None
+        if "from_document" in vars(clazz):
+            self._from_document = clazz.from_document
+        # property name => setter
+        self._property_setters = {}
+        for klass in reversed(clazz.__mro__):
+            for name, attr in vars(klass).items():
+                if isinstance(attr, property) and attr.fset:
+                    self._property_setters[name] = attr.fset
+        # document key => setter
+        self._setters = {}
+
+    ###########################################################################
+    def hydrate(self, doc, hydrator):
+        if self._from_document:
+            return self._from_document(doc, hydrator)
+
+        obj = self._clazz()
+        setters = self._setters
+        for key, value in doc.iteritems():
+            if key == "_type":
+                continue
+            setter = setters.get(key)
+            if setter is None:
+                setter = self._compile_setter(key)
+            setter(obj, hydrator.make_value(value))
+
+        return obj
+
+    ###########################################################################
+    def _compile_setter(self, key):
+        attr = camel_to_snake(key)
+        setter = self._property_setters.get(attr)
+        if setter is None and _accepts_attribute(self._clazz, attr):
+            setter = lambda obj, value: setattr(obj, attr, value)
+        elif setter is None:
+            # e.g. keys of older documents that are no longer declared by
+            # classes with __slots__ (and no __dict__)
+            logger.debug("DocumentHydrator: Ignoring '%s' of %s documents" %
+                         (key, self._clazz.__name__))
+            setter = _ignore_value
+        self._setters[key] = setter
+        return setter
+
+###############################################################################
+# HELPERS
+###############################################################################
+def _accepts_attribute(clazz, attr):
+    """
+        Whether attr can be set on instances of clazz: declared by the class
+        (e.g. a slot) or instances have a __dict__
+    """
+    if hasattr(clazz, attr):
+        return True
+    for klass in clazz.__mro__[:-1]:
+        slots = vars(klass).get("__slots__")
+        if slots is None or "__dict__" in slots:
+            return True
+    return False
+
+###############################################################################
+def _ignore_value(obj, value):
+    pass
+
+###############################################################################
+_FIRST_CAP_RE = re.compile("(.)([A-Z][a-z]+)")
+_ALL_CAP_RE = re.compile("([a-z0-9])([A-Z])")
+
+def camel_to_snake(key):
+    """
+        camelCase document key => snake_case property name
+        (e.g. backupRateInMBPS => backup_rate_in_mbps)
+    """
+    return _ALL_CAP_RE.sub(r"\1_\2", _FIRST_CAP_RE.sub(r"\1_\2", key)).lower()
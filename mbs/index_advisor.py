@@ -0,0 +1,236 @@
+__author__ = 'abdul'
+
+import hashlib
+import json
+
+from threading import Lock
+
+from bson import json_util
+
+import mbs_logging
+
+from date_utils import date_now
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+# operators whose fields are used as range bounds when proposing indexes
+RANGE_OPERATORS = ["$lt", "$lte", "$gt", "$gte", "$ne", "$nin", "$exists"]
+
+###############################################################################
+# QueryShapeRecorder
+###############################################################################
+class QueryShapeRecorder(object):
+    """
+        Records the distinct query shapes (query structure with values
+        stripped + sort) issued against mbs collections in the query_shapes
+        collection. A sample query is kept with each shape so that it can be
+        explained. Each shape is written once per process
+    """
+    ###########################################################################
+    def __init__(self, collection):
+        self._collection = collection
+        self._recorded_shapes = set()
+        self._lock = Lock()
+
+    ###########################################################################
+    def record(self, collection_name, query, sort=None):
+        shape = {
+            "collection": collection_name,
+            "query": query_shape(query or {}),
+            "sort": _sort_spec(sort)
+        }
+        shape_id = hashlib.sha1(json.dumps(shape, sort_keys=True)).hexdigest()
+
+        with self._lock:
+            if shape_id in self._recorded_shapes:
+                return
+            self._recorded_shapes.add(shape_id)
+
+        try:
+            # queries have $ keys so they are stored as json
+            self._collection.update({"_id": shape_id}, {
+                "$set": {
+                    "collection": collection_name,
+                    "shape": json.dumps(shape["query"], sort_keys=True),
+                    "query": json_util.dumps(query or {}),
+                    "sort": shape["sort"],
+                    "lastSeenDate": date_now()
+                }
+            }, upsert=True)
+        except Exception, e:
+            logger.error("QueryShapeRecorder: Error while recording query "
+                         "shape of %s: %s" % (collection_name, e))
+
+###############################################################################
+# IndexAdvisor
+###############################################################################
+class IndexAdvisor(object):
+    """
+        Explains recorded query shapes and reports the ones that scan whole
+        collections (COLLSCAN) or sort in memory. Proposes an index for each
+        (equality fields, then sort fields, then range fields) and optionally
+        creates it
+    """
+    ###########################################################################
+    def __init__(self, database, shapes_collection_name="query_shapes"):
+        self._database = database
+        self._shapes_collection = database[shapes_collection_name]
+
+    ###########################################################################
+    def get_report(self, apply=False):
+        shape_docs = list(self._shapes_collection.find(
+            sort=[("collection", 1), ("shape", 1)]))
+
+        problems = []
+        for shape_doc in shape_docs:
+            entry = self.explain_shape(shape_doc)
+            if not (entry["collectionScan"] or entry["inMemorySort"]):
+                continue
+
+            if apply and entry["proposedIndex"]:
+                logger.info("IndexAdvisor: Creating index %s on '%s'" %
+                            (entry["proposedIndex"], entry["collection"]))
+                collection = self._database[entry["collection"]]
+                collection.ensure_index(entry["proposedIndex"])
+                entry["indexCreated"] = True
+
+            problems.append(entry)
+
+        return {
+            "queryShapeCount": len(shape_docs),
+            "problemCount": len(problems),
+            "problems": problems
+        }
+
+    ###########################################################################
+    def explain_shape(self, shape_doc):
+        query = json_util.loads(shape_doc["query"])
+        sort = [tuple(spec) for spec in shape_doc.get("sort") or []] or None
+        collection = self._database[shape_doc["collection"]]
+        explain = collection.find(query, sort=sort).limit(1).explain()
+        stages = explain_stages(explain)
+
+        entry = {
+            "collection": shape_doc["collection"],
+            "shape": shape_doc["shape"],
+            "sort": shape_doc.get("sort"),
+            "collectionScan": "COLLSCAN" in stages,
+            "inMemorySort": "SORT" in stages,
+            "nscanned": explain.get("nscanned"),
+            "n": explain.get("n"),
+            "proposedIndex": None
+        }
+
+        if entry["collectionScan"] or entry["inMemorySort"]:
+            index = propose_index(query, sort)
+            if index and not _has_index(collection, index):
+                entry["proposedIndex"] = index
+
+        return entry
+
+###############################################################################
+# HELPERS
+###############################################################################
+def query_shape(query):
+    """
+        Query with its values replaced by 1. Operators, $or/$and clauses and
+        field names are kept
+    """
+    if isinstance(query, dict):
+        shape = {}
+        for key, value in query.items():
+            if key in ["$or", "$and", "$nor"]:
+                shape[key] = [query_shape(clause) for clause in value]
+            elif isinstance(value, dict) and _is_operator_doc(value):
+                shape[key] = dict((op, 1) for op in value.keys())
+            else:
+                shape[key] = 1
+        return shape
+    else:
+        return 1
+
+###############################################################################
+def explain_stages(explain):
+    """
+        Returns the set of plan stages of an explain() output. Legacy (2.x)
+        explain outputs are mapped to stages: BasicCursor => COLLSCAN,
+        scanAndOrder => SORT
+    """
+    stages = set()
+    if "queryPlanner" in explain:
+        _collect_stages(explain["queryPlanner"].get("winningPlan"), stages)
+    else:
+        plans = explain.get("clauses") or [explain]
+        for plan in plans:
+            if plan.get("cursor", "").startswith("BasicCursor"):
+                stages.add("COLLSCAN")
+            if plan.get("scanAndOrder"):
+                stages.add("SORT")
+        if explain.get("scanAndOrder"):
+            stages.add("SORT")
+
+    return stages
+
+###############################################################################
+def _collect_stages(plan, stages):
+    if not plan:
+        return
+    stages.add(plan.get("stage"))
+    _collect_stages(plan.get("inputStage"), stages)
+    for input_stage in plan.get("inputStages") or []:
+        _collect_stages(input_stage, stages)
+
+###############################################################################
+def propose_index(query, sort=None):
+    """
+        Index for query/sort: equality fields, then sort fields, then range
+        fields. Fields only used within $or clauses are left out
+    """
+    equality_fields = []
+    range_fields = []
+    for field, value in query.items():
+        if field.startswith("$"):
+            continue
+        if (isinstance(value, dict) and _is_operator_doc(value) and
+                set(value.keys()).intersection(RANGE_OPERATORS)):
+            range_fields.append(field)
+        else:
+            equality_fields.append(field)
+
+    index = [(field, 1) for field in sorted(equality_fields)]
+    for field, direction in sort or []:
+        if field not in equality_fields:
+            index.append((field, direction))
+    for field in sorted(range_fields):
+        if field not in dict(index):
+            index.append((field, 1))
+
+    return index
+
+###############################################################################
+def _has_index(collection, index):
+    """
+        Whether the collection has an index with the specified key prefix
+    """
+    for index_info in collection.index_information().values():
+        key = [(field, direction) for field, direction in index_info["key"]]
+        if key[:len(index)] == index:
+            return True
+    return False
+
+###############################################################################
+def _is_operator_doc(value):
+    return value and all(key.startswith("$") for key in value.keys())
+
+###############################################################################
+def _sort_spec(sort):
+    """
+        Sort as a storable list of [field, direction]
+    """
+    return [[field, direction] for field, direction in sort or []]
@@ -14,9 +14,24 @@ MBS_INDEXES = {
         },
             {
             "index": [('state', ASCENDING), ('plan.$id', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('plan._id', ASCENDING)]
         },
             {
             "index": [('state', ASCENDING), ('engineGuid', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('priority', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('createdDate', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('rescheduleAfter', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('dueAlertAt', ASCENDING)]
         },
             {
             "index": [('plan.description', ASCENDING)]
@@ -32,18 +47,52 @@ MBS_INDEXES = {
             "index": [ ('plan._id', ASCENDING), ('targetReference', ASCENDING),
                        ('createdDate', DESCENDING),
                        ('targetReference.expiredDate', ASCENDING) ]
+        },
+            {
+            "index": [('plan._id', ASCENDING), ('startDate', ASCENDING)]
         }
     ],
 
     "plans":[
         {
             "index":[('source._type', ASCENDING)]
+        },
+        {
+            "index":[('nextOccurrence', ASCENDING)]
         }
     ],
 
     "restores":[
             {
             "index": [('state', ASCENDING), ('engineGuid', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('priority', ASCENDING)]
+        },
+            {
+            "index": [('state', ASCENDING), ('createdDate', ASCENDING)]
+        }
+    ],
+
+    "audit_entries":[
+            {
+            "index": [('auditId', ASCENDING), ('_id', ASCENDING)]
+        }
+    ],
+
+    "audit_summaries":[
+            {
+            "index": [('date', ASCENDING), ('planId', ASCENDING)]
+        }
+    ],
+
+    "task_events":[
+            {
+            "index": [('taskId', ASCENDING), ('date', ASCENDING)]
+        },
+            {
+            "index": [('taskId', ASCENDING), ('eventType', ASCENDING),
+                      ('date', ASCENDING)]
         }
     ]
 }
@@ -0,0 +1,235 @@
+__author__ = 'abdul'
+
+import hashlib
+
+from datetime import timedelta
+
+from base import MBSObject
+from date_utils import date_now, date_plus_seconds, timedelta_total_seconds
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+# expected duration of plans with no backup history (1 hour)
+DEFAULT_EXPECTED_DURATION = 60 * 60
+
+###############################################################################
+# LoadLevelingPolicy
+###############################################################################
+class LoadLevelingPolicy(MBSObject):
+    """
+        Spreads plan occurrences over a per-plan window to flatten the load
+        of plans that share the same natural occurrences (e.g. midnight).
+        A plan's occurrence is delayed by a stable fraction (derived from the
+        plan id hash) of its window. The window is lagRatio * the schedule's
+        max acceptable lag, minus the plan's expected backup duration (so that
+        the backup is still expected to complete within the lag), capped by
+        maxSpreadInSeconds and by the next natural occurrence (cron schedules
+        can have uneven periods)
+    """
+    ###########################################################################
+    def __init__(self):
+        MBSObject.__init__(self)
+        self._max_spread_in_seconds = None
+        self._lag_ratio = 0.5
+        self._history_days = 7
+
+    ###########################################################################
+    @property
+    def max_spread_in_seconds(self):
+        return self._max_spread_in_seconds
+
+    @max_spread_in_seconds.setter
+    def max_spread_in_seconds(self, val):
+        self._max_spread_in_seconds = val
+
+    ###########################################################################
+    @property
+    def lag_ratio(self):
+        """
+            Ratio of the schedule's max acceptable lag that can be used for
+            spreading (0 to 1)
+        """
+        return self._lag_ratio
+
+    @lag_ratio.setter
+    def lag_ratio(self, val):
+        self._lag_ratio = val
+
+    ###########################################################################
+    @property
+    def history_days(self):
+        """
+            Number of days of successful backups used to compute plans
+            expected durations
+        """
+        return self._history_days
+
+    @history_days.setter
+    def history_days(self, val):
+        self._history_days = val
+
+    ###########################################################################
+    def get_window(self, plan, occurrence, expected_duration=None):
+        """
+            Returns the number of seconds that the plan's occurrence can be
+            delayed by
+        """
+        lag = plan.schedule.max_acceptable_lag(occurrence)
+        window = lag * self.lag_ratio - (expected_duration or 0)
+        if self.max_spread_in_seconds is not None:
+            window = min(window, self.max_spread_in_seconds)
+
+        # leveled occurrences have to map back to their natural occurrence
+        next_occurrence = plan.schedule.next_natural_occurrence(occurrence)
+        window = min(window,
+                     timedelta_total_seconds(next_occurrence - occurrence) -
+                     60)
+
+        return int(max(window, 0))
+
+    ###########################################################################
+    def get_offset(self, plan, occurrence, expected_duration=None):
+        window = self.get_window(plan, occurrence,
+                                 expected_duration=expected_duration)
+        offset = int(window * plan_hash_fraction(plan))
+        # whole minutes so that leveled occurrences of cron schedules still
+        # map back to their natural occurrence
+        return offset - offset % 60
+
+    ###########################################################################
+    def level_occurrence(self, plan, occurrence, expected_duration=None):
+        """
+            Returns the leveled occurrence for the specified natural occurrence
+        """
+        offset = self.get_offset(plan, occurrence,
+                                 expected_duration=expected_duration)
+        return date_plus_seconds(occurrence, offset)
+
+    ###########################################################################
+    def validate(self):
+        errors = []
+        if self.lag_ratio is None or not 0 <= self.lag_ratio <= 1:
+            errors.append("Invalid lagRatio '%s'. lagRatio has to be between"
+                          " 0 and 1" % self.lag_ratio)
+        return errors
+
+    ###########################################################################
+    def to_document(self, display_only=False):
+        doc = {
+            "_type": "LoadLevelingPolicy",
+            "lagRatio": self.lag_ratio,
+            "historyDays": self.history_days
+        }
+
+        if self.max_spread_in_seconds is not None:
+            doc["maxSpreadInSeconds"] = self.max_spread_in_seconds
+
+        return doc
+
+###############################################################################
+# HELPERS
+###############################################################################
+def plan_hash_fraction(plan):
+    """
+        Returns a stable number in [0, 1) derived from the plan id
+    """
+    digest = hashlib.md5(str(plan.id)).hexdigest()
+    return int(digest[:8], 16) / float(0x100000000)
+
+###############################################################################
+def get_load_curve(intervals, start_date, end_date, resolution=15 * 60):
+    """
+        Returns the max number of concurrent intervals ((start, end) dates)
+        within each resolution seconds bucket between start_date and end_date
+        as a list of (bucket date, max concurrency)
+    """
+    events = []
+    for interval_start, interval_end in intervals:
+        events.append((interval_start, 1))
+        events.append((interval_end, -1))
+    # ends sort before starts at the same date
+    events.sort()
+
+    curve = []
+    concurrency = 0
+    i = 0
+    bucket_start = start_date
+    while bucket_start < end_date:
+        bucket_end = date_plus_seconds(bucket_start, resolution)
+        # concurrency carried over from the previous bucket
+        while i < len(events) and events[i][0] <= bucket_start:
+            concurrency += events[i][1]
+            i += 1
+        bucket_max = concurrency
+        while i < len(events) and events[i][0] < bucket_end:
+            concurrency += events[i][1]
+            bucket_max = max(bucket_max, concurrency)
+            i += 1
+
+        curve.append((bucket_start, bucket_max))
+        bucket_start = bucket_end
+
+    return curve
+
+###############################################################################
+def load_leveling_report(plans, policy, expected_durations=None,
+                         start_date=None, days=1, resolution=15 * 60):
+    """
+        Projects the concurrent backup load of the specified plans over the
+        next days, before and after load leveling.
+        expected_durations is a dict of plan id => duration in seconds
+    """
+    expected_durations = expected_durations or {}
+    start_date = start_date or date_now()
+    end_date = start_date + timedelta(days=days)
+
+    before = []
+    after = []
+    for plan in plans:
+        expected_duration = expected_durations.get(plan.id)
+        delta = timedelta(seconds=expected_duration or
+                                  DEFAULT_EXPECTED_DURATION)
+        for occurrence in plan.natural_occurrences_between(start_date,
+                                                           end_date):
+            before.append((occurrence, occurrence + delta))
+            leveled = policy.level_occurrence(
+                plan, occurrence, expected_duration=expected_duration)
+            after.append((leveled, leveled + delta))
+
+    before_curve = get_load_curve(before, start_date, end_date,
+                                  resolution=resolution)
+    after_curve = get_load_curve(after, start_date, end_date,
+                                 resolution=resolution)
+
+    return {
+        "startDate": start_date,
+        "endDate": end_date,
+        "resolutionInSeconds": resolution,
+        "before": _curve_document(before_curve),
+        "after": _curve_document(after_curve)
+    }
+
+###############################################################################
+def _curve_document(curve):
+    loads = [load for _, load in curve]
+    return {
+        "peakConcurrency": max(loads) if loads else 0,
+        "averageConcurrency": (round(float(sum(loads)) / len(loads), 2)
+                               if loads else 0),
+        "curve": [{"date": date, "concurrency": load}
+                  for date, load in curve]
+    }
+
+###############################################################################
+def median_duration(backup_docs):
+    """
+        Returns the median duration in seconds of the specified backup docs
+        (having startDate and endDate)
+    """
+    durations = sorted(timedelta_total_seconds(doc["endDate"] -
+                                               doc["startDate"])
+                       for doc in backup_docs
+                       if doc.get("startDate") and doc.get("endDate"))
+    if durations:
+        return int(durations[len(durations) / 2])
@@ -6,6 +6,10 @@ import mbs_config as config
 import mbs_logging
 
 from collection import MBSObjectCollection, MBSTaskCollection
+from config_snapshots import ConfigSnapshotStore, DEFAULT_CACHE_SIZE
+from index_advisor import QueryShapeRecorder
+from archive import get_archive_collection
+from audit_summaries import AuditSummaryStore
 from makerpy.maker import resolve_class, Maker
 
 from type_bindings import TYPE_BINDINGS
@@ -53,7 +57,14 @@ class MBS(object):
         self._backup_collection = None
         self._plan_collection = None
         self._audit_collection = None
+        self._audit_entries_collection = None
         self._restore_collection = None
+        self._backup_archive_collection = None
+        self._restore_archive_collection = None
+        self._target_tuning_collection = None
+        self._config_snapshot_store = None
+        self._query_shape_recorder = None
+        self._audit_summary_store = None
 
         # load backup system/engines lazily
         self._backup_system = None
@@ -109,9 +120,17 @@ class MBS(object):
     @property
     def backup_collection(self):
         if not self._backup_collection:
+            config_snapshots = None
+            if self._get_config_value("normalizeBackupConfig"):
+                config_snapshots = self.config_snapshot_store
             bc = MBSTaskCollection(self.database["backups"],
                                    clazz=Backup,
-                                   type_bindings=self._type_bindings)
+                                   type_bindings=self._type_bindings,
+                                   events_collection=
+                                   self.database["task_events"],
+                                   config_snapshots=config_snapshots,
+                                   query_recorder=self.query_shape_recorder,
+                                   audit_summaries=self.audit_summary_store)
             self._backup_collection = bc
 
         return self._backup_collection
@@ -122,18 +141,62 @@ class MBS(object):
         if not self._restore_collection:
             rc = MBSTaskCollection(self.database["restores"],
                                    clazz=Restore,
-                                   type_bindings=self._type_bindings)
+                                   type_bindings=self._type_bindings,
+                                   events_collection=
+                                   self.database["task_events"],
+                                   query_recorder=self.query_shape_recorder)
             self._restore_collection = rc
 
         return self._restore_collection
 
+    ###########################################################################
+    @property
+    def backup_archive_collection(self):
+        """
+            Old backups moved out of the backups collection (read only)
+        """
+        if not self._backup_archive_collection:
+            archive = get_archive_collection(self.database, "backups")
+            bc = MBSTaskCollection(archive,
+                                   clazz=Backup,
+                                   type_bindings=self._type_bindings,
+                                   events_collection=
+                                   self.database["task_events"],
+                                   flush_interval=None,
+                                   config_snapshots=
+                                   self.config_snapshot_store,
+                                   task_collection_name="backups")
+            self._backup_archive_collection = bc
+
+        return self._backup_archive_collection
+
+    ###########################################################################
+    @property
+    def restore_archive_collection(self):
+        """
+            Old restores moved out of the restores collection (read only)
+        """
+        if not self._restore_archive_collection:
+            archive = get_archive_collection(self.database, "restores")
+            rc = MBSTaskCollection(archive,
+                                   clazz=Restore,
+                                   type_bindings=self._type_bindings,
+                                   events_collection=
+                                   self.database["task_events"],
+                                   flush_interval=None,
+                                   task_collection_name="restores")
+            self._restore_archive_collection = rc
+
+        return self._restore_archive_collection
+
     ###########################################################################
     @property
     def plan_collection(self):
 
         if not self._plan_collection:
             pc = MBSObjectCollection(self.database["plans"], clazz=BackupPlan,
-                                     type_bindings=self._type_bindings)
+                                     type_bindings=self._type_bindings,
+                                     query_recorder=self.query_shape_recorder)
             self._plan_collection = pc
 
         return self._plan_collection
@@ -143,12 +206,80 @@ class MBS(object):
     def audit_collection(self):
         if not self._audit_collection:
             ac = MBSObjectCollection(self.database["audits"], clazz=AuditReport,
-                                     type_bindings=self._type_bindings)
+                                     type_bindings=self._type_bindings,
+                                     query_recorder=self.query_shape_recorder)
 
             self._audit_collection = ac
 
         return self._audit_collection
 
+    ###########################################################################
+    @property
+    def audit_entries_collection(self):
+        """
+            Entries of audit reports (e.g. PlanAuditReports) stored as
+            separate documents keyed by audit id (raw documents)
+        """
+        if self._audit_entries_collection is None:
+            self._audit_entries_collection = self.database["audit_entries"]
+
+        return self._audit_entries_collection
+
+    ###########################################################################
+    @property
+    def target_tuning_collection(self):
+        """
+            Upload tuning settings persisted per target (raw documents)
+        """
+        if self._target_tuning_collection is None:
+            self._target_tuning_collection = self.database["target_tuning"]
+
+        return self._target_tuning_collection
+
+    ###########################################################################
+    @property
+    def config_snapshot_store(self):
+        """
+            Deduplicated plan/source/target/strategy snapshots of backups.
+            Used when the normalizeBackupConfig config option is on
+        """
+        if self._config_snapshot_store is None:
+            cache_size = (self._get_config_value("configSnapshotCacheSize") or
+                          DEFAULT_CACHE_SIZE)
+            self._config_snapshot_store = ConfigSnapshotStore(
+                self.database["config_snapshots"], cache_size=cache_size)
+
+        return self._config_snapshot_store
+
+    ###########################################################################
+    @property
+    def audit_summary_store(self):
+        """
+            Per plan per day audit summaries maintained as backups change
+            state. Off unless the auditSummaries config option is true.
+            Auditors only read summaries once rebuilt (see migrations)
+        """
+        if (self._audit_summary_store is None and
+                self._get_config_value("auditSummaries")):
+            self._audit_summary_store = AuditSummaryStore(
+                self.database["audit_summaries"])
+
+        return self._audit_summary_store
+
+    ###########################################################################
+    @property
+    def query_shape_recorder(self):
+        """
+            Records query shapes for the index advisor. Off unless the
+            recordQueryShapes config option is true
+        """
+        if (self._query_shape_recorder is None and
+                self._get_config_value("recordQueryShapes")):
+            self._query_shape_recorder = QueryShapeRecorder(
+                self.database["query_shapes"])
+
+        return self._query_shape_recorder
+
     ###########################################################################
     @property
     def engines(self):
@@ -0,0 +1,148 @@
+__author__ = 'abdul'
+
+import mbs_logging
+
+from datetime import timedelta
+
+from mbs import get_mbs
+from task import (STATE_SCHEDULED, RESCHEDULE_PERIOD, MAX_RECENT_LOGS,
+                  EVENT_TYPE_ERROR, EVENT_TYPE_WARNING)
+from backup_system import backup_due_alert_at
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# Task field migrations
+###############################################################################
+def backfill_task_event_dates():
+    """
+        Sets lastEventDate/rescheduleAfter from the last log entry of backups
+        and restores that do not have them yet
+    """
+    database = get_mbs().database
+    for coll_name in ["backups", "restores"]:
+        count = _backfill_event_dates(database[coll_name])
+        logger.info("Backfilled event dates of %s %s" % (count, coll_name))
+
+###############################################################################
+def _backfill_event_dates(collection):
+    q = {
+        "lastEventDate": {"$exists": False},
+        "logs.0": {"$exists": True}
+    }
+    # only fetch the last log entry
+    fields = {"_id": 1, "logs": {"$slice": -1}}
+
+    count = 0
+    for doc in collection.find(q, fields=fields):
+        last_event_date = doc["logs"][-1].get("date")
+        if not last_event_date:
+            continue
+        reschedule_after = (last_event_date +
+                            timedelta(seconds=RESCHEDULE_PERIOD))
+        u = {
+            "$set": {
+                "lastEventDate": last_event_date,
+                "rescheduleAfter": reschedule_after
+            }
+        }
+        collection.update({"_id": doc["_id"]}, u)
+        count += 1
+
+    return count
+
+###############################################################################
+def backfill_backup_due_alert_dates():
+    """
+        Sets dueAlertAt of scheduled backups that do not have it yet
+    """
+    bc = get_mbs().backup_collection
+    q = {
+        "state": STATE_SCHEDULED,
+        "dueAlertAt": {"$exists": False}
+    }
+
+    count = 0
+    for backup in bc.find(q):
+        due_alert_at = backup_due_alert_at(backup)
+        bc.update({"_id": backup.id}, {"$set": {"dueAlertAt": due_alert_at}})
+        count += 1
+
+    logger.info("Backfilled dueAlertAt of %s scheduled backups" % count)
+
+###############################################################################
+def move_task_event_logs():
+    """
+        Copies the logs of backups and restores that have no event summary
+        yet to the task_events collection, sets their event summary and caps
+        their logs to the MAX_RECENT_LOGS most recent entries
+    """
+    for task_collection in [get_mbs().backup_collection,
+                            get_mbs().restore_collection]:
+        count = _move_event_logs(task_collection)
+        logger.info("Moved event logs of %s tasks" % count)
+
+###############################################################################
+def _move_event_logs(task_collection):
+    q = {
+        "loggedEvents": {"$exists": False}
+    }
+
+    count = 0
+    for task_id in task_collection.find_ids(q):
+        doc = task_collection.find_documents({"_id": task_id},
+                                             fields={"logs": 1})[0]
+        logs = doc.get("logs") or []
+        # upserted so that re-runs of an interrupted migration do not copy
+        # events twice
+        task_collection.upsert_task_events(task_id, logs)
+
+        logged_events = []
+        for log_doc in logs:
+            name = log_doc.get("name")
+            if name and name not in logged_events:
+                logged_events.append(name)
+
+        # logs are trimmed (and event names added) in place so that entries
+        # pushed by engines since the read are not lost
+        u = {
+            "$set": {
+                "errorCount": _count_event_type(logs, EVENT_TYPE_ERROR),
+                "warningCount": _count_event_type(logs, EVENT_TYPE_WARNING)
+            },
+            "$addToSet": {
+                "loggedEvents": {"$each": logged_events}
+            },
+            "$push": {
+                "logs": {"$each": [], "$slice": -MAX_RECENT_LOGS}
+            }
+        }
+        task_collection.update(spec={"_id": task_id}, document=u)
+        count += 1
+
+    return count
+
+###############################################################################
+def _count_event_type(logs, event_type):
+    return len([log_doc for log_doc in logs
+                if log_doc.get("eventType") == event_type])
+
+###############################################################################
+def rebuild_audit_summaries():
+    """
+        Rebuilds the audit summaries of all plan backups (if enabled) and
+        marks them complete so that auditors start reading them
+    """
+    store = get_mbs().audit_summary_store
+    if store:
+        store.rebuild(get_mbs().database["backups"])
+
+###############################################################################
+def migrate_task_fields():
+    backfill_task_event_dates()
+    backfill_backup_due_alert_dates()
+    move_task_event_logs()
+    rebuild_audit_summaries()
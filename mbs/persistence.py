@@ -1,7 +1,9 @@
 __author__ = 'abdul'
 
 from backup import EVENT_TYPE_INFO
+from task import STATE_SUCCEEDED
 from mbs import get_mbs
+from load_leveling import median_duration
 from mongo_utils import objectiditify
 import  mbs_logging
 ###############################################################################
@@ -12,8 +14,17 @@ logger = mbs_logging.logger
 ###############################################################################
 # Contains helper functions for persisting mbs documents
 ###############################################################################
-def get_backup(backup_id):
-    return get_mbs().backup_collection.get_by_id(backup_id)
+def get_backup(backup_id, fields=None, lazy=False):
+    """
+        Falls back to the backups archive for backups that have been archived
+    """
+    backup = get_mbs().backup_collection.get_by_id(backup_id, fields=fields,
+                                                   lazy=lazy)
+    if backup is None:
+        backup = get_mbs().backup_archive_collection.get_by_id(
+            backup_id, fields=fields, lazy=lazy)
+
+    return backup
 
 ###############################################################################
 def get_backup_plan(plan_id):
@@ -21,7 +32,15 @@ def get_backup_plan(plan_id):
 
 ###############################################################################
 def get_restore(restore_id):
-    return get_mbs().restore_collection.get_by_id(restore_id)
+    """
+        Falls back to the restores archive for restores that have been
+        archived
+    """
+    restore = get_mbs().restore_collection.get_by_id(restore_id)
+    if restore is None:
+        restore = get_mbs().restore_archive_collection.get_by_id(restore_id)
+
+    return restore
 
 ###############################################################################
 def update_backup(backup, properties=None, event_name=None,
@@ -36,3 +55,23 @@ def update_restore(restore, properties=None, event_name=None,
     rc = get_mbs().restore_collection
     rc.update_task(restore, properties=properties, event_name=event_name,
         event_type=event_type, message=message, details=details)
+
+###############################################################################
+def get_plans_backup_durations(plan_ids, since):
+    """
+        Returns a dict of plan id => median duration (in seconds) of the plan's
+        backups that succeeded since the specified date. Uses a single query
+    """
+    q = {
+        "plan._id": {"$in": plan_ids},
+        "state": STATE_SUCCEEDED,
+        "endDate": {"$gte": since}
+    }
+    fields = {"_id": 0, "plan._id": 1, "startDate": 1, "endDate": 1}
+
+    docs_by_plan = {}
+    for doc in get_mbs().backup_collection.find_documents(q, fields=fields):
+        docs_by_plan.setdefault(doc["plan"]["_id"], []).append(doc)
+
+    return dict((plan_id, median_duration(docs))
+                for plan_id, docs in docs_by_plan.items())
@@ -0,0 +1,92 @@
+__author__ = 'abdul'
+
+import heapq
+import threading
+
+from date_utils import epoch_date
+
+###############################################################################
+# PlanHeap
+###############################################################################
+class PlanHeap(object):
+    """
+        Min-heap of (nextOccurrence, planId) used by the backup system to know
+        when the next plan is due without querying the plans collection.
+        Entries are invalidated lazily: updating/removing a plan only changes
+        the plan's current due date and stale heap entries are skipped when
+        they reach the top. Plans with no next occurrence are due immediately
+    """
+    ###########################################################################
+    def __init__(self):
+        self._heap = []
+        # plan id => current due date
+        self._due_dates = {}
+        self._lock = threading.Lock()
+
+    ###########################################################################
+    def load(self, plan_docs):
+        """
+            Replaces the heap content with the specified plan documents
+            (only _id and nextOccurrence are needed)
+        """
+        with self._lock:
+            self._due_dates = dict((doc["_id"],
+                                    doc.get("nextOccurrence") or epoch_date())
+                                   for doc in plan_docs)
+            self._heap = [(due, plan_id)
+                          for plan_id, due in self._due_dates.items()]
+            heapq.heapify(self._heap)
+
+    ###########################################################################
+    def update(self, plan_id, due_date):
+        due_date = due_date or epoch_date()
+        with self._lock:
+            if self._due_dates.get(plan_id) == due_date:
+                return
+            self._due_dates[plan_id] = due_date
+            heapq.heappush(self._heap, (due_date, plan_id))
+
+    ###########################################################################
+    def remove(self, plan_id):
+        with self._lock:
+            self._due_dates.pop(plan_id, None)
+
+    ###########################################################################
+    def next_due_date(self):
+        """
+            Returns the earliest due date or None if the heap is empty
+        """
+        with self._lock:
+            self._discard_stale()
+            if self._heap:
+                return self._heap[0][0]
+
+    ###########################################################################
+    def pop_due(self, now):
+        """
+            Removes and returns the ids of all plans due at or before now
+        """
+        due_plan_ids = []
+        with self._lock:
+            self._discard_stale()
+            while self._heap and self._heap[0][0] <= now:
+                due_date, plan_id = heapq.heappop(self._heap)
+                del self._due_dates[plan_id]
+                due_plan_ids.append(plan_id)
+                self._discard_stale()
+
+        return due_plan_ids
+
+    ###########################################################################
+    def _discard_stale(self):
+        heap = self._heap
+        while heap and self._due_dates.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    ###########################################################################
+    def __len__(self):
+        return len(self._due_dates)
+
+    ###########################################################################
+    def __contains__(self, plan_id):
+        return plan_id in self._due_dates
@@ -91,7 +91,9 @@ class RetainLastNPolicy(RetentionPolicy):
         }
         s = [("createdDate", -1)]
 
-        backups = get_mbs().backup_collection.find(q, sort=s)
+        # expire_backup() re-reads the backup so only ids are needed
+        backups = get_mbs().backup_collection.find(q, sort=s,
+                                                   fields={"_id": 1})
 
         if len(backups) <= self.retain_count:
             return []
@@ -144,7 +146,7 @@ class RetainMaxTimePolicy(RetentionPolicy):
             }
         }
 
-        backups = get_mbs().backup_collection.find(q)
+        backups = get_mbs().backup_collection.find(q, fields={"_id": 1})
         return backups
 
     ###########################################################################
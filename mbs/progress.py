@@ -0,0 +1,176 @@
+__author__ = 'abdul'
+
+import time
+import threading
+
+import mbs_logging
+
+from date_utils import date_now
+from restore import Restore
+from persistence import update_backup, update_restore
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+MB = 1024 * 1024
+
+# min number of seconds between two persisted progress updates
+DEFAULT_UPDATE_INTERVAL = 30
+
+###############################################################################
+# TransferProgressReporter
+###############################################################################
+class TransferProgressReporter(object):
+    """
+        Tracks the progress of a transfer (possibly made of several streams,
+        e.g. parts or child targets) and persists it to the task's
+        transferProgress field at most every update_interval seconds.
+        Active reporters are registered so that they can be listed by the
+        engine command server
+    """
+    ###########################################################################
+    def __init__(self, task=None, name=None,
+                 update_interval=DEFAULT_UPDATE_INTERVAL):
+        self._task = task
+        self._name = name
+        self._update_interval = update_interval
+        self._total_bytes = 0
+        self._bytes_transferred = 0
+        self._start_time = time.time()
+        self._last_update = None
+        self._lock = threading.Lock()
+
+        _register(self)
+
+    ###########################################################################
+    @property
+    def task(self):
+        return self._task
+
+    ###########################################################################
+    @property
+    def name(self):
+        return self._name
+
+    ###########################################################################
+    def expect(self, nbytes):
+        """
+            Adds nbytes to the total number of bytes to transfer
+        """
+        with self._lock:
+            self._total_bytes += nbytes
+
+    ###########################################################################
+    def callback(self):
+        """
+            Returns a new (transferred, total) callback for a single stream
+            (compatible with boto/cloudfiles callbacks). Bytes re-sent when
+            the stream is retried from the start are only counted once
+        """
+        state = {"transferred": 0}
+
+        def stream_callback(transferred, total):
+            if transferred > state["transferred"]:
+                self.add(transferred - state["transferred"])
+                state["transferred"] = transferred
+
+        return stream_callback
+
+    ###########################################################################
+    def add(self, nbytes):
+        with self._lock:
+            self._bytes_transferred += max(nbytes, 0)
+            now = time.time()
+            due = (self._last_update is None or
+                   now - self._last_update >= self._update_interval)
+            if due:
+                self._last_update = now
+
+        if due:
+            self._persist()
+
+    ###########################################################################
+    def get_progress(self):
+        with self._lock:
+            total = self._total_bytes
+            transferred = self._bytes_transferred
+            if total:
+                transferred = min(transferred, total)
+
+        elapsed = time.time() - self._start_time
+        rate = float(transferred) / elapsed if elapsed > 0 else 0
+        if rate and total:
+            eta = int((total - transferred) / rate)
+        else:
+            eta = None
+
+        progress = {
+            "bytesTransferred": transferred,
+            "totalBytes": total,
+            "rateMBps": round(rate / MB, 2),
+            "etaSeconds": eta,
+            "updatedDate": date_now()
+        }
+        if self.name:
+            progress["name"] = self.name
+
+        return progress
+
+    ###########################################################################
+    def finish(self):
+        """
+            Persists the final progress and unregisters the reporter
+        """
+        _unregister(self)
+        self._persist()
+
+    ###########################################################################
+    def _persist(self):
+        if not self.task or not self.task.id:
+            return
+        try:
+            self.task.transfer_progress = self.get_progress()
+            if isinstance(self.task, Restore):
+                update_restore(self.task, properties="transferProgress")
+            else:
+                update_backup(self.task, properties="transferProgress")
+        except Exception, e:
+            logger.warning("Error while persisting transfer progress of task"
+                           " '%s': %s" % (self.task.id, e))
+
+###############################################################################
+# Active reporters registry
+###############################################################################
+_active_reporters = []
+_active_reporters_lock = threading.Lock()
+
+###############################################################################
+def _register(reporter):
+    with _active_reporters_lock:
+        _active_reporters.append(reporter)
+
+###############################################################################
+def _unregister(reporter):
+    with _active_reporters_lock:
+        if reporter in _active_reporters:
+            _active_reporters.remove(reporter)
+
+###############################################################################
+def get_active_transfers():
+    with _active_reporters_lock:
+        reporters = list(_active_reporters)
+
+    transfers = []
+    for reporter in reporters:
+        progress = reporter.get_progress()
+        if reporter.task:
+            progress["taskId"] = str(reporter.task.id)
+            progress["taskType"] = reporter.task.__class__.__name__
+        transfers.append(progress)
+
+    return transfers
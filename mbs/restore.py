@@ -7,6 +7,19 @@ from bson.dbref import DBRef
 # Restore
 ###############################################################################
 class Restore(MBSTask):
+
+    __slots__ = ("_source_backup", "_source_database_name", "_destination",
+                 "_destination_stats")
+
+    PROPERTY_EXPORTERS = MBSTask.PROPERTY_EXPORTERS.copy()
+    PROPERTY_EXPORTERS.update({
+        "sourceBackup": lambda restore, display_only: DBRef(
+            "backups", restore.source_backup.id),
+        "sourceDatabaseName": attribute_exporter("source_database_name"),
+        "destination": document_exporter("destination"),
+        "destinationStats": attribute_exporter("destination_stats")
+    })
+
     def __init__(self):
         # init fields
         MBSTask.__init__(self)
@@ -0,0 +1,486 @@
+__author__ = 'abdul'
+
+import sys
+import copy
+import math
+import time
+import heapq
+import random
+import logging
+
+from datetime import timedelta
+from contextlib import contextmanager
+
+from bson.objectid import ObjectId
+
+import mbs_logging
+
+from mbs import MBS, get_mbs
+from errors import MBSError
+from engine import TaskQueueProcessor
+from backup_system import BackupSystem
+from task import STATE_SUCCEEDED, STATE_CANCELED, STATE_SCHEDULED
+from date_utils import (date_now, date_minus_seconds, date_plus_seconds,
+                        timedelta_total_seconds)
+
+###############################################################################
+# LOGGER
+###############################################################################
+logger = mbs_logging.logger
+
+###############################################################################
+# CONSTANTS
+###############################################################################
+# duration of tasks with no history (1 hour)
+DEFAULT_TASK_DURATION = 60 * 60
+
+# seconds between two task queue processor ticks (same as the real engine)
+PROCESSOR_SLEEP_TIME = 10
+
+# days of successful backups used for task durations
+DURATION_HISTORY_DAYS = 14
+
+# names under which date_utils may be loaded
+DATE_UTILS_MODULES = ["date_utils", "mbs.date_utils"]
+
+###############################################################################
+# VirtualClock
+###############################################################################
+class VirtualClock(object):
+    """
+        Simulation clock. Replaces date_now() while the simulation runs
+    """
+    ###########################################################################
+    def __init__(self, start_date):
+        self._now = start_date
+
+    ###########################################################################
+    def now(self):
+        return self._now
+
+    ###########################################################################
+    def advance_to(self, date):
+        if date > self._now:
+            self._now = date
+
+###############################################################################
+@contextmanager
+def virtual_time(clock):
+    """
+        Patches date_now in every loaded module that imported it so that
+        schedules, the backup system and task processors see virtual time
+    """
+    patched = []
+    for module in sys.modules.values():
+        func = getattr(module, "date_now", None)
+        if (func is not None and
+                getattr(func, "__module__", None) in DATE_UTILS_MODULES):
+            patched.append((module, func))
+            module.date_now = clock.now
+    try:
+        yield clock
+    finally:
+        for module, func in patched:
+            module.date_now = func
+        # modules imported while the clock ran copied the patched date_now
+        for module in sys.modules.values():
+            func = getattr(module, "date_now", None)
+            if getattr(func, "__self__", None) is clock:
+                module.date_now = date_now
+
+###############################################################################
+@contextmanager
+def simulated_mbs(sim_mbs):
+    """
+        Makes get_mbs() return sim_mbs
+    """
+    mbs_module = sys.modules[get_mbs.__module__]
+    real_mbs = mbs_module.mbs_singleton
+    mbs_module.mbs_singleton = sim_mbs
+    try:
+        yield sim_mbs
+    finally:
+        mbs_module.mbs_singleton = real_mbs
+
+###############################################################################
+def new_memory_database(name="mbs_simulation"):
+    try:
+        import mongomock
+    except ImportError:
+        raise MBSError("Simulations require mongomock to be installed "
+                       "(pip install mbs[simulation])")
+
+    _use_mongo_range_matching(mongomock)
+    return mongomock.Connection()[name]
+
+###############################################################################
+def _use_mongo_range_matching(mongomock):
+    """
+        Like mongo, $lt/$lte/$gt/$gte never match null (e.g. the startDate
+        of scheduled tasks) instead of comparing None to dates
+    """
+    from mongomock import filtering
+    for op in ["$lt", "$lte", "$gt", "$gte"]:
+        func = filtering.OPERATOR_MAP[op]
+        if not getattr(func, "_mbs_range_op", False):
+            filtering.OPERATOR_MAP[op] = _range_op(func)
+
+###############################################################################
+def _range_op(func):
+    def op(doc_val, search_val):
+        return doc_val is not None and func(doc_val, search_val)
+    op._mbs_range_op = True
+    return op
+
+###############################################################################
+# DurationSampler
+###############################################################################
+class DurationSampler(object):
+    """
+        Draws synthetic task durations (in seconds) from historical durations
+        of the plan's backups or from all historical durations for plans with
+        no history
+    """
+    ###########################################################################
+    def __init__(self, history=None, default_duration=DEFAULT_TASK_DURATION,
+                 seed=None):
+        # plan id => list of durations
+        self._history = history or {}
+        self._all_durations = [duration
+                               for durations in self._history.values()
+                               for duration in durations]
+        self._default_duration = default_duration
+        self._random = random.Random(seed)
+
+    ###########################################################################
+    def alias(self, plan_id, source_plan_id):
+        """
+            Makes plan_id use the history of source_plan_id
+        """
+        if source_plan_id in self._history:
+            self._history[plan_id] = self._history[source_plan_id]
+
+    ###########################################################################
+    def sample(self, plan_id=None):
+        durations = self._history.get(plan_id) or self._all_durations
+        if durations:
+            return self._random.choice(durations)
+        return self._default_duration
+
+###############################################################################
+def load_duration_history(database, since):
+    """
+        Returns a dict of plan id => durations (in seconds) of the plan's
+        backups that succeeded since the specified date
+    """
+    q = {
+        "state": STATE_SUCCEEDED,
+        "endDate": {"$gte": since}
+    }
+    fields = {"_id": 0, "plan._id": 1, "startDate": 1, "endDate": 1}
+
+    history = {}
+    for doc in database["backups"].find(q, fields=fields):
+        if not doc.get("startDate"):
+            continue
+        duration = timedelta_total_seconds(doc["endDate"] - doc["startDate"])
+        plan_id = doc.get("plan", {}).get("_id")
+        history.setdefault(plan_id, []).append(duration)
+
+    return history
+
+###############################################################################
+# Simulated engine parts
+###############################################################################
+class SimulatedEngine(object):
+    """
+        Stands for a BackupEngine: only what TaskQueueProcessor needs to claim
+        tasks
+    """
+    ###########################################################################
+    def __init__(self, id, max_workers=10, tags=None):
+        self.id = id
+        self.engine_guid = "simulated-%s" % id
+        self.max_workers = int(max_workers)
+        self.tags = tags
+
+    ###########################################################################
+    def info(self, msg):
+        logger.debug("SimulatedEngine %s: %s" % (self.id, msg))
+
+    ###########################################################################
+    def _notify_error(self, exception):
+        logger.error("SimulatedEngine %s: %s" % (self.id, exception))
+
+###############################################################################
+class SimulatedWorker(object):
+    ###########################################################################
+    def __init__(self, task):
+        self.task = task
+
+###############################################################################
+# Simulation
+###############################################################################
+class Simulation(object):
+    """
+        Runs the real BackupSystem scheduling (plan heap, batch scheduling,
+        load leveling, cancellations...) and the real TaskQueueProcessor
+        claiming against an in-memory store and a virtual clock. Task
+        execution is replaced by synthetic durations. The clock jumps from
+        one event (plan due, maintenance, processor tick while there is work
+        to claim, task completion) to the next, so idle time costs nothing
+    """
+    ###########################################################################
+    def __init__(self, config, plan_docs, engine_docs, duration_sampler=None,
+                 start_date=None, prune_finished=True):
+        self._config = copy.deepcopy(config)
+        # never send notifications from a simulation
+        self._config.pop("notificationHandler", None)
+        self._plan_docs = plan_docs
+        self._engine_docs = engine_docs
+        self._duration_sampler = duration_sampler or DurationSampler()
+        self._start_date = start_date or date_now()
+        # remove finished backups from the store to keep queries fast
+        self._prune_finished = prune_finished
+
+        # stats
+        self._latencies = []
+        self._busy_seconds = {}
+        self._past_due_starts = 0
+        self._completed = 0
+
+    ###########################################################################
+    def run(self, days=7):
+        started = time.time()
+        end_date = self._start_date + timedelta(days=days)
+
+        sim_mbs = MBS(self._config)
+        sim_mbs._database = new_memory_database()
+        if self._plan_docs:
+            sim_mbs.database["plans"].insert(copy.deepcopy(self._plan_docs))
+
+        clock = VirtualClock(self._start_date)
+        log_level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            with simulated_mbs(sim_mbs), virtual_time(clock):
+                backup_system = sim_mbs.backup_system or BackupSystem()
+                # plans are fixed for the duration of the simulation
+                backup_system.plan_generators = []
+                # no real time write buffer timers in virtual time
+                sim_mbs.backup_collection.flush_interval = None
+                engines = [SimulatedEngine(doc.get("_id") or str(i),
+                                           max_workers=doc.get("maxWorkers",
+                                                               10),
+                                           tags=doc.get("tags"))
+                           for i, doc in enumerate(self._engine_docs)]
+                processors = [TaskQueueProcessor("Backups",
+                                                 sim_mbs.backup_collection,
+                                                 engine, engine.max_workers)
+                              for engine in engines]
+
+                self._run_loop(clock, end_date, backup_system, processors)
+                return self._get_report(sim_mbs, days, engines, processors,
+                                        time.time() - started)
+        finally:
+            logger.setLevel(log_level)
+
+    ###########################################################################
+    def _run_loop(self, clock, end_date, backup_system, processors):
+        # heap of (end date, seq, processor, worker)
+        running = []
+        seq = 0
+        # processors that have nothing to claim (or no free workers)
+        idle = set()
+        next_polls = dict((processor, self._start_date)
+                          for processor in processors)
+        next_backup_system_tick = self._start_date
+
+        while clock.now() < end_date:
+            now = clock.now()
+
+            # task completions
+            while running and running[0][0] <= now:
+                _, _, processor, worker = heapq.heappop(running)
+                processor.worker_finished(worker, STATE_SUCCEEDED)
+                self._completed += 1
+                if self._prune_finished:
+                    processor._task_collection.remove({"_id": worker.task.id})
+                idle.discard(processor)
+
+            # backup system
+            if now >= next_backup_system_tick:
+                backup_system._tick()
+                next_backup_system_tick = backup_system._get_next_wake_date()
+                # new backups might have been scheduled
+                idle.clear()
+
+            # task processors
+            for processor in processors:
+                if processor in idle:
+                    continue
+                if next_polls[processor] < now:
+                    next_polls[processor] = self._align_to_poll(now)
+                if next_polls[processor] > now:
+                    continue
+
+                next_polls[processor] = date_plus_seconds(
+                    now, PROCESSOR_SLEEP_TIME)
+                processor._tick_count += 1
+                task = None
+                if processor._has_available_workers():
+                    task = processor.read_next_task()
+                if not task:
+                    idle.add(processor)
+                    continue
+
+                end = self._start_task(task, processor, now, end_date)
+                seq += 1
+                heapq.heappush(running,
+                               (end, seq, processor, SimulatedWorker(task)))
+
+            # jump to the next event
+            next_dates = [end_date, next_backup_system_tick]
+            if running:
+                next_dates.append(running[0][0])
+            next_dates.extend(next_polls[processor]
+                              for processor in processors
+                              if processor not in idle)
+            next_date = min(next_dates)
+            if next_date <= now:
+                next_date = date_plus_seconds(now, 1)
+            clock.advance_to(next_date)
+
+    ###########################################################################
+    def _align_to_poll(self, date):
+        """
+            Returns the first processor tick date at or after date
+        """
+        elapsed = timedelta_total_seconds(date - self._start_date)
+        ticks = -(-int(elapsed) // PROCESSOR_SLEEP_TIME)
+        return date_plus_seconds(self._start_date,
+                                 ticks * PROCESSOR_SLEEP_TIME)
+
+    ###########################################################################
+    def _start_task(self, task, processor, now, end_date):
+        processor.next_worker_id()
+        task.start_date = now
+
+        occurrence_date = getattr(task, "plan_occurrence",
+                                  None) or task.created_date
+        self._latencies.append(timedelta_total_seconds(now - occurrence_date))
+        due_alert_at = getattr(task, "due_alert_at", None)
+        if due_alert_at and now > due_alert_at:
+            self._past_due_starts += 1
+
+        plan = getattr(task, "plan", None)
+        duration = self._duration_sampler.sample(plan.id if plan else None)
+        end = now + timedelta(seconds=duration)
+
+        busy = timedelta_total_seconds(min(end, end_date) - now)
+        engine = processor._engine
+        self._busy_seconds[engine.id] = (self._busy_seconds.get(engine.id, 0) +
+                                         busy)
+        return end
+
+    ###########################################################################
+    def _get_report(self, sim_mbs, days, engines, processors, wall_seconds):
+        bc = sim_mbs.backup_collection
+        total_seconds = days * 24 * 60 * 60
+
+        engine_stats = []
+        total_busy = 0
+        total_capacity = 0
+        for engine in engines:
+            busy = self._busy_seconds.get(engine.id, 0)
+            capacity = engine.max_workers * total_seconds
+            total_busy += busy
+            total_capacity += capacity
+            engine_stats.append({
+                "engineId": engine.id,
+                "maxWorkers": engine.max_workers,
+                "workerUtilization": _ratio(busy, capacity)
+            })
+
+        latencies = sorted(self._latencies)
+        return {
+            "startDate": self._start_date,
+            "simulatedDays": days,
+            "wallClockSeconds": round(wall_seconds, 2),
+            "plans": len(self._plan_docs),
+            "backupsStarted": len(latencies),
+            "backupsCompleted": self._completed,
+            "backupsQueuedAtEnd": bc.count({"state": STATE_SCHEDULED}),
+            "pastDueStarts": self._past_due_starts,
+            "pastDueCancellations": bc.count({"state": STATE_CANCELED}),
+            "queueLatencyInMinutes": {
+                "p50": _minutes(percentile(latencies, 50)),
+                "p90": _minutes(percentile(latencies, 90)),
+                "p99": _minutes(percentile(latencies, 99)),
+                "max": _minutes(latencies[-1] if latencies else None)
+            },
+            "workerUtilization": _ratio(total_busy, total_capacity),
+            "engines": engine_stats
+        }
+
+###############################################################################
+# HELPERS
+###############################################################################
+def percentile(sorted_values, pct):
+    """
+        Nearest rank percentile of a sorted list
+    """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+###############################################################################
+def _minutes(seconds):
+    if seconds is not None:
+        return round(seconds / 60.0, 2)
+
+###############################################################################
+def _ratio(value, total):
+    if total:
+        return round(float(value) / total, 4)
+    return 0
+
+###############################################################################
+def simulate_current_setup(days=7, extra_plans=0, engine_count=None,
+                           max_workers=None, seed=None):
+    """
+        Simulates the configured backup system and engines with the current
+        plans (plus extra_plans clones of random existing plans) and task
+        durations drawn from the recent history
+    """
+    real_mbs = get_mbs()
+    database = real_mbs.database
+    rand = random.Random(seed)
+
+    since = date_minus_seconds(date_now(),
+                               DURATION_HISTORY_DAYS * 24 * 60 * 60)
+    sampler = DurationSampler(load_duration_history(database, since),
+                              seed=seed)
+
+    plan_docs = list(database["plans"].find())
+    if extra_plans and plan_docs:
+        for i in range(extra_plans):
+            plan_doc = copy.deepcopy(rand.choice(plan_docs))
+            source_plan_id = plan_doc["_id"]
+            plan_doc["_id"] = ObjectId()
+            sampler.alias(plan_doc["_id"], source_plan_id)
+            plan_docs.append(plan_doc)
+
+    engine_docs = real_mbs._get_config_value("engines") or []
+    if engine_count:
+        engine_docs = [dict(engine_docs[0] if engine_docs else {},
+                            _id="engine-%s" % i)
+                       for i in range(engine_count)]
+    if max_workers:
+        engine_docs = [dict(doc, maxWorkers=max_workers)
+                       for doc in engine_docs]
+
+    simulation = Simulation(real_mbs._config, plan_docs, engine_docs,
+                            duration_sampler=sampler)
+    return simulation.run(days=days)
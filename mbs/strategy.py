@@ -23,7 +23,9 @@ from utils import (which, ensure_dir, execute_command, execute_command_wrapper,
                    find_mount_point, freeze_mount_point, unfreeze_mount_point,
                    listify)
 
-from target import CBS_STATUS_PENDING, CBS_STATUS_COMPLETED, CBS_STATUS_ERROR
+from target import (CBS_STATUS_PENDING, CBS_STATUS_COMPLETED,
+                    CBS_STATUS_ERROR, CompositeTarget)
+from progress import TransferProgressReporter
 
 
 from task import EVENT_TYPE_WARNING
@@ -43,6 +45,7 @@ EVENT_START_ARCHIVE = "START_ARCHIVE"
 EVENT_END_ARCHIVE = "END_ARCHIVE"
 EVENT_START_UPLOAD = "START_UPLOAD"
 EVENT_END_UPLOAD = "END_UPLOAD"
+EVENT_PARTIAL_UPLOAD = "PARTIAL_UPLOAD"
 
 # Member preference values
 PREF_PRIMARY_ONLY = "PRIMARY_ONLY"
@@ -612,26 +615,65 @@ class DumpStrategy(BackupStrategy):
                       event_name=EVENT_START_UPLOAD,
                       message="Upload tar to target")
         upload_dest_path = _upload_file_dest(backup)
-        target_reference = backup.target.put_file(tar_file_path,
-            destination_path=upload_dest_path)
 
         # keep old target reference if it exists to delete it because it would
         # be the failed file reference
         failed_reference = backup.target_reference
+
+        progress_reporter = TransferProgressReporter(task=backup,
+                                                     name="upload")
+        try:
+            if isinstance(backup.target, CompositeTarget):
+                target_reference = self._upload_dump_to_composite_target(
+                    backup, tar_file_path, upload_dest_path,
+                    progress_reporter)
+            else:
+                target_reference = backup.target.put_file(tar_file_path,
+                    destination_path=upload_dest_path,
+                    progress_reporter=progress_reporter)
+        finally:
+            progress_reporter.finish()
+
         backup.target_reference = target_reference
 
         update_backup(backup, properties="targetReference",
                       event_name=EVENT_END_UPLOAD,
                       message="Upload completed!")
 
-        # remove failed reference if exists
-        if failed_reference:
+        # remove failed reference if exists. A reference to the upload
+        # destination itself is the partial reference that we just resumed
+        if (failed_reference and
+                getattr(failed_reference, "file_path", None) !=
+                upload_dest_path):
             try:
                 backup.target.delete_file(failed_reference)
             except Exception, ex:
                 logger.error("Exception while deleting failed backup file: %s"
                              % ex)
 
+    ###########################################################################
+    def _upload_dump_to_composite_target(self, backup, tar_file_path,
+                                         upload_dest_path,
+                                         progress_reporter=None):
+        """
+            Uploads to all child targets resuming from the partial reference
+            of a previous attempt (if any). On partial failure, the partial
+            reference is saved so that the next attempt resumes from it
+        """
+        try:
+            return backup.target.put_file(
+                tar_file_path, destination_path=upload_dest_path,
+                progress_reporter=progress_reporter,
+                completed_reference=backup.target_reference)
+        except CompositeTargetPartialUploadError, e:
+            backup.target_reference = e.target_reference
+            update_backup(backup, properties="targetReference",
+                          event_name=EVENT_PARTIAL_UPLOAD,
+                          event_type=EVENT_TYPE_WARNING,
+                          message="Upload failed for some targets",
+                          details=e.detailed_message)
+            raise
+
     ###########################################################################
     def _upload_dump_log_file(self, backup):
         log_file_path = self._get_dump_log_path(backup)
@@ -923,7 +965,13 @@ class DumpStrategy(BackupStrategy):
         update_restore(restore, event_name="START_DOWNLOAD_BACKUP",
                        message="Download source backup file...")
 
-        backup.target.get_file(file_reference, restore.workspace)
+        progress_reporter = TransferProgressReporter(task=restore,
+                                                     name="download")
+        try:
+            backup.target.get_file(file_reference, restore.workspace,
+                                   progress_reporter=progress_reporter)
+        finally:
+            progress_reporter.finish()
 
         update_restore(restore, event_name="END_DOWNLOAD_BACKUP",
                        message="Source backup file download complete!")
@@ -3,7 +3,9 @@ __author__ = 'abdul'
 
 import os
 import sys
+import time
 import shutil
+import threading
 import cloudfiles
 import cloudfiles.errors
 
@@ -15,10 +17,14 @@ from utils import which, execute_command
 from azure.storage import BlobService
 from boto.s3.connection import S3Connection
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from boto.ec2 import EC2Connection
 from errors import *
 from robustify.robustify import robustify
 from splitfile import SplitFile
+from bandwidth import ThrottledTransfer, get_engine_limiter, get_shared_limiter
+from autotune import (MultipartAutotuner, FilePart, load_tuning, save_tuning,
+                      DEFAULT_PART_SIZE)
 
 ###############################################################################
 # LOGGER
@@ -32,6 +38,24 @@ MULTIPART_MIN_SIZE = 100 * 1024 * 1024
 CF_MULTIPART_MIN_SIZE = 5 * 1024 * 1024 * 1024
 MAX_SPLIT_SIZE = 1024 * 1024 * 1024
 
+# max age (in seconds) of a target inventory before it gets re-listed
+INVENTORY_MAX_AGE = 30 * 60
+
+# page size used when listing cloud files containers
+CF_LIST_PAGE_SIZE = 10000
+
+# page size used when listing azure containers (max allowed by azure)
+AZURE_LIST_PAGE_SIZE = 5000
+
+# max number of parts of an s3 multi-part upload
+S3_MAX_PARTS = 10000
+
+# max number of attempts to upload a single part of an autotuned upload
+PART_MAX_ATTEMPTS = 3
+
+# number of progress callbacks per (unthrottled) boto transfer
+TRANSFER_NUM_CB = 100
+
 # Cloud block storage statuses
 CBS_STATUS_PENDING = "pending"
 CBS_STATUS_COMPLETED = "completed"
@@ -44,7 +68,8 @@ class BackupTarget(MBSObject):
 
     ###########################################################################
     def __init__(self):
-        pass
+        self._use_inventory = False
+        self._bandwidth_limiter = None
 
     ###########################################################################
     @property
@@ -53,6 +78,16 @@ class BackupTarget(MBSObject):
             Should be implemented by subclasses
         """
 
+    ###########################################################################
+    @property
+    def account_identity(self):
+        """
+            Identity of the account/credentials used to access the container.
+            Targets of the same container accessed with different accounts do
+            not share inventories. Overridden by subclasses
+        """
+        return None
+
     ###########################################################################
     @property
     def target_type(self):
@@ -61,14 +96,92 @@ class BackupTarget(MBSObject):
         """
         return self.__class__.__name__
 
+    ###########################################################################
+    @property
+    def use_inventory(self):
+        """
+            When set, existence/size checks are answered from an in-process
+            inventory of the container instead of a HEAD request per file
+        """
+        return self._use_inventory
+
+    @use_inventory.setter
+    def use_inventory(self, val):
+        self._use_inventory = val
+
+    ###########################################################################
+    @property
+    def inventory(self):
+        if self.use_inventory:
+            return get_target_inventory(self)
+
+    ###########################################################################
+    @property
+    def bandwidth_limiter(self):
+        """
+            Optional BandwidthLimiter that caps transfers to this target.
+            Shared by all workers transferring to the same container
+        """
+        return self._bandwidth_limiter
+
+    @bandwidth_limiter.setter
+    def bandwidth_limiter(self, val):
+        self._bandwidth_limiter = val
+
+    ###########################################################################
+    def _get_bandwidth_limiters(self):
+        limiters = []
+        engine_limiter = get_engine_limiter()
+        if engine_limiter:
+            limiters.append(engine_limiter)
+
+        if self.bandwidth_limiter:
+            key = (self.target_type, self.container_name)
+            limiters.append(get_shared_limiter(key, self.bandwidth_limiter))
+
+        return limiters
+
+    ###########################################################################
+    def _transfer_callback(self, callback=None):
+        """
+            Returns a transfer progress callback that throttles the transfer
+            by the applicable bandwidth limiters (if any)
+        """
+        limiters = self._get_bandwidth_limiters()
+        if limiters:
+            return ThrottledTransfer(limiters, callback=callback)
+        else:
+            return callback
+
+    ###########################################################################
+    def _export_options(self, doc, display_only=False):
+        """
+            Adds optional properties common to all targets to doc
+        """
+        if self.use_inventory:
+            doc["useInventory"] = self.use_inventory
+
+        if self.bandwidth_limiter:
+            doc["bandwidthLimiter"] = self.bandwidth_limiter.to_document(
+                display_only=display_only)
+
+        return doc
+
+    ###########################################################################
+    def refresh_inventory(self):
+        logger.info("%s: Listing container '%s' to refresh inventory" %
+                    (self.target_type, self.container_name))
+        self.inventory.load(self._list_files())
+
     ###########################################################################
     def put_file(self, file_path, destination_path=None,
-                 overwrite_existing=False):
+                 overwrite_existing=False, progress_reporter=None):
         """
             Uploads the specified file path under destination_path.
              destination_path defaults to base name (file name) of file_path
              This is the generic implementation that includes upload
-             verification and returning proper errors
+             verification and returning proper errors.
+             progress_reporter (TransferProgressReporter) is optional
         """
         try:
 
@@ -92,12 +205,19 @@ class BackupTarget(MBSObject):
                     raise UploadedFileAlreadyExistError(msg)
 
 
+            if progress_reporter:
+                progress_reporter.expect(file_size)
+
             target_ref = self.do_put_file(file_path, destination_path=
-                                                        destination_path)
+                                                        destination_path,
+                                          progress_reporter=progress_reporter)
 
             # validate that the file has been uploaded successfully
             self._verify_file_uploaded(destination_path, file_size)
 
+            if self.inventory:
+                self.inventory.file_added(destination_path, file_size)
+
             logger.info("%s: Uploading %s (%s bytes) to container %s "
                         "completed successfully!!" %
                         (self.target_type, file_path, file_size,
@@ -114,18 +234,28 @@ class BackupTarget(MBSObject):
                                         cause=e)
 
     ###########################################################################
-    def do_put_file(self, file_path, destination_path=None):
+    def do_put_file(self, file_path, destination_path=None,
+                    progress_reporter=None):
         """
            does the actually work. should be implemented by subclasses
         """
         pass
 
     ###########################################################################
-    def get_file(self, file_reference, destination):
+    def get_file(self, file_reference, destination, progress_reporter=None):
         """
             Gets the file references and writes it to the specified destination
         """
 
+    ###########################################################################
+    def _progress_callback(self, progress_reporter):
+        """
+            Returns a transfer progress callback for a single stream of the
+            specified reporter (if any)
+        """
+        if progress_reporter:
+            return progress_reporter.callback()
+
     ###########################################################################
     def delete_file(self, file_reference):
         """
@@ -137,6 +267,9 @@ class BackupTarget(MBSObject):
         self.do_delete_file(file_reference)
         self._verify_file_deleted(file_reference.file_path)
 
+        if self.inventory:
+            self.inventory.file_removed(file_reference.file_path)
+
     ###########################################################################
     def do_delete_file(self, file_reference):
         """
@@ -189,15 +322,50 @@ class BackupTarget(MBSObject):
     ###########################################################################
     def file_exists(self, file_path):
 
-        file_exists, file_size = self._fetch_file_info(file_path)
+        file_exists, file_size = self._lookup_file_info(file_path)
         return file_exists
 
+    ###########################################################################
+    def _lookup_file_info(self, file_path):
+        """
+            Returns a tuple of (file_exists, file_size) answered from the
+            inventory if enabled and fresh. Only files found in the inventory
+            are trusted (the file could have been uploaded by another
+            process since the listing); misses fall back to a live lookup
+        """
+        inventory = self.inventory
+        if inventory:
+            try:
+                if inventory.is_stale():
+                    self.refresh_inventory()
+                file_info = inventory.lookup(file_path)
+                if file_info and file_info[0]:
+                    return file_info
+            except Exception, e:
+                logger.warning("%s: Error while looking up '%s' in inventory "
+                               "of container '%s'. Falling back to a live "
+                               "lookup. Cause: %s" %
+                               (self.target_type, file_path,
+                                self.container_name, e))
+
+        return self._fetch_file_info(file_path)
+
     ###########################################################################
     def _fetch_file_info(self, destination_path):
         """
             Returns a tuple of (file_exists, file_size)
             Should be implemented by subclasses
         """
+
+    ###########################################################################
+    def _list_files(self):
+        """
+            Returns an iterable of (file_path, file_size) tuples for all files
+            in the container. Should be implemented by subclasses that support
+            inventories
+        """
+        raise TargetError("%s does not support listing container files" %
+                          self.target_type)
 ###############################################################################
 # S3BucketTarget
 ###############################################################################
@@ -209,17 +377,21 @@ class S3BucketTarget(BackupTarget):
         self._bucket_name = None
         self._encrypted_access_key = None
         self._encrypted_secret_key = None
+        self._autotune_uploads = False
 
     ###########################################################################
-    def do_put_file(self, file_path, destination_path):
+    def do_put_file(self, file_path, destination_path,
+                    progress_reporter=None):
 
         # determine single/multi part upload
         file_size = os.path.getsize(file_path)
 
         if file_size >= MULTIPART_MIN_SIZE:
-            self._multi_part_put(file_path, destination_path, file_size)
+            self._multi_part_put(file_path, destination_path, file_size,
+                                 progress_reporter=progress_reporter)
         else:
-            self._single_part_put(file_path, destination_path)
+            self._single_part_put(file_path, destination_path,
+                                  progress_reporter=progress_reporter)
 
         return FileReference(file_path=destination_path,
                              file_size=file_size)
@@ -238,15 +410,33 @@ class S3BucketTarget(BackupTarget):
             return False, None
 
     ###########################################################################
-    def _single_part_put(self, file_path, destination_path):
+    def _list_files(self):
+        """
+            Override. boto pages through the bucket listing (1000 keys per
+            request) as the result set is iterated
+        """
+        for key in self._get_bucket().list():
+            yield key.name, key.size
+
+    ###########################################################################
+    def _single_part_put(self, file_path, destination_path,
+                         progress_reporter=None):
         bucket = self._get_bucket()
         file_obj = open(file_path)
         k = Key(bucket)
         k.key = destination_path
-        k.set_contents_from_file(file_obj)
+        callback = self._progress_callback(progress_reporter)
+        k.set_contents_from_file(file_obj,
+                                 **self._transfer_args(callback=callback))
 
     ###########################################################################
-    def _multi_part_put(self, file_path, destination_path, file_size):
+    def _multi_part_put(self, file_path, destination_path, file_size,
+                        progress_reporter=None):
+
+        if self.autotune_uploads:
+            return self._autotuned_multi_part_put(file_path, destination_path,
+                                                  file_size,
+                                                  progress_reporter)
 
         logger.info("S3BucketTarget: Starting multi-part put for %s " %
                     file_path)
@@ -262,14 +452,121 @@ class S3BucketTarget(BackupTarget):
         for i, chunk in enumerate(upload, 1):
             logger.debug("Uploading file part %d (%s bytes)" %
                          (i, chunk.size))
-            mp.upload_part_from_file(chunk, i)
+            callback = self._progress_callback(progress_reporter)
+            mp.upload_part_from_file(chunk, i,
+                                     **self._transfer_args(callback=callback))
 
         mp.complete_upload()
         logger.info("S3BucketTarget: Multi-part put for %s completed"
                     " successfully!" % file_path)
 
     ###########################################################################
-    def get_file(self, file_reference, destination):
+    def _autotuned_multi_part_put(self, file_path, destination_path,
+                                  file_size, progress_reporter=None):
+        """
+            Multi-part put with variable part sizes and concurrent parts as
+            chosen by a MultipartAutotuner. The tuner starts off the settings
+            persisted by the previous autotuned upload to this bucket
+        """
+        tuning_key = "%s:%s" % (self.target_type, self.bucket_name)
+        tuning_coll = get_mbs().target_tuning_collection
+        settings = load_tuning(tuning_coll, tuning_key) or {}
+        tuner = MultipartAutotuner(part_size=settings.get("partSize") or
+                                             DEFAULT_PART_SIZE,
+                                   in_flight=settings.get("inFlight") or 1,
+                                   max_part_size=MAX_SPLIT_SIZE)
+
+        logger.info("S3BucketTarget: Starting autotuned multi-part put for "
+                    "%s (part size %s bytes, %s parts in flight)" %
+                    (file_path, tuner.part_size, tuner.in_flight))
+
+        mp = self._get_bucket().initiate_multipart_upload(destination_path)
+
+        condition = threading.Condition()
+        active = [0]
+        errors = []
+
+        def upload_part(part_num, offset, size):
+            try:
+                self._upload_tuned_part(mp, file_path, part_num, offset, size,
+                                        tuner, progress_reporter)
+            except Exception, ex:
+                errors.append(ex)
+            finally:
+                with condition:
+                    active[0] -= 1
+                    condition.notify_all()
+
+        try:
+            threads = []
+            offset = 0
+            part_num = 0
+            while offset < file_size and not errors:
+                with condition:
+                    while active[0] >= tuner.in_flight:
+                        condition.wait()
+                    active[0] += 1
+
+                part_num += 1
+                # stay within the max number of parts
+                remaining = file_size - offset
+                min_size = remaining / (S3_MAX_PARTS - part_num + 1) + 1
+                size = min(max(tuner.part_size, min_size), remaining)
+
+                thread = threading.Thread(target=upload_part,
+                                          args=(part_num, offset, size))
+                thread.start()
+                threads.append(thread)
+                offset += size
+
+            for thread in threads:
+                thread.join()
+
+            if errors:
+                raise errors[0]
+
+            mp.complete_upload()
+        except Exception:
+            mp.cancel_upload()
+            raise
+
+        settings = tuner.get_settings()
+        save_tuning(tuning_coll, tuning_key, settings)
+        logger.info("S3BucketTarget: Autotuned multi-part put for %s "
+                    "completed successfully! (%s parts, tuning: %s)" %
+                    (file_path, part_num, settings))
+
+    ###########################################################################
+    def _upload_tuned_part(self, mp, file_path, part_num, offset, size, tuner,
+                           progress_reporter=None):
+        # each part uses its own connection
+        part_mp = MultiPartUpload(self._get_bucket())
+        part_mp.key_name = mp.key_name
+        part_mp.id = mp.id
+        # one stream for all attempts so that retried bytes count once
+        callback = self._progress_callback(progress_reporter)
+
+        for attempt in range(1, PART_MAX_ATTEMPTS + 1):
+            start = time.time()
+            try:
+                logger.debug("Uploading file part %d (%s bytes)" %
+                             (part_num, size))
+                transfer_args = self._transfer_args(callback=callback)
+                with FilePart(file_path, offset, size) as part:
+                    part_mp.upload_part_from_file(part, part_num, size=size,
+                                                  **transfer_args)
+                tuner.record_part(size, time.time() - start)
+                return
+            except Exception, e:
+                tuner.record_failure()
+                if attempt == PART_MAX_ATTEMPTS:
+                    raise
+                logger.warning("S3BucketTarget: Error while uploading part "
+                               "%s of %s (attempt %s). Retrying... Cause: %s"
+                               % (part_num, file_path, attempt, e))
+
+    ###########################################################################
+    def get_file(self, file_reference, destination, progress_reporter=None):
         try:
 
             file_path = file_reference.file_path
@@ -279,7 +576,7 @@ class S3BucketTarget(BackupTarget):
                   (file_path, self.bucket_name))
 
             bucket = self._get_bucket()
-            key = bucket.get_key(file_path)
+            key = self._get_existing_key(bucket, file_path)
 
             if not key:
                 raise TargetFileNotFoundError("No such file '%s' in bucket "
@@ -288,9 +585,13 @@ class S3BucketTarget(BackupTarget):
 
             file_obj = open(os.path.join(destination, file_name), mode="w")
 
-            num_call_backs = key.size / 1000
-            key.get_contents_to_file(file_obj, cb=_download_progress,
-                                     num_cb=num_call_backs)
+            if progress_reporter:
+                progress_reporter.expect(key.size)
+
+            callback = (self._progress_callback(progress_reporter) or
+                        _console_download_progress())
+            key.get_contents_to_file(file_obj,
+                                     **self._transfer_args(callback=callback))
 
             print("Download completed successfully!!")
 
@@ -300,6 +601,36 @@ class S3BucketTarget(BackupTarget):
                    (file_path, self.bucket_name, e))
             raise TargetError(msg, cause=e)
 
+    ###########################################################################
+    def _transfer_args(self, callback=None, num_cb=None):
+        """
+            Returns the boto cb/num_cb kwargs for a transfer. Throttled
+            transfers get called back on every buffer (num_cb=-1)
+        """
+        cb = self._transfer_callback(callback=callback)
+        if cb is None:
+            return {}
+        elif cb is callback:
+            return {"cb": cb, "num_cb": num_cb or TRANSFER_NUM_CB}
+        else:
+            return {"cb": cb, "num_cb": -1}
+
+    ###########################################################################
+    def _get_existing_key(self, bucket, file_path):
+        """
+            Returns the key for the specified path or None if it does not
+            exist. Files found in the inventory are answered without a HEAD
+            request
+        """
+        file_info = self.inventory and self.inventory.lookup(file_path)
+        if file_info and file_info[0]:
+            file_exists, file_size = file_info
+            key = Key(bucket, file_path)
+            key.size = file_size
+            return key
+
+        return bucket.get_key(file_path)
+
     ###########################################################################
     def do_delete_file(self, file_reference):
         try:
@@ -324,6 +655,11 @@ class S3BucketTarget(BackupTarget):
     def container_name(self):
         return self.bucket_name
 
+    ###########################################################################
+    @property
+    def account_identity(self):
+        return self.encrypted_access_key
+
     ###########################################################################
     @property
     def bucket_name(self):
@@ -333,6 +669,19 @@ class S3BucketTarget(BackupTarget):
     def bucket_name(self, bucket_name):
         self._bucket_name = str(bucket_name)
 
+    ###########################################################################
+    @property
+    def autotune_uploads(self):
+        """
+            When set, multi-part uploads autotune their part size and number
+            of parts in flight
+        """
+        return self._autotune_uploads
+
+    @autotune_uploads.setter
+    def autotune_uploads(self, val):
+        self._autotune_uploads = val
+
     ###########################################################################
     def _get_bucket(self):
         conn = S3Connection(self.access_key, self.secret_key)
@@ -387,13 +736,18 @@ class S3BucketTarget(BackupTarget):
         ak = "xxxxx" if display_only else self.encrypted_access_key
         sk = "xxxxx" if display_only else self.encrypted_secret_key
 
-        return {
+        doc = {
             "_type": "S3BucketTarget",
             "bucketName": self.bucket_name,
             "encryptedAccessKey": ak,
             "encryptedSecretKey": sk
         }
 
+        if self.autotune_uploads:
+            doc["autotuneUploads"] = self.autotune_uploads
+
+        return self._export_options(doc, display_only=display_only)
+
     ###########################################################################
     def validate(self):
         errors = []
@@ -422,7 +776,8 @@ class EbsSnapshotTarget(BackupTarget):
         self._ec2_connection = None
 
     ###########################################################################
-    def put_file(self, file_path, destination_path=None):
+    def put_file(self, file_path, destination_path=None,
+                 overwrite_existing=False, progress_reporter=None):
         raise Exception("Unsupported operation")
 
     ###########################################################################
@@ -505,7 +860,8 @@ class RackspaceCloudFilesTarget(BackupTarget):
     @robustify(max_attempts=3, retry_interval=5,
                do_on_exception=raise_if_not_retriable,
                do_on_failure=raise_exception)
-    def do_put_file(self, file_path, destination_path):
+    def do_put_file(self, file_path, destination_path,
+                    progress_reporter=None):
 
         # determine single/multi part upload
         file_size = os.path.getsize(file_path)
@@ -515,17 +871,24 @@ class RackspaceCloudFilesTarget(BackupTarget):
 
         if file_size >= CF_MULTIPART_MIN_SIZE:
             self._multi_part_put(file_path, destination_path, file_size)
+            # st does not report progress so report it all at the end
+            if progress_reporter:
+                progress_reporter.add(file_size)
         else:
-            self._single_part_put(file_path, destination_path)
+            self._single_part_put(file_path, destination_path,
+                                  progress_reporter=progress_reporter)
 
         return FileReference(file_path=destination_path,
                              file_size=file_size)
 
     ###########################################################################
-    def _single_part_put(self, file_path, destination_path):
+    def _single_part_put(self, file_path, destination_path,
+                         progress_reporter=None):
         container = self._get_container()
         container_obj = container.create_object(destination_path)
-        container_obj.load_from_filename(file_path)
+        callback = self._transfer_callback(
+            callback=self._progress_callback(progress_reporter))
+        container_obj.load_from_filename(file_path, callback=callback)
 
     ###########################################################################
     def _multi_part_put(self, file_path, destination_path, file_size):
@@ -537,6 +900,11 @@ class RackspaceCloudFilesTarget(BackupTarget):
         logger.info("RackspaceCloudFilesTarget: Starting multi-part put "
                     "for %s " % file_path)
 
+        if self._get_bandwidth_limiters():
+            logger.warning("RackspaceCloudFilesTarget: Multi-part puts are "
+                           "done by the st command and are not bandwidth "
+                           "limited")
+
         # calculate chunk size
         # split into 10 chunks if possible
         chunk_size = int(file_size / 10)
@@ -576,7 +944,24 @@ class RackspaceCloudFilesTarget(BackupTarget):
         return False, None
 
     ###########################################################################
-    def get_file(self, file_reference, destination):
+    def _list_files(self):
+        """
+            Override. Pages through the container listing using markers
+        """
+        container = self._get_container()
+        marker = None
+        while True:
+            page = container.list_objects_info(limit=CF_LIST_PAGE_SIZE,
+                                               marker=marker)
+            if not page:
+                break
+            for obj_info in page:
+                yield obj_info["name"], obj_info["bytes"]
+
+            marker = page[-1]["name"]
+
+    ###########################################################################
+    def get_file(self, file_reference, destination, progress_reporter=None):
         try:
 
             file_path = file_reference.file_path
@@ -593,8 +978,13 @@ class RackspaceCloudFilesTarget(BackupTarget):
 
             file_name = file_reference.file_name
             des_file = os.path.join(destination, file_name)
-            container_obj.save_to_filename(des_file,
-                                           callback=_download_progress)
+            if progress_reporter:
+                progress_reporter.expect(container_obj.size)
+
+            callback = self._transfer_callback(
+                callback=(self._progress_callback(progress_reporter) or
+                          _console_download_progress()))
+            container_obj.save_to_filename(des_file, callback=callback)
             print("\nDownload completed successfully!!")
 
         except Exception, e:
@@ -631,6 +1021,11 @@ class RackspaceCloudFilesTarget(BackupTarget):
     def container_name(self, container_name):
         self._container_name = str(container_name)
 
+    ###########################################################################
+    @property
+    def account_identity(self):
+        return self.encrypted_username
+
     ###########################################################################
     def _get_container(self):
         conn = cloudfiles.get_connection(username=self.username,
@@ -687,13 +1082,15 @@ class RackspaceCloudFilesTarget(BackupTarget):
     def to_document(self, display_only=False):
         eu = "xxxxx" if display_only else self.encrypted_username
         eak = "xxxxx" if display_only else self.encrypted_api_key
-        return {
+        doc = {
             "_type": "RackspaceCloudFilesTarget",
             "containerName": self.container_name,
             "encryptedUsername": eu,
             "encryptedApiKey": eak
         }
 
+        return self._export_options(doc, display_only=display_only)
+
     ###########################################################################
     def validate(self):
         errors = []
@@ -722,12 +1119,15 @@ class AzureContainerTarget(BackupTarget):
         self._account_key = None
 
     ###########################################################################
-    def put_file(self, file_path, destination_path):
+    def put_file(self, file_path, destination_path=None,
+                 overwrite_existing=False, progress_reporter=None):
         try:
 
             # calculating file size
             file_size = os.path.getsize(file_path)
             destination_path = os.path.basename(file_path)
+            if progress_reporter:
+                progress_reporter.expect(file_size)
 
             logger.info("AzureContainerTarget: Uploading %s (%s bytes) "
                         "to container %s" %
@@ -735,6 +1135,8 @@ class AzureContainerTarget(BackupTarget):
 
 
             self._single_part_put(file_path, destination_path)
+            if progress_reporter:
+                progress_reporter.add(file_size)
 
             logger.info("AzureContainerTarget: Uploading %s (%s bytes) "
                         "to container %s completed successfully!!" %
@@ -752,6 +1154,10 @@ class AzureContainerTarget(BackupTarget):
     def _single_part_put(self, file_path, destination_path):
         blob_service = self._get_blob_service()
         fp = open(file_path, 'r').read()
+        # put_blob sends the whole blob in one request so throttling can only
+        # be done upfront
+        for limiter in self._get_bandwidth_limiters():
+            limiter.throttle(len(fp))
         blob_service.put_blob(self.container_name, destination_path, fp,
                               x_ms_blob_type='BlockBlob')
 
@@ -759,9 +1165,27 @@ class AzureContainerTarget(BackupTarget):
     def _multi_part_put(self, file_path, destination_path, file_size):
         pass
 
+    ###########################################################################
+    def _list_files(self):
+        """
+            Override. Pages through the container listing using the markers
+            returned by azure
+        """
+        blob_service = self._get_blob_service()
+        marker = None
+        while True:
+            page = blob_service.list_blobs(self.container_name, marker=marker,
+                                           maxresults=AZURE_LIST_PAGE_SIZE)
+            for blob in page.blobs:
+                yield blob.name, blob.properties.content_length
+
+            marker = page.next_marker
+            if not marker:
+                break
+
 
     ###########################################################################
-    def get_file(self, file_reference, destination):
+    def get_file(self, file_reference, destination, progress_reporter=None):
         raise Exception("AzureContainerTarget: get_file not supported yet")
 
     ###########################################################################
@@ -777,6 +1201,11 @@ class AzureContainerTarget(BackupTarget):
     def container_name(self, container_name):
         self._container_name = str(container_name)
 
+    ###########################################################################
+    @property
+    def account_identity(self):
+        return self.account_name
+
     ###########################################################################
     def _get_blob_service(self):
         return BlobService(account_name=self.account_name,
@@ -803,13 +1232,15 @@ class AzureContainerTarget(BackupTarget):
 
     ###########################################################################
     def to_document(self, display_only=False):
-        return {
+        doc = {
             "_type": "AzureContainerTarget",
             "containerName": self.container_name,
             "accountName": "xxxxx" if display_only else self.account_name,
             "accountKey": "xxxxx" if display_only else self.account_key
         }
 
+        return self._export_options(doc, display_only=display_only)
+
     ###########################################################################
     def validate(self):
         errors = []
@@ -824,6 +1255,239 @@ class AzureContainerTarget(BackupTarget):
             errors.append("Missing 'accountKey' property")
 
         return errors
+
+###############################################################################
+# CompositeTarget
+###############################################################################
+class CompositeTarget(BackupTarget):
+    """
+        A list of targets that every file gets uploaded to. Uploads to the
+        child targets run concurrently off the same local file and the
+        resulting references are tracked per child target
+    """
+    ###########################################################################
+    def __init__(self):
+        BackupTarget.__init__(self)
+        self._targets = []
+
+    ###########################################################################
+    @property
+    def targets(self):
+        return self._targets
+
+    @targets.setter
+    def targets(self, targets):
+        self._targets = targets
+
+    ###########################################################################
+    @property
+    def container_name(self):
+        return ", ".join(str(target.container_name)
+                         for target in self.targets)
+
+    ###########################################################################
+    def put_file(self, file_path, destination_path=None,
+                 overwrite_existing=False, progress_reporter=None,
+                 completed_reference=None):
+        """
+            Uploads the file to all child targets. Child uploads recorded in
+            completed_reference (the partial reference of a previous attempt)
+            for the same destination path are reused and not re-uploaded.
+            Raises CompositeTargetPartialUploadError, holding the partial
+            reference, if only some of the child uploads succeed
+        """
+        destination_path = destination_path or os.path.basename(file_path)
+        file_size = os.path.getsize(file_path)
+
+        references = [None] * len(self.targets)
+        failures = [None] * len(self.targets)
+
+        if isinstance(completed_reference, CompositeTargetReference):
+            for i, ref in enumerate(completed_reference.references):
+                if (i < len(references) and ref and
+                        ref.file_path == destination_path):
+                    references[i] = ref
+
+        def upload(i, target):
+            try:
+                references[i] = target.put_file(
+                    file_path, destination_path=destination_path,
+                    overwrite_existing=overwrite_existing,
+                    progress_reporter=progress_reporter)
+            except Exception, e:
+                logger.error("CompositeTarget: Error while uploading '%s' to "
+                             "%s '%s': %s" % (file_path, target.target_type,
+                                              target.container_name, e))
+                failures[i] = e
+
+        threads = []
+        for i, target in enumerate(self.targets):
+            if references[i]:
+                logger.info("CompositeTarget: '%s' already uploaded to %s "
+                            "'%s'. Skipping..." %
+                            (destination_path, target.target_type,
+                             target.container_name))
+                continue
+
+            thread = threading.Thread(target=upload, args=(i, target))
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        target_ref = CompositeTargetReference(file_path=destination_path,
+                                              file_size=file_size,
+                                              references=references)
+
+        errors = filter(None, failures)
+        if errors:
+            if not filter(None, references):
+                # nothing succeeded so raise the error as is
+                raise errors[0]
+            raise CompositeTargetPartialUploadError(destination_path,
+                                                    self.container_name,
+                                                    target_ref, errors)
+
+        return target_ref
+
+    ###########################################################################
+    def get_file(self, file_reference, destination, progress_reporter=None):
+        """
+            Downloads the file from the first child target that succeeds
+        """
+        error = None
+        for target, ref in self._child_references(file_reference):
+            if not ref:
+                continue
+            try:
+                return target.get_file(ref, destination,
+                                       progress_reporter=progress_reporter)
+            except Exception, e:
+                logger.error("CompositeTarget: Error while downloading '%s' "
+                             "from %s '%s': %s" %
+                             (ref.file_path, target.target_type,
+                              target.container_name, e))
+                error = e
+
+        if error:
+            raise error
+        else:
+            raise TargetFileNotFoundError("No target holds file '%s'" %
+                                          file_reference.file_path)
+
+    ###########################################################################
+    def delete_file(self, file_reference):
+        errors = []
+        for target, ref in self._child_references(file_reference):
+            if not ref:
+                continue
+            try:
+                target.delete_file(ref)
+            except Exception, e:
+                errors.append("%s '%s': %s" % (target.target_type,
+                                               target.container_name, e))
+
+        if errors:
+            msg = ("CompositeTarget: Failed to delete '%s' from %s target(s)"
+                   % (file_reference.file_path, len(errors)))
+            raise TargetDeleteError(msg, details="; ".join(errors))
+
+    ###########################################################################
+    def file_exists(self, file_path):
+        return all(target.file_exists(file_path) for target in self.targets)
+
+    ###########################################################################
+    def _child_references(self, file_reference):
+        """
+            Returns a list of (target, reference) pairs
+        """
+        if isinstance(file_reference, CompositeTargetReference):
+            return zip(self.targets, file_reference.references)
+        else:
+            return [(target, file_reference) for target in self.targets]
+
+    ###########################################################################
+    def to_document(self, display_only=False):
+        doc = {
+            "_type": "CompositeTarget",
+            "targets": [target.to_document(display_only=display_only)
+                        for target in self.targets]
+        }
+
+        return self._export_options(doc, display_only=display_only)
+
+    ###########################################################################
+    def validate(self):
+        errors = []
+
+        if not self.targets:
+            errors.append("Missing 'targets' property")
+
+        for target in self.targets:
+            errors.extend(target.validate())
+
+        return errors
+
+###############################################################################
+# TargetInventory
+###############################################################################
+class TargetInventory(object):
+    """
+        In-process index of the files in a target container (path => size).
+        Built from a full (paginated) listing of the container and updated
+        incrementally on the puts/deletes made by this process. Lookups
+        return None once the inventory is older than max_age so that callers
+        fall back to a live lookup
+    """
+    ###########################################################################
+    def __init__(self, max_age=INVENTORY_MAX_AGE):
+        self._max_age = max_age
+        self._files = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    ###########################################################################
+    def is_stale(self):
+        return (self._files is None or
+                time.time() - self._loaded_at > self._max_age)
+
+    ###########################################################################
+    def load(self, file_infos):
+        files = {}
+        for file_path, file_size in file_infos:
+            files[file_path] = file_size
+
+        with self._lock:
+            self._files = files
+            self._loaded_at = time.time()
+
+    ###########################################################################
+    def lookup(self, file_path):
+        """
+            Returns a tuple of (file_exists, file_size) or None if the
+            inventory is stale
+        """
+        with self._lock:
+            if self.is_stale():
+                return None
+            elif file_path in self._files:
+                return True, self._files[file_path]
+            else:
+                return False, None
+
+    ###########################################################################
+    def file_added(self, file_path, file_size):
+        with self._lock:
+            if self._files is not None:
+                self._files[file_path] = file_size
+
+    ###########################################################################
+    def file_removed(self, file_path):
+        with self._lock:
+            if self._files is not None:
+                self._files.pop(file_path, None)
+
 ###############################################################################
 # Target Reference Classes
 ###############################################################################
@@ -832,6 +1496,8 @@ class TargetReference(MBSObject):
     """
         Represents a reference to the file that gets uploaded to target
     """
+    __slots__ = ("_expired_date", "_file_size")
+
     ###########################################################################
     def __init__(self):
         self._expired_date = None
@@ -871,12 +1537,27 @@ class TargetReference(MBSObject):
 ###############################################################################
 class FileReference(TargetReference):
 
+    __slots__ = ("_file_path",)
+
     ###########################################################################
     def __init__(self, file_path=None, file_size=None):
         TargetReference.__init__(self)
         self.file_path = file_path
         self.file_size = file_size
 
+    ###########################################################################
+    @classmethod
+    def from_document(cls, doc, maker=None):
+        """
+            Builds the reference from its document without going through the
+            generic maker
+        """
+        reference = cls.__new__(cls)
+        reference._file_path = doc.get("filePath")
+        reference._file_size = doc.get("fileSize")
+        reference._expired_date = doc.get("expiredDate")
+        return reference
+
     ###########################################################################
     @property
     def file_path(self):
@@ -909,6 +1590,8 @@ class CloudBlockStorageSnapshotReference(TargetReference):
     """
         Base class for cloud block storage snapshot references
     """
+    __slots__ = ("_cloud_block_storage", "_status")
+
     ###########################################################################
     def __init__(self, cloud_block_storage=None, status=None):
         TargetReference.__init__(self)
@@ -946,6 +1629,8 @@ class CloudBlockStorageSnapshotReference(TargetReference):
 ###############################################################################
 class EbsSnapshotReference(CloudBlockStorageSnapshotReference):
 
+    __slots__ = ("_snapshot_id", "_volume_size", "_progress", "_start_time")
+
     ###########################################################################
     def __init__(self, snapshot_id=None, cloud_block_storage=None, status=None,
                  volume_size=None, progress=None, start_time=None ):
@@ -957,6 +1642,25 @@ class EbsSnapshotReference(CloudBlockStorageSnapshotReference):
         self._progress = progress
         self._start_time = start_time
 
+    ###########################################################################
+    @classmethod
+    def from_document(cls, doc, maker):
+        """
+            Builds the reference from its document. Only the cloud block
+            storage goes through the maker
+        """
+        reference = cls.__new__(cls)
+        cbs_doc = doc.get("cloudBlockStorage")
+        reference._cloud_block_storage = cbs_doc and maker.make(cbs_doc)
+        reference._status = doc.get("status")
+        reference._snapshot_id = doc.get("snapshotId")
+        reference._volume_size = doc.get("volumeSize")
+        reference._progress = doc.get("progress")
+        reference._start_time = doc.get("startTime")
+        reference._expired_date = doc.get("expiredDate")
+        reference._file_size = doc.get("fileSize")
+        return reference
+
     ###########################################################################
     @property
     def snapshot_id(self):
@@ -1009,8 +1713,72 @@ class EbsSnapshotReference(CloudBlockStorageSnapshotReference):
 
         return doc
 
+###############################################################################
+# CompositeTargetReference
+###############################################################################
+class CompositeTargetReference(FileReference):
+    """
+        Reference to a file uploaded to a CompositeTarget. Holds one reference
+        per child target (in the same order as the targets), None for child
+        uploads that did not complete
+    """
+    __slots__ = ("_references",)
+
+    ###########################################################################
+    def __init__(self, file_path=None, file_size=None, references=None):
+        FileReference.__init__(self, file_path=file_path, file_size=file_size)
+        self._references = references or []
+
+    ###########################################################################
+    @property
+    def references(self):
+        return self._references
+
+    @references.setter
+    def references(self, references):
+        self._references = references
+
+    ###########################################################################
+    @property
+    def complete(self):
+        return all(self.references)
+
+    ###########################################################################
+    def to_document(self, display_only=False):
+        doc = FileReference.to_document(self, display_only=display_only)
+        doc.update({
+            "_type": "CompositeTargetReference",
+            "references": [ref and ref.to_document(display_only=display_only)
+                           for ref in self.references]
+        })
+
+        return doc
+
 ###############################################################################
 # HELPERS
+###############################################################################
+# inventories are shared by all target objects pointing to the same container
+_target_inventories = {}
+_target_inventories_lock = threading.Lock()
+
+def get_target_inventory(target):
+    key = (target.target_type, target.account_identity,
+           target.container_name)
+    with _target_inventories_lock:
+        if key not in _target_inventories:
+            _target_inventories[key] = TargetInventory()
+        return _target_inventories[key]
+
+###############################################################################
+def _console_download_progress():
+    """
+        Returns the stdout download progress callback only if stdout is a
+        terminal (i.e. not redirected to the logger)
+    """
+    isatty = getattr(sys.stdout, "isatty", None)
+    if isatty and isatty():
+        return _download_progress
+
 ###############################################################################
 def _download_progress(transferred, size):
     percentage = (float(transferred)/float(size)) * 100
@@ -1,6 +1,8 @@
 __author__ = 'abdul'
 
 
+from datetime import timedelta
+
 from date_utils import date_now
 from base import MBSObject
 
@@ -25,10 +27,78 @@ PRIORITY_HIGH = 0
 PRIORITY_MEDIUM = 5
 PRIORITY_LOW = 10
 
+# Minimum time before rescheduling a failed task (5 minutes)
+RESCHEDULE_PERIOD = 5 * 60
+
+# Max number of recent log entries kept in the task document. The complete
+# event log is stored in the task_events collection
+MAX_RECENT_LOGS = 50
+
+###############################################################################
+# PROPERTY EXPORTERS
+###############################################################################
+# Exporters return the to_document() value of a single task property.
+# They are called as exporter(task, display_only)
+
+def attribute_exporter(attr):
+    return lambda task, display_only: getattr(task, attr)
+
+###############################################################################
+def optional_attribute_exporter(attr):
+    """
+        For properties that to_document() only includes when set
+    """
+    return lambda task, display_only: getattr(task, attr) or None
+
+###############################################################################
+def document_exporter(attr):
+    def export(task, display_only):
+        value = getattr(task, attr)
+        if value:
+            return value.to_document(display_only=display_only)
+    return export
+
 ###############################################################################
 # MBSTask
 ###############################################################################
 class MBSTask(MBSObject):
+
+    __slots__ = ("_id", "_created_date", "_state", "_engine_guid", "_strategy",
+                 "_logs", "_start_date", "_end_date", "_tags", "_try_count",
+                 "_reschedulable", "_workspace", "_priority",
+                 "_queue_latency_in_minutes", "_log_target_reference",
+                 "_transfer_progress", "_last_event_date", "_reschedule_after",
+                 "_due_alert_at", "_logged_events", "_error_count",
+                 "_warning_count", "_archived_date", "_event_index")
+
+    # document property => exporter
+    PROPERTY_EXPORTERS = {
+        "_id": attribute_exporter("id"),
+        "createdDate": attribute_exporter("created_date"),
+        "state": attribute_exporter("state"),
+        "strategy": document_exporter("strategy"),
+        "startDate": attribute_exporter("start_date"),
+        "endDate": attribute_exporter("end_date"),
+        "engineGuid": attribute_exporter("engine_guid"),
+        "logs": lambda task, display_only: task.export_logs(),
+        "workspace": attribute_exporter("workspace"),
+        "tryCount": attribute_exporter("try_count"),
+        "tags": optional_attribute_exporter("tags"),
+        "reschedulable": attribute_exporter("reschedulable"),
+        "priority": attribute_exporter("priority"),
+        "queueLatencyInMinutes": attribute_exporter(
+            "queue_latency_in_minutes"),
+        "logTargetReference": document_exporter("log_target_reference"),
+        "transferProgress": optional_attribute_exporter("transfer_progress"),
+        "lastEventDate": optional_attribute_exporter("last_event_date"),
+        "rescheduleAfter": optional_attribute_exporter("reschedule_after"),
+        "dueAlertAt": optional_attribute_exporter("due_alert_at"),
+        "loggedEvents": attribute_exporter("logged_events"),
+        "errorCount": attribute_exporter("error_count"),
+        "warningCount": attribute_exporter("warning_count"),
+        "archivedDate": optional_attribute_exporter("archived_date")
+    }
+
     def __init__(self):
         # init fields
         self._id = None
@@ -46,6 +116,16 @@ class MBSTask(MBSObject):
         self._priority = PRIORITY_LOW
         self._queue_latency_in_minutes = None
         self._log_target_reference = None
+        self._transfer_progress = None
+        self._last_event_date = None
+        self._reschedule_after = None
+        self._due_alert_at = None
+        self._logged_events = []
+        self._error_count = 0
+        self._warning_count = 0
+        self._archived_date = None
+        # EventLogIndex of logs. Built on first lookup
+        self._event_index = None
 
     ###########################################################################
     def execute(self):
@@ -121,6 +201,7 @@ class MBSTask(MBSObject):
     @logs.setter
     def logs(self, logs):
         self._logs = logs
+        self._event_index = None
 
     ###########################################################################
     @property
@@ -209,6 +290,100 @@ class MBSTask(MBSObject):
     def log_target_reference(self, target_reference):
         self._log_target_reference = target_reference
 
+    ###########################################################################
+    @property
+    def transfer_progress(self):
+        """
+            Progress of the current/last upload or download:
+            {bytesTransferred, totalBytes, rateMBps, etaSeconds, updatedDate}
+        """
+        return self._transfer_progress
+
+    @transfer_progress.setter
+    def transfer_progress(self, val):
+        self._transfer_progress = val
+
+    ###########################################################################
+    @property
+    def last_event_date(self):
+        """
+            Date of the last logged event. Materialized for indexed queries
+        """
+        return self._last_event_date
+
+    @last_event_date.setter
+    def last_event_date(self, val):
+        self._last_event_date = val
+
+    ###########################################################################
+    @property
+    def reschedule_after(self):
+        """
+            Date after which the task can be rescheduled if it fails
+            (last event date + RESCHEDULE_PERIOD)
+        """
+        return self._reschedule_after
+
+    @reschedule_after.setter
+    def reschedule_after(self, val):
+        self._reschedule_after = val
+
+    ###########################################################################
+    @property
+    def due_alert_at(self):
+        """
+            Date after which the task is considered past due if it is still
+            scheduled
+        """
+        return self._due_alert_at
+
+    @due_alert_at.setter
+    def due_alert_at(self, val):
+        self._due_alert_at = val
+
+    ###########################################################################
+    @property
+    def archived_date(self):
+        """
+            Date the task was moved to the archive collection (if archived)
+        """
+        return self._archived_date
+
+    @archived_date.setter
+    def archived_date(self, val):
+        self._archived_date = val
+
+    ###########################################################################
+    @property
+    def logged_events(self):
+        """
+            Distinct names of all events ever logged (logs only has the
+            MAX_RECENT_LOGS most recent entries)
+        """
+        return self._logged_events
+
+    @logged_events.setter
+    def logged_events(self, val):
+        self._logged_events = val
+
+    ###########################################################################
+    @property
+    def error_count(self):
+        return self._error_count
+
+    @error_count.setter
+    def error_count(self, val):
+        self._error_count = val
+
+    ###########################################################################
+    @property
+    def warning_count(self):
+        return self._warning_count
+
+    @warning_count.setter
+    def warning_count(self, val):
+        self._warning_count = val
+
     ###########################################################################
     def log_event(self, event_type=EVENT_TYPE_INFO, name=None, message=None,
                   details=None):
@@ -223,28 +398,56 @@ class MBSTask(MBSObject):
         log_entry.details = details
 
         logs.append(log_entry)
-        self.logs = logs
+        # keep the event index (not reset through the logs setter)
+        self._logs = logs[-MAX_RECENT_LOGS:]
+        if self._event_index:
+            self._event_index.add(log_entry)
+
+        # maintain event summary
+        if name and name not in self.logged_events:
+            self.logged_events.append(name)
+        if event_type == EVENT_TYPE_ERROR:
+            self.error_count += 1
+        elif event_type == EVENT_TYPE_WARNING:
+            self.warning_count += 1
+
+        event_dates = event_date_fields(log_entry)
+        self.last_event_date = event_dates["lastEventDate"]
+        self.reschedule_after = event_dates["rescheduleAfter"]
+
         return log_entry
 
     ###########################################################################
     def has_errors(self):
-        return len(self.get_errors()) > 0
+        return self.error_count > 0 or len(self.get_errors()) > 0
 
     ###########################################################################
     def has_warnings(self):
-        return len(self.get_warnings()) > 0
+        return self.warning_count > 0 or len(self.get_warnings()) > 0
 
     ###########################################################################
     def get_errors(self):
+        """
+            Errors within the recent logs. See error_count for the total
+        """
         return self._get_logs_by_event_type(EVENT_TYPE_ERROR)
 
     ###########################################################################
     def get_warnings(self):
+        """
+            Warnings within the recent logs. See warning_count for the total
+        """
         return self._get_logs_by_event_type(EVENT_TYPE_WARNING)
 
     ###########################################################################
     def _get_logs_by_event_type(self, event_type):
-        return filter(lambda entry: entry.event_type == event_type, self.logs)
+        return self._get_event_index().get_entries_by_type(event_type)
+
+    ###########################################################################
+    def _get_event_index(self):
+        if self._event_index is None:
+            self._event_index = EventLogIndex(self.logs)
+        return self._event_index
 
     ###########################################################################
     def is_event_logged(self, event_name):
@@ -257,8 +460,12 @@ class MBSTask(MBSObject):
         if not isinstance(event_name, list):
             event_name = [event_name]
 
-        logs = filter(lambda entry: entry.name in event_name, self.logs)
-        return len(logs) > 0
+        if any(name in self.logged_events for name in event_name):
+            return True
+
+        # tasks created before loggedEvents was maintained
+        event_index = self._get_event_index()
+        return any(event_index.get_first_entry(name) for name in event_name)
 
     ###########################################################################
     def _get_state_set_date(self, state):
@@ -266,10 +473,7 @@ class MBSTask(MBSObject):
            Returns the date of when the backup was set to the specified state.
            None if state was never set
         """
-
-        state_logs = filter(lambda entry: entry.state == state, self.logs)
-        if state_logs:
-            return state_logs[0].date
+        return self._get_event_index().get_state_set_date(state)
 
     ###########################################################################
     def to_document(self, display_only=False):
@@ -283,7 +487,10 @@ class MBSTask(MBSObject):
             "engineGuid": self.engine_guid,
             "logs": self.export_logs(),
             "workspace": self.workspace,
-            "tryCount": self.try_count
+            "tryCount": self.try_count,
+            "loggedEvents": self.logged_events,
+            "errorCount": self.error_count,
+            "warningCount": self.warning_count
         }
 
         if self.id:
@@ -305,8 +512,35 @@ class MBSTask(MBSObject):
             doc["logTargetReference"] =\
                 self.log_target_reference.to_document(display_only=display_only)
 
+        if self.transfer_progress:
+            doc["transferProgress"] = self.transfer_progress
+
+        if self.last_event_date:
+            doc["lastEventDate"] = self.last_event_date
+
+        if self.reschedule_after:
+            doc["rescheduleAfter"] = self.reschedule_after
+
+        if self.due_alert_at:
+            doc["dueAlertAt"] = self.due_alert_at
+
+        if self.archived_date:
+            doc["archivedDate"] = self.archived_date
+
         return doc
 
+    ###########################################################################
+    def export_property(self, name, display_only=False):
+        """
+            Returns the value of the specified property as exported by
+            to_document() while only serializing that property
+        """
+        exporter = self.PROPERTY_EXPORTERS.get(name)
+        if exporter:
+            return exporter(self, display_only)
+        else:
+            return self.to_document(display_only=display_only).get(name)
+
     ###########################################################################
     def export_logs(self, event_type=None):
         result = []
@@ -320,11 +554,66 @@ class MBSTask(MBSObject):
         return result
 
 
+###############################################################################
+# EventLogIndex
+###############################################################################
+class EventLogIndex(object):
+    """
+        Lookups over a task's log entries: event name => first/last entry,
+        state => first date and entries by event type. Built once from the
+        task's logs then maintained incrementally by log_event()
+    """
+    __slots__ = ("_first_entries", "_last_entries", "_state_dates",
+                 "_entries_by_type")
+    ###########################################################################
+    def __init__(self, logs=None):
+        self._first_entries = {}
+        self._last_entries = {}
+        self._state_dates = {}
+        self._entries_by_type = {}
+        for log_entry in logs or []:
+            self.add(log_entry)
+
+    ###########################################################################
+    def add(self, log_entry):
+        if log_entry.name:
+            self._first_entries.setdefault(log_entry.name, log_entry)
+            self._last_entries[log_entry.name] = log_entry
+
+        if log_entry.state:
+            self._state_dates.setdefault(log_entry.state, log_entry.date)
+
+        entries = self._entries_by_type.setdefault(log_entry.event_type, [])
+        entries.append(log_entry)
+
+    ###########################################################################
+    def get_first_entry(self, name):
+        return self._first_entries.get(name)
+
+    ###########################################################################
+    def get_last_entry(self, name):
+        return self._last_entries.get(name)
+
+    ###########################################################################
+    def get_state_set_date(self, state):
+        return self._state_dates.get(state)
+
+    ###########################################################################
+    def get_entries_by_type(self, event_type):
+        return list(self._entries_by_type.get(event_type, []))
+
+    ###########################################################################
+    def count(self, event_type):
+        return len(self._entries_by_type.get(event_type, []))
+
 ###############################################################################
 # EventLogEntry
 ###############################################################################
 class EventLogEntry(MBSObject):
 
+    __slots__ = ("_event_type", "_name", "_date", "_state", "_message",
+                 "_details")
+
     ###########################################################################
     def __init__(self):
         self._event_type = None
@@ -334,6 +623,22 @@ class EventLogEntry(MBSObject):
         self._message = None
         self._details = None
 
+    ###########################################################################
+    @classmethod
+    def from_document(cls, doc, maker=None):
+        """
+            Builds the entry from its document without going through the
+            generic maker
+        """
+        log_entry = cls.__new__(cls)
+        log_entry._event_type = doc.get("eventType")
+        log_entry._name = doc.get("name")
+        log_entry._date = doc.get("date")
+        log_entry._state = doc.get("state")
+        log_entry._message = doc.get("message")
+        log_entry._details = doc.get("details")
+        return log_entry
+
     ###########################################################################
     @property
     def event_type(self):
@@ -422,3 +727,14 @@ def state_change_log_entry(state, message=None):
 
 
     return log_entry
+
+###############################################################################
+def event_date_fields(log_entry):
+    """
+        Returns the materialized task fields that derive from the date of the
+        last logged event. Should be $set along with every $push to logs
+    """
+    return {
+        "lastEventDate": log_entry.date,
+        "rescheduleAfter": log_entry.date + timedelta(seconds=RESCHEDULE_PERIOD)
+    }
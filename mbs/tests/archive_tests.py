@@ -0,0 +1,30 @@
+from mbs.archive import ARCHIVE_MAX_LOGS, compact_task_document
+from mbs.benchmark import sample_backup_document
+
+from . import BaseTest
+
+
+###############################################################################
+# ArchiveTest
+###############################################################################
+class ArchiveTest(BaseTest):
+
+    ###########################################################################
+    def test_compact_task_document(self):
+        doc = sample_backup_document(log_count=100)
+        doc["sourceStats"]["repl"] = {"me": "host1:27017", "members": []}
+
+        archived = compact_task_document(doc)
+        self.assertEqual(archived["logs"], doc["logs"][-ARCHIVE_MAX_LOGS:])
+        self.assertEqual(archived["sourceStats"], {
+            "dataSize": doc["sourceStats"]["dataSize"],
+            "repl": {"me": "host1:27017"}
+        })
+        self.assertIn("archivedDate", archived)
+        # the original document is left untouched
+        self.assertEqual(len(doc["logs"]), 100)
+
+        # hydrates like any task document
+        backup = self.maker.make(archived)
+        self.assertEqual(backup.source_stats["dataSize"],
+                         doc["sourceStats"]["dataSize"])
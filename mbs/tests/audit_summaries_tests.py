@@ -0,0 +1,143 @@
+from datetime import datetime
+
+from mbs.audit_summaries import (AuditSummaryStore, COMPLETE_MARKER_ID,
+                                 count_states, summary_id)
+from mbs.backup import Backup
+from mbs.plan import BackupPlan
+from mbs.task import STATE_FAILED
+
+from . import BaseTest
+
+
+###############################################################################
+# UpdateRecorder: records the updates issued against a collection
+###############################################################################
+class UpdateRecorder(object):
+
+    ###########################################################################
+    def __init__(self):
+        self.updates = []
+
+    ###########################################################################
+    def update(self, spec, document, upsert=False):
+        self.updates.append((spec, document, upsert))
+
+    ###########################################################################
+    def find_one(self, spec):
+        for update_spec, document, upsert in reversed(self.updates):
+            if update_spec == spec:
+                return document
+
+    ###########################################################################
+    def find(self, spec, fields=None, sort=None):
+        return []
+
+
+###############################################################################
+class SummaryCollection(UpdateRecorder):
+
+    ###########################################################################
+    def __init__(self, summaries):
+        UpdateRecorder.__init__(self)
+        self.summaries = summaries
+        self.queries = []
+
+    ###########################################################################
+    def find(self, spec, fields=None, sort=None):
+        self.queries.append(spec)
+        return self.summaries
+
+
+###############################################################################
+# AuditSummariesTest
+###############################################################################
+class AuditSummariesTest(BaseTest):
+
+    ###########################################################################
+    def test_record_task(self):
+        collection = UpdateRecorder()
+        store = AuditSummaryStore(collection)
+
+        # one time backups are not recorded
+        backup = Backup()
+        backup.id = "backup-1"
+        backup.state = STATE_FAILED
+        store.record_task(backup)
+        self.assertEqual(collection.updates, [])
+
+        backup.plan = BackupPlan()
+        backup.plan.id = "plan-1"
+        backup.plan_occurrence = datetime(2013, 1, 2, 3)
+        store.record_task(backup)
+
+        spec, document, upsert = collection.updates[0]
+        self.assertEqual(spec, {"_id": "plan-1-20130102"})
+        self.assertTrue(upsert)
+        self.assertEqual(document["$set"]["date"], datetime(2013, 1, 2))
+        self.assertEqual(document["$set"]["occurrences.1357095600"], {
+            "backupId": "backup-1",
+            "planOccurrence": datetime(2013, 1, 2, 3),
+            "state": STATE_FAILED,
+            "errorCount": 0,
+            "warningCount": 0
+        })
+
+    ###########################################################################
+    def test_rebuild_marks_complete(self):
+        collection = UpdateRecorder()
+        store = AuditSummaryStore(collection)
+        self.assertFalse(store.covers(datetime(2013, 1, 2)))
+
+        # summaries are complete from the first full day rebuilt
+        store.rebuild(UpdateRecorder(), since=datetime(2013, 1, 1, 12))
+        self.assertEqual(collection.find_one({"_id": COMPLETE_MARKER_ID}),
+                         {"_id": COMPLETE_MARKER_ID,
+                          "completeSince": datetime(2013, 1, 2)})
+        self.assertFalse(store.covers(datetime(2013, 1, 1)))
+        self.assertTrue(store.covers(datetime(2013, 1, 2)))
+
+    ###########################################################################
+    def test_count_states(self):
+        summaries = [
+            {"occurrences": {"1": {"state": "SUCCEEDED"},
+                             "2": {"state": "FAILED"}}},
+            {"occurrences": {"3": {"state": "SUCCEEDED"}}}
+        ]
+        self.assertEqual(count_states(summaries),
+                         {"SUCCEEDED": 2, "FAILED": 1})
+        self.assertEqual(summary_id("plan-1", datetime(2013, 12, 1)),
+                         "plan-1-20131201")
+
+    ###########################################################################
+    def test_get_range_report(self):
+        collection = SummaryCollection([
+            {"planId": "plan-2",
+             "occurrences": {"1": {"state": "SUCCEEDED"}}},
+            {"planId": "plan-1",
+             "occurrences": {"1": {"state": "SUCCEEDED"},
+                             "2": {"state": "FAILED"}}},
+            {"planId": "plan-1",
+             "occurrences": {"3": {"state": "SUCCEEDED"}}}
+        ])
+        store = AuditSummaryStore(collection)
+        store.mark_complete_since(datetime(2013, 1, 1))
+
+        report = store.get_range_report(datetime(2013, 1, 1),
+                                        end_date=datetime(2013, 1, 8),
+                                        plan_ids=["plan-1", "plan-2"])
+        self.assertEqual(collection.queries, [{
+            "date": {"$gte": datetime(2013, 1, 1),
+                     "$lt": datetime(2013, 1, 8)},
+            "planId": {"$in": ["plan-1", "plan-2"]}
+        }])
+        self.assertTrue(report["complete"])
+        self.assertEqual(report["states"], {"SUCCEEDED": 3, "FAILED": 1})
+        self.assertEqual(report["plans"], [
+            {"planId": "plan-1", "states": {"SUCCEEDED": 2, "FAILED": 1}},
+            {"planId": "plan-2", "states": {"SUCCEEDED": 1}}
+        ])
+
+        # defaults to one day; days before the summaries are incomplete
+        report = store.get_range_report(datetime(2012, 12, 31))
+        self.assertEqual(report["endDate"], datetime(2013, 1, 1))
+        self.assertFalse(report["complete"])
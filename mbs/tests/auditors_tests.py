@@ -0,0 +1,369 @@
+from datetime import datetime
+
+from mock import patch
+
+import mbs.auditors
+
+from mbs.audit import AuditReport, PlanAuditReport
+from mbs.audit_summaries import AuditSummaryStore, COMPLETE_MARKER_ID
+from mbs.auditors import (GlobalAuditor, PlanAuditor, MAX_TOP_FAILURES,
+                          _push_top_failure)
+from mbs.benchmark import sample_backup_document
+from mbs.date_utils import date_to_seconds
+from mbs.plan import BackupPlan
+from mbs.simulation import simulated_mbs
+from mbs.task import STATE_SUCCEEDED, STATE_FAILED
+
+from . import BaseTest
+
+
+###############################################################################
+# InsertRecorder: records the documents inserted in a collection
+###############################################################################
+class InsertRecorder(object):
+
+    ###########################################################################
+    def __init__(self):
+        self.docs = []
+
+    ###########################################################################
+    def insert(self, doc):
+        self.docs.append(doc)
+
+    ###########################################################################
+    def find(self, q, sort=None):
+        return [doc for doc in self.docs
+                if all(doc.get(key) == value for key, value in q.items())]
+
+
+###############################################################################
+# AuditCollection: audit reports collection
+###############################################################################
+class AuditCollection(InsertRecorder):
+
+    ###########################################################################
+    def save_document(self, doc):
+        self.insert(doc)
+
+    ###########################################################################
+    def find_documents(self, q):
+        return self.find(q)
+
+
+###############################################################################
+# Fakes of the mbs collections read by PlanAuditor
+###############################################################################
+class AuditBackupCollection(object):
+
+    ###########################################################################
+    def __init__(self, backup_docs, events=None):
+        self.backup_docs = backup_docs
+        # backup id => error/warning events
+        self.events = events or {}
+        self.queries = []
+
+    ###########################################################################
+    def find_documents(self, q, fields=None):
+        self.queries.append(q)
+        occurrence_range = q["planOccurrence"]
+        return [dict(doc) for doc in self.backup_docs
+                if occurrence_range["$gte"] <= doc["planOccurrence"] <
+                   occurrence_range["$lt"] and
+                   doc["plan"]["_id"] in q["plan._id"]["$in"]]
+
+    ###########################################################################
+    def get_tasks_events(self, task_ids, event_types=None):
+        return dict((task_id, self.events[task_id]) for task_id in task_ids
+                    if task_id in self.events)
+
+
+###############################################################################
+class PlanCollection(object):
+
+    ###########################################################################
+    def __init__(self, plans):
+        self.plans = plans
+
+    ###########################################################################
+    def find(self, lazy=False):
+        return self.plans
+
+
+###############################################################################
+class SummaryCollection(object):
+
+    ###########################################################################
+    def __init__(self, docs):
+        self.docs = docs
+
+    ###########################################################################
+    def find_one(self, q):
+        for doc in self.docs:
+            if doc["_id"] == q["_id"]:
+                return doc
+
+    ###########################################################################
+    def find(self, q):
+        return [doc for doc in self.docs
+                if "date" in doc and q["date"]["$gte"] <= doc["date"] <
+                   q["date"]["$lt"]]
+
+
+###############################################################################
+class AuditMBS(object):
+
+    ###########################################################################
+    def __init__(self, backup_collection, plan_collection,
+                 audit_summary_store=None):
+        self.backup_collection = backup_collection
+        self.plan_collection = plan_collection
+        self.audit_summary_store = audit_summary_store
+
+
+###############################################################################
+# AuditorsTest
+###############################################################################
+class AuditorsTest(BaseTest):
+
+    ###########################################################################
+    def _plan_report(self, plan_id, total_failures):
+        plan = BackupPlan()
+        plan.id = plan_id
+        plan.description = "Plan %s" % plan_id
+        plan_report = PlanAuditReport()
+        plan_report.plan = plan
+        plan_report.total_failures = total_failures
+        return plan_report
+
+    ###########################################################################
+    def test_top_failures(self):
+        top_failures = []
+        for i in range(MAX_TOP_FAILURES * 2):
+            _push_top_failure(top_failures, self._plan_report(i, i))
+
+        self.assertEqual(len(top_failures), MAX_TOP_FAILURES)
+        self.assertEqual(min(top_failures)[0], MAX_TOP_FAILURES)
+
+    ###########################################################################
+    def test_report_digest(self):
+        report = AuditReport()
+        report.id = "audit-1"
+        report.audit_type = "PLAN_AUDIT"
+        report.audit_date = datetime(2013, 1, 1)
+        report.top_failures = [{"planId": 1, "description": "Plan 1",
+                                "totalFailures": 2, "totalWarnings": 0}]
+
+        auditor = GlobalAuditor(None, entries_collection=InsertRecorder(),
+                                report_url="http://mbs:9003/audit-report/")
+        digest = auditor._report_digest(report)
+        self.assertIn("1 (Plan 1): 2 failures", digest)
+        self.assertIn("http://mbs:9003/audit-report/audit-1", digest)
+
+    ###########################################################################
+    def _audit_plan(self, plan_id):
+        plan_doc = sample_backup_document(log_count=0)["plan"]
+        plan_doc["_id"] = plan_id
+        plan_doc["description"] = "Plan %s" % plan_id
+        plan_doc["createdDate"] = datetime(2012, 1, 1)
+        plan_doc["nextOccurrence"] = datetime(2013, 1, 3)
+        plan_doc["schedule"] = {
+            "_type": "Schedule",
+            "frequencyInSeconds": 6 * 60 * 60,
+            "offset": datetime(2013, 1, 1)
+        }
+        return self.maker.make(plan_doc)
+
+    ###########################################################################
+    def _error_event(self, message):
+        return self.maker.make({
+            "_type": "EventLogEntry",
+            "eventType": "ERROR",
+            "message": message,
+            "date": datetime(2013, 1, 2)
+        })
+
+    ###########################################################################
+    def _backup_doc(self, backup_id, plan_id, plan_occurrence,
+                    state=STATE_SUCCEEDED, error_count=0, warning_count=0):
+        return {
+            "_id": backup_id,
+            "plan": {"_id": plan_id},
+            "planOccurrence": plan_occurrence,
+            "state": state,
+            "errorCount": error_count,
+            "warningCount": warning_count
+        }
+
+    ###########################################################################
+    def test_missing_summary_occurrences(self):
+        audit_date = datetime(2013, 1, 2)
+        plan = self._audit_plan("plan-1")
+        occurrences = plan.natural_occurrences_as_of(audit_date)
+        backup_docs = [self._backup_doc("backup-%s" % i, "plan-1", occurrence)
+                       for i, occurrence in enumerate(occurrences)]
+
+        # the summary of the last occurrence was dropped
+        summary = {
+            "_id": "plan-1-20130102",
+            "planId": "plan-1",
+            "date": audit_date,
+            "occurrences": dict(
+                (str(date_to_seconds(doc["planOccurrence"])), {
+                    "backupId": doc["_id"],
+                    "planOccurrence": doc["planOccurrence"],
+                    "state": doc["state"]
+                }) for doc in backup_docs[:-1])
+        }
+        marker = {"_id": COMPLETE_MARKER_ID,
+                  "completeSince": datetime(2013, 1, 1)}
+        store = AuditSummaryStore(SummaryCollection([marker, summary]))
+        backup_collection = AuditBackupCollection(backup_docs)
+
+        with simulated_mbs(AuditMBS(backup_collection, PlanCollection([plan]),
+                                    audit_summary_store=store)):
+            report = PlanAuditor().daily_audit_report(audit_date)
+
+        # backups were read instead of reporting NEVER SCHEDULED
+        self.assertEqual(len(backup_collection.queries), 1)
+        self.assertEqual(report.total_failures, 0)
+        self.assertEqual(report.total_audits, 1)
+
+        # complete summaries are used as is
+        summary["occurrences"].update(
+            (str(date_to_seconds(doc["planOccurrence"])), {
+                "backupId": doc["_id"],
+                "planOccurrence": doc["planOccurrence"],
+                "state": doc["state"]
+            }) for doc in backup_docs)
+        backup_collection.queries = []
+        with simulated_mbs(AuditMBS(backup_collection, PlanCollection([plan]),
+                                    audit_summary_store=store)):
+            report = PlanAuditor().daily_audit_report(audit_date)
+
+        self.assertEqual(backup_collection.queries, [])
+        self.assertEqual(report.total_failures, 0)
+
+        # days before the summaries were rebuilt are read from backups
+        marker["completeSince"] = datetime(2013, 1, 3)
+        with simulated_mbs(AuditMBS(backup_collection, PlanCollection([plan]),
+                                    audit_summary_store=store)):
+            report = PlanAuditor().daily_audit_report(audit_date)
+
+        self.assertEqual(len(backup_collection.queries), 1)
+        self.assertEqual(report.total_failures, 0)
+
+    ###########################################################################
+    def test_streamed_audit(self):
+        audit_date = datetime(2013, 1, 2)
+        plans = [self._audit_plan("plan-%s" % i) for i in range(3)]
+        backup_docs = []
+        for plan in plans:
+            for occurrence in plan.natural_occurrences_as_of(audit_date):
+                backup_docs.append(self._backup_doc(
+                    "backup-%s" % len(backup_docs), plan.id, occurrence))
+        # plan-1 has a failed backup, plan-2 a never scheduled occurrence
+        backup_docs[4].update(state=STATE_FAILED, errorCount=1)
+        del backup_docs[8]
+        events = {"backup-4": [self._error_event("boom")]}
+
+        audit_collection = AuditCollection()
+        entries_collection = InsertRecorder()
+        global_auditor = GlobalAuditor(audit_collection,
+                                       entries_collection=entries_collection)
+        global_auditor.register_auditor(PlanAuditor())
+        backup_collection = AuditBackupCollection(backup_docs, events=events)
+        with simulated_mbs(AuditMBS(backup_collection,
+                                    PlanCollection(plans))), \
+             patch.object(mbs.auditors, "AUDIT_PLAN_BATCH_SIZE", 2):
+            global_auditor.generate_daily_audit_reports(audit_date)
+
+        # backups are read per batch of plans
+        self.assertEqual([query["plan._id"]["$in"]
+                          for query in backup_collection.queries],
+                         [["plan-0", "plan-1"], ["plan-2"]])
+
+        # entries are streamed out of the saved summary report
+        report_doc = audit_collection.docs[0]
+        self.assertEqual(report_doc["entryCount"], 2)
+        self.assertEqual(report_doc["failures"], [])
+        self.assertEqual(report_doc["totalAudits"], 3)
+        self.assertEqual(report_doc["totalFailures"], 2)
+        self.assertEqual([failure["planId"]
+                          for failure in report_doc["topFailures"]],
+                         ["plan-2", "plan-1"])
+
+        entries = entries_collection.docs
+        self.assertEqual([entry["planId"] for entry in entries],
+                         ["plan-1", "plan-2"])
+        for entry in entries:
+            self.assertEqual(entry["auditId"], report_doc["_id"])
+        failed_audit = entries[0]["failures"][0]
+        self.assertEqual(failed_audit["backupId"], "backup-4")
+        self.assertEqual(failed_audit["errors"][0]["message"], "boom")
+        self.assertEqual(entries[1]["failures"][0]["state"],
+                         "NEVER SCHEDULED")
+
+        result = global_auditor.get_audit_report(report_doc["_id"])
+        self.assertEqual(result["report"], report_doc)
+        self.assertEqual(result["entries"], entries)
+
+    ###########################################################################
+    def test_audit_backups_join(self):
+        audit_date = datetime(2013, 1, 2)
+        plans = [self._audit_plan("plan-%s" % i) for i in range(3)]
+        backup_docs = []
+        events = {}
+        # backups of the day before, the audit day and the day after
+        for plan in plans:
+            for occurrence in plan.natural_occurrences_between(
+                    datetime(2013, 1, 1, 18), datetime(2013, 1, 3, 6)):
+                backup_id = "backup-%s" % len(backup_docs)
+                backup_doc = self._backup_doc(backup_id, plan.id, occurrence)
+                if len(backup_docs) % 3 == 0:
+                    backup_doc.update(state=STATE_FAILED, errorCount=1)
+                    events[backup_id] = [self._error_event(backup_id)]
+                backup_docs.append(backup_doc)
+
+        # a rescheduled occurrence (the first backup is the one audited)
+        backup_docs.append(self._backup_doc("backup-dup", "plan-0",
+                                            datetime(2013, 1, 2, 6),
+                                            state=STATE_FAILED))
+        # a never scheduled occurrence
+        backup_docs = [doc for doc in backup_docs
+                       if not (doc["plan"]["_id"] == "plan-2" and
+                               doc["planOccurrence"] ==
+                               datetime(2013, 1, 2, 12))]
+
+        # reference: one lookup per plan occurrence
+        class OccurrenceLookupAuditor(PlanAuditor):
+            def _audit_plan_occurrence(self, plan, plan_occurrence,
+                                       audit_backups):
+                for doc in backup_docs:
+                    if (doc["plan"]["_id"] == plan.id and
+                            doc["planOccurrence"] == plan_occurrence):
+                        audit_backups = {(plan.id, plan_occurrence): dict(
+                            doc, errors=events.get(doc["_id"], []),
+                            warnings=[])}
+                        break
+                return PlanAuditor._audit_plan_occurrence(
+                    self, plan, plan_occurrence, audit_backups)
+
+        reports = []
+        for auditor in [PlanAuditor(), OccurrenceLookupAuditor()]:
+            with simulated_mbs(AuditMBS(AuditBackupCollection(backup_docs,
+                                                              events=events),
+                                        PlanCollection(plans))):
+                report = auditor.daily_audit_report(audit_date)
+            reports.append(report.to_document(display_only=True))
+
+        self.assertEqual(reports[0], reports[1])
+        failed_audits = [audit for plan_report in reports[0]["failures"]
+                         for audit in plan_report["failures"]]
+        self.assertEqual(len([audit for audit in failed_audits
+                              if audit["state"] == "NEVER SCHEDULED"]), 1)
+        for audit in failed_audits:
+            if audit["state"] == STATE_FAILED:
+                self.assertEqual(audit["errors"][0]["message"],
+                                 audit["backupId"])
+        self.assertNotIn("backup-dup", [audit.get("backupId")
+                                        for audit in failed_audits])
@@ -0,0 +1,53 @@
+import os
+
+from tempfile import NamedTemporaryFile
+
+from mbs.autotune import MultipartAutotuner, FilePart, MB, MIN_PART_SIZE
+
+from . import BaseTest
+
+
+###############################################################################
+# AutotuneTest
+###############################################################################
+class AutotuneTest(BaseTest):
+
+    ###########################################################################
+    def test_additive_increase(self):
+        tuner = MultipartAutotuner(part_size=8 * MB, max_in_flight=4,
+                                   memory_limit=64 * MB)
+        for i in range(10):
+            tuner.record_part(8 * MB, 1)
+
+        # in flight grows first then part size grows within memory limit
+        self.assertEqual(tuner.in_flight, 4)
+        self.assertTrue(tuner.part_size > 8 * MB)
+        self.assertTrue(tuner.in_flight * tuner.part_size <= 64 * MB)
+
+    ###########################################################################
+    def test_multiplicative_decrease(self):
+        tuner = MultipartAutotuner(part_size=8 * MB, in_flight=4,
+                                   max_in_flight=4, memory_limit=64 * MB)
+        tuner.record_part(8 * MB, 1)
+        self.assertEqual(tuner.in_flight, 4)
+
+        # big throughput drop halves parts in flight
+        tuner.record_part(8 * MB, 10)
+        self.assertEqual(tuner.in_flight, 2)
+
+        tuner.record_failure()
+        self.assertEqual(tuner.in_flight, 1)
+        self.assertTrue(tuner.part_size >= MIN_PART_SIZE)
+
+    ###########################################################################
+    def test_file_part(self):
+        with NamedTemporaryFile() as f:
+            f.write("0123456789")
+            f.flush()
+            with FilePart(f.name, 3, 4) as part:
+                self.assertEqual(part.read(), "3456")
+                self.assertEqual(part.read(), "")
+                part.seek(0, os.SEEK_END)
+                self.assertEqual(part.tell(), 4)
+                part.seek(1)
+                self.assertEqual(part.read(2), "45")
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from mock import patch
+
+import mbs.backup_system
+
+from mbs.backup_system import BackupSystem
+from mbs.benchmark import sample_backup_document
+from mbs.collection import MBSObjectCollection, MBSTaskCollection
+from mbs.simulation import simulated_mbs
+from mbs.type_bindings import TYPE_BINDINGS
+
+from . import BaseTest
+
+
+###############################################################################
+# CollectionRecorder: records the writes issued against a collection
+###############################################################################
+class CollectionRecorder(object):
+
+    ###########################################################################
+    def __init__(self, name):
+        self.name = name
+        self.inserts = []
+        self.updates = []
+
+    ###########################################################################
+    def insert(self, docs):
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        self.inserts.append(docs)
+
+    ###########################################################################
+    def update(self, spec, document, multi=False):
+        self.updates.append((spec, document, multi))
+
+    ###########################################################################
+    def find(self, *args, **kwargs):
+        raise Exception("Database is down")
+
+
+###############################################################################
+class SchedulingMBS(object):
+
+    ###########################################################################
+    def __init__(self):
+        self.events = CollectionRecorder("task_events")
+        self.backup_collection = MBSTaskCollection(
+            CollectionRecorder("backups"), type_bindings=TYPE_BINDINGS,
+            events_collection=self.events)
+        self.plan_collection = MBSObjectCollection(
+            CollectionRecorder("plans"), type_bindings=TYPE_BINDINGS)
+        self.error_notifications = []
+
+    ###########################################################################
+    def send_error_notification(self, subject, message, exception):
+        self.error_notifications.append(exception)
+
+
+###############################################################################
+# BackupSystemTest
+###############################################################################
+class BackupSystemTest(BaseTest):
+
+    ###########################################################################
+    def _make_plans(self, count):
+        plans = []
+        for i in range(count):
+            plan_doc = sample_backup_document(log_count=0)["plan"]
+            plan_doc["_id"] = "plan-%s" % i
+            plan_doc["schedule"]["offset"] = datetime(2013, 1, 1)
+            plan_doc["nextOccurrence"] = datetime(2013, 1, 2)
+            plans.append(self.maker.make(plan_doc))
+        return plans
+
+    ###########################################################################
+    def test_schedule_new_backups(self):
+        sim_mbs = SchedulingMBS()
+        backup_system = BackupSystem()
+        with simulated_mbs(sim_mbs), \
+             patch.object(mbs.backup_system, "BACKUP_INSERT_BATCH_SIZE", 2):
+            plans = self._make_plans(5)
+            backups = backup_system.schedule_new_backups(plans)
+
+        # inserted in batches through the backup collection
+        inserts = sim_mbs.backup_collection._pymongo_collection.inserts
+        self.assertEqual([len(docs) for docs in inserts], [2, 2, 1])
+        self.assertEqual([str(backup.id) for backup in backups],
+                         [str(doc["_id"]) for docs in inserts for doc in docs])
+        for backup in backups:
+            self.assertEqual(backup.plan_occurrence, datetime(2013, 1, 2))
+        # the SCHEDULED event of each backup is copied to the events
+        self.assertEqual(
+            sum(len(docs) for docs in sim_mbs.events.inserts), 5)
+
+        # plans sharing the same next occurrence are updated at once
+        plan_updates = sim_mbs.plan_collection._pymongo_collection.updates
+        self.assertEqual(plan_updates, [(
+            {"_id": {"$in": ["plan-%s" % i for i in range(5)]}},
+            {"$set": {"nextOccurrence": plans[0].next_occurrence}},
+            True
+        )])
+        self.assertEqual(len(backup_system._plan_heap), 5)
+
+    ###########################################################################
+    def test_plans_requeued_on_read_error(self):
+        sim_mbs = SchedulingMBS()
+        backup_system = BackupSystem()
+        backup_system._plan_heap.update("plan-1", datetime(2013, 1, 1))
+
+        with simulated_mbs(sim_mbs):
+            backup_system._process_plans_considered_now()
+
+        self.assertEqual(len(sim_mbs.error_notifications), 1)
+        self.assertTrue("plan-1" in backup_system._plan_heap)
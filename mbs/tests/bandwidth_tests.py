@@ -0,0 +1,46 @@
+import time
+
+from datetime import datetime
+
+from mbs.bandwidth import BandwidthLimiter, TokenBucket, ThrottledTransfer
+
+from . import BaseTest
+
+
+###############################################################################
+# BandwidthTest
+###############################################################################
+class BandwidthTest(BaseTest):
+
+    ###########################################################################
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1000, capacity=100)
+        # initial burst is free
+        self.assertEqual(bucket.consume(100), 0)
+
+        start = time.time()
+        bucket.consume(200)
+        self.assertTrue(time.time() - start >= 0.15)
+
+    ###########################################################################
+    def test_off_peak_windows(self):
+        limiter = self.maker.make({'_type': 'BandwidthLimiter',
+                                   'maxRateInMBPS': 1,
+                                   'offPeakWindows': ['22:00-06:00',
+                                                      '12:00-13:00']})
+
+        self.assertTrue(limiter.is_off_peak(datetime(2013, 1, 1, 23, 0)))
+        self.assertTrue(limiter.is_off_peak(datetime(2013, 1, 1, 5, 59)))
+        self.assertTrue(limiter.is_off_peak(datetime(2013, 1, 1, 12, 30)))
+        self.assertFalse(limiter.is_off_peak(datetime(2013, 1, 1, 6, 0)))
+        self.assertFalse(limiter.is_off_peak(datetime(2013, 1, 1, 13, 0)))
+
+    ###########################################################################
+    def test_throttled_transfer(self):
+        limiter = self.maker.make({'_type': 'BandwidthLimiter',
+                                   'maxRateInMBPS': 100})
+        transfer = ThrottledTransfer([limiter])
+        for transferred in (0, 1000, 5000, 5000):
+            transfer(transferred, 5000)
+
+        self.assertEqual(limiter.get_stats()['totalBytes'], 5000)
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from mbs.capacity import PlanProfile, get_demand_curve, MB
+
+from . import BaseTest
+
+
+###############################################################################
+# CapacityTest
+###############################################################################
+class CapacityTest(BaseTest):
+
+    ###########################################################################
+    def test_plan_profile(self):
+        docs = [{
+            "startDate": datetime(2013, 1, day) - timedelta(hours=2),
+            "endDate": datetime(2013, 1, day),
+            "sourceStats": {"dataSize": 1024 * MB * day},
+            "targetReference": {"fileSize": 256 * MB * day}
+        } for day in range(1, 8)]
+
+        profile = PlanProfile(docs)
+        self.assertEqual(profile.expected_duration, 2 * 60 * 60)
+        self.assertAlmostEqual(profile.growth_per_day, 1024 * MB)
+        self.assertAlmostEqual(profile.upload_ratio, 0.25)
+        self.assertAlmostEqual(profile.projected_data_size(datetime(2013, 1,
+                                                                    9)),
+                               9 * 1024 * MB)
+
+    ###########################################################################
+    def test_demand_curve(self):
+        start = datetime(2013, 1, 1)
+        demand = {"workers": 1, "tempDisk": MB, "upload": MB}
+        intervals = [(start, start + timedelta(hours=2), demand),
+                     (start + timedelta(hours=1),
+                      start + timedelta(hours=3), demand)]
+
+        curve = get_demand_curve(intervals, start, start + timedelta(hours=4))
+        self.assertEqual([peak["workers"] for _, peak in curve], [1, 2, 1, 0])
+        self.assertEqual(curve[1][1]["tempDisk"], 2 * MB)
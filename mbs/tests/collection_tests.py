@@ -0,0 +1,232 @@
+from datetime import datetime
+
+from bson.dbref import DBRef
+from bson.objectid import ObjectId
+
+from mbs.backup import Backup
+from mbs.benchmark import sample_backup_document
+from mbs.collection import (LazyObject, MBSTaskCollection, add_log_entries,
+                            _TaskWriteBuffer, _is_durable_write)
+from mbs.restore import Restore
+from mbs.task import MAX_RECENT_LOGS
+from mbs.type_bindings import TYPE_BINDINGS
+
+from . import BaseTest
+
+
+###############################################################################
+# EventsCollection: records the events inserted in the events collection
+###############################################################################
+class EventsCollection(object):
+
+    ###########################################################################
+    def __init__(self):
+        self.docs = []
+
+    ###########################################################################
+    def insert(self, docs):
+        self.docs.extend(docs)
+
+    ###########################################################################
+    def update(self, spec, document, upsert=False):
+        self.docs = [doc for doc in self.docs
+                     if any(doc.get(key) != value
+                            for key, value in spec.items())]
+        self.docs.append(document)
+
+
+###############################################################################
+# ReferenceDatabase: documents by collection name, for DBRef lookups
+###############################################################################
+class ReferenceDatabase(object):
+
+    ###########################################################################
+    def __init__(self, docs_by_collection):
+        self.docs_by_collection = docs_by_collection
+
+    ###########################################################################
+    def __getitem__(self, name):
+        return ReferenceCollection(self, name)
+
+    ###########################################################################
+    def dereference(self, dbref):
+        return self[dbref.collection].find_one({"_id": dbref.id})
+
+
+###############################################################################
+class ReferenceCollection(object):
+
+    ###########################################################################
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+
+    ###########################################################################
+    def find_one(self, spec):
+        for doc in self.database.docs_by_collection.get(self.name, []):
+            if doc["_id"] == spec["_id"]:
+                return doc
+
+
+###############################################################################
+# CollectionTest
+###############################################################################
+class CollectionTest(BaseTest):
+
+    ###########################################################################
+    def test_lazy_object(self):
+        doc = {
+            "_type": "Backup",
+            "_id": "backup-1",
+            "state": "FAILED",
+            "createdDate": datetime(2013, 1, 1),
+            "logs": [{
+                "_type": "EventLogEntry",
+                "eventType": "ERROR",
+                "message": "boom",
+                "date": datetime(2013, 1, 1)
+            }]
+        }
+
+        backup = LazyObject(self.maker, doc)
+        self.assertTrue(isinstance(backup, Backup))
+        self.assertEqual(backup.state, "FAILED")
+        self.assertEqual(backup._lazy_pending.keys(), ["logs"])
+
+        # methods hydrate pending sub-documents first
+        self.assertEqual(len(backup.get_errors()), 1)
+        self.assertEqual(backup._lazy_pending, {})
+
+        backup.state = "SUCCEEDED"
+        self.assertEqual(backup._lazy_target.state, "SUCCEEDED")
+
+    ###########################################################################
+    def test_write_buffer(self):
+        write_buffer = _TaskWriteBuffer()
+        write_buffer.add({"tryCount": 1, "startDate": datetime(2013, 1, 1)},
+                         {"message": "one"})
+        write_buffer.add({"tryCount": 2}, {"message": "two"})
+
+        self.assertEqual(write_buffer.to_update_document(), {
+            "$set": {"tryCount": 2, "startDate": datetime(2013, 1, 1)},
+            "$push": {"logs": {"$each": [{"message": "one"},
+                                         {"message": "two"}],
+                               "$slice": -MAX_RECENT_LOGS}}
+        })
+        self.assertEqual(len(write_buffer.event_docs), 2)
+
+        self.assertTrue(_is_durable_write("state", None))
+        self.assertTrue(_is_durable_write(None, "END_UPLOAD"))
+        self.assertFalse(_is_durable_write(["sourceStats"], "START_UPLOAD"))
+
+    ###########################################################################
+    def test_failed_flush(self):
+        events_collection = EventsCollection()
+        task_collection = MBSTaskCollection(
+            None, flush_interval=0, events_collection=events_collection,
+            task_collection_name="backups")
+        updates = []
+        failures = [Exception("boom"), Exception("boom")]
+
+        def update(spec, document):
+            if failures:
+                raise failures.pop()
+            updates.append(document)
+
+        task_collection.update = update
+        task_id = ObjectId()
+
+        self.assertRaises(Exception, task_collection._buffer_write, task_id,
+                          {"tryCount": 1}, {"message": "one"}, True)
+        # errors of background flushes are logged
+        task_collection._expire(task_id)
+
+        # failed writes are kept and written before newer ones
+        task_collection._buffer_write(task_id, {"tryCount": 2},
+                                      {"message": "two"}, True)
+        self.assertEqual(updates, [{
+            "$set": {"tryCount": 2},
+            "$push": {"logs": {"$each": [{"message": "one"},
+                                         {"message": "two"}],
+                               "$slice": -MAX_RECENT_LOGS}}
+        }])
+        # events are inserted once
+        self.assertEqual([doc["message"] for doc in events_collection.docs],
+                         ["one", "two"])
+        self.assertEqual(task_collection._write_buffers, {})
+
+    ###########################################################################
+    def test_upsert_task_events(self):
+        events_collection = EventsCollection()
+        task_collection = MBSTaskCollection(
+            None, events_collection=events_collection,
+            task_collection_name="backups")
+        task_id = ObjectId()
+        log_docs = [{"name": "START_UPLOAD", "date": datetime(2013, 1, 1)},
+                    {"name": "END_UPLOAD", "date": datetime(2013, 1, 1)}]
+
+        # re-running (e.g. an interrupted migration) does not copy twice
+        task_collection.upsert_task_events(task_id, log_docs)
+        task_collection.upsert_task_events(task_id, log_docs)
+        self.assertEqual(sorted(doc["name"]
+                                for doc in events_collection.docs),
+                         ["END_UPLOAD", "START_UPLOAD"])
+
+    ###########################################################################
+    def test_add_log_entries(self):
+        log_docs = [{"name": "START_UPLOAD", "eventType": "INFO"},
+                    {"name": "DUMP_ERROR", "eventType": "WARNING"},
+                    {"name": "DUMP_ERROR", "eventType": "WARNING"}]
+
+        u = add_log_entries({}, log_docs)
+        self.assertEqual(u["$addToSet"], {
+            "loggedEvents": {"$each": ["START_UPLOAD", "DUMP_ERROR"]}
+        })
+        self.assertEqual(u["$inc"], {"warningCount": 2})
+
+        # logs being reset are updated in place
+        u = add_log_entries({"$set": {"logs": [], "loggedEvents": [],
+                                      "warningCount": 0}}, log_docs)
+        self.assertEqual(u.keys(), ["$set"])
+        self.assertEqual(u["$set"]["logs"], log_docs)
+        self.assertEqual(u["$set"]["loggedEvents"],
+                         ["START_UPLOAD", "DUMP_ERROR"])
+        self.assertEqual(u["$set"]["warningCount"], 2)
+
+    ###########################################################################
+    def test_export_property(self):
+        backup = self.maker.make(sample_backup_document(log_count=3))
+        backup.transfer_progress = {"percentage": 50}
+        doc = backup.to_document()
+        for prop in Backup.PROPERTY_EXPORTERS.keys():
+            self.assertEqual(backup.export_property(prop), doc.get(prop))
+
+    ###########################################################################
+    def test_dereference_archived_source_backup(self):
+        backup_doc = sample_backup_document(log_count=0)
+        backup_doc["_id"] = ObjectId()
+        backup_doc["state"] = "SUCCEEDED"
+        database = ReferenceDatabase({"backups_archive": [backup_doc]})
+        restore_doc = {
+            "_type": "Restore",
+            "_id": ObjectId(),
+            "state": "FAILED",
+            "createdDate": datetime(2013, 1, 1),
+            "sourceBackup": DBRef("backups", backup_doc["_id"]),
+            "strategy": backup_doc["strategy"],
+            "sourceDatabaseName": "db",
+            "destination": {
+                "_type": "MongoSource",
+                "uri": "mongodb://localhost:27017/db"
+            }
+        }
+
+        rc = MBSTaskCollection(database["restores"], clazz=Restore,
+                               type_bindings=TYPE_BINDINGS)
+        restore = rc._make(restore_doc)
+        self.assertEqual(str(restore.source_backup.id),
+                         str(backup_doc["_id"]))
+        self.assertEqual(restore.export_property("sourceBackup"),
+                         DBRef("backups", backup_doc["_id"]))
+        self.assertEqual(restore.to_document()["sourceBackup"],
+                         DBRef("backups", backup_doc["_id"]))
@@ -0,0 +1,75 @@
+import copy
+
+from mbs.benchmark import sample_backup_document
+from mbs.config_snapshots import (ConfigSnapshotStore, LRUCache, config_hash,
+                                  with_config_snapshot_field)
+
+from . import BaseTest
+
+
+###############################################################################
+# SnapshotCollection: in memory stand in for the config_snapshots collection
+###############################################################################
+class SnapshotCollection(object):
+
+    ###########################################################################
+    def __init__(self):
+        self.docs = {}
+
+    ###########################################################################
+    def update(self, spec, doc, upsert=False):
+        self.docs[spec["_id"]] = doc
+
+    ###########################################################################
+    def find_one(self, spec):
+        return self.docs.get(spec["_id"])
+
+
+###############################################################################
+# ConfigSnapshotsTest
+###############################################################################
+class ConfigSnapshotsTest(BaseTest):
+
+    ###########################################################################
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+
+    ###########################################################################
+    def test_normalize_document(self):
+        collection = SnapshotCollection()
+        store = ConfigSnapshotStore(collection)
+        doc = sample_backup_document(log_count=1)
+        original = copy.deepcopy(doc)
+
+        store.normalize_document(doc)
+        self.assertEqual(sorted(doc["plan"].keys()),
+                         ["_id", "description", "nextOccurrence"])
+        self.assertNotIn("target", doc)
+        self.assertEqual(len(collection.docs), 1)
+
+        # a backup of the next occurrence shares the snapshot
+        next_doc = copy.deepcopy(original)
+        next_doc["plan"]["nextOccurrence"] = None
+        store.normalize_document(next_doc)
+        self.assertEqual(next_doc["configSnapshot"], doc["configSnapshot"])
+        self.assertEqual(len(collection.docs), 1)
+
+        # expanded from the collection (not the cache)
+        store = ConfigSnapshotStore(collection)
+        self.assertEqual(store.expand_document(doc), original)
+
+    ###########################################################################
+    def test_config_hash(self):
+        self.assertEqual(config_hash({"a": 1, "b": {"c": 2, "d": 3}}),
+                         config_hash({"b": {"d": 3, "c": 2}, "a": 1}))
+        self.assertEqual(with_config_snapshot_field({"plan._id": 1}),
+                         {"plan._id": 1, "configSnapshot": 1})
+        self.assertEqual(with_config_snapshot_field({"logs": 0}),
+                         {"logs": 0})
@@ -0,0 +1,44 @@
+from mbs.benchmark import sample_backup_document
+from mbs.hydration import DocumentHydrator, camel_to_snake
+from mbs.type_bindings import TYPE_BINDINGS
+
+from . import BaseTest
+
+
+###############################################################################
+# HydrationTest
+###############################################################################
+class HydrationTest(BaseTest):
+
+    ###########################################################################
+    def test_camel_to_snake(self):
+        self.assertEqual(camel_to_snake("_id"), "_id")
+        self.assertEqual(camel_to_snake("createdDate"), "created_date")
+        self.assertEqual(camel_to_snake("backupRateInMBPS"),
+                         "backup_rate_in_mbps")
+
+    ###########################################################################
+    def test_hydrate_backup(self):
+        doc = sample_backup_document(log_count=3)
+        hydrator = DocumentHydrator(type_bindings=TYPE_BINDINGS)
+
+        backup = hydrator.make(doc)
+        self.assertEqual(backup.to_document(),
+                         self.maker.make(doc).to_document())
+        self.assertEqual(backup.plan.schedule.frequency_in_seconds,
+                         24 * 60 * 60)
+        self.assertEqual(len(backup.logs), 3)
+
+    ###########################################################################
+    def test_hydrate_legacy_keys(self):
+        doc = sample_backup_document(log_count=3)
+        # no longer declared by Backup (no __dict__ to hold it)
+        doc["legacyField"] = 1
+        # kept by the plan, whose class has a __dict__
+        doc["plan"]["legacyField"] = 1
+        hydrator = DocumentHydrator(type_bindings=TYPE_BINDINGS)
+
+        backup = hydrator.make(doc)
+        self.assertFalse(hasattr(backup, "__dict__"))
+        self.assertFalse(hasattr(backup, "legacy_field"))
+        self.assertEqual(backup.plan.legacy_field, 1)
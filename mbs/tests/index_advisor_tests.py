@@ -0,0 +1,52 @@
+from mbs.index_advisor import query_shape, propose_index, explain_stages
+
+from . import BaseTest
+
+
+###############################################################################
+# IndexAdvisorTest
+###############################################################################
+class IndexAdvisorTest(BaseTest):
+
+    ###########################################################################
+    def test_query_shape(self):
+        q = {
+            "state": "FAILED",
+            "plan._id": {"$in": ["a", "b"]},
+            "$or": [{"tags": {"$exists": False}}, {"tags": None}]
+        }
+        self.assertEqual(query_shape(q), {
+            "state": 1,
+            "plan._id": {"$in": 1},
+            "$or": [{"tags": {"$exists": 1}}, {"tags": 1}]
+        })
+
+    ###########################################################################
+    def test_propose_index(self):
+        q = {
+            "plan._id": "plan-1",
+            "startDate": {"$lt": "date"},
+            "$or": [{"tags": None}]
+        }
+        self.assertEqual(propose_index(q),
+                         [("plan._id", 1), ("startDate", 1)])
+        self.assertEqual(propose_index({"state": "SCHEDULED"},
+                                       sort=[("priority", 1)]),
+                         [("state", 1), ("priority", 1)])
+
+    ###########################################################################
+    def test_explain_stages(self):
+        legacy = {"cursor": "BasicCursor", "scanAndOrder": True}
+        self.assertEqual(explain_stages(legacy), set(["COLLSCAN", "SORT"]))
+        self.assertEqual(explain_stages({"cursor": "BtreeCursor state_1"}),
+                         set())
+
+        explain = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "SORT",
+                    "inputStage": {"stage": "COLLSCAN"}
+                }
+            }
+        }
+        self.assertEqual(explain_stages(explain), set(["COLLSCAN", "SORT"]))
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from mbs.load_leveling import LoadLevelingPolicy, load_leveling_report
+
+from . import BaseTest
+
+
+###############################################################################
+# LoadLevelingTest
+###############################################################################
+class LoadLevelingTest(BaseTest):
+
+    ###########################################################################
+    def _make_plans(self, count):
+        return [self.maker.make({
+            "_type": "Plan",
+            "_id": "plan-%s" % i,
+            "schedule": {
+                "_type": "Schedule",
+                "frequencyInSeconds": 24 * 60 * 60,
+                "offset": datetime(2013, 1, 1)
+            }
+        }) for i in range(count)]
+
+    ###########################################################################
+    def test_level_occurrence(self):
+        policy = LoadLevelingPolicy()
+        plan = self._make_plans(1)[0]
+        occurrence = datetime(2013, 1, 2)
+
+        leveled = policy.level_occurrence(plan, occurrence,
+                                          expected_duration=60 * 60)
+        # stable and within half the lag minus the expected duration
+        self.assertEqual(leveled, policy.level_occurrence(
+            plan, occurrence, expected_duration=60 * 60))
+        self.assertTrue(occurrence <= leveled <=
+                        occurrence + timedelta(hours=5))
+        # still maps back to the natural occurrence
+        self.assertEqual(plan.schedule.last_natural_occurrence(leveled),
+                         occurrence)
+
+    ###########################################################################
+    def test_cron_window(self):
+        policy = LoadLevelingPolicy()
+        policy.lag_ratio = 1
+        # the period leading up to 23:00 is 22 hours but the next occurrence
+        # is 2 hours later
+        occurrence = datetime(2013, 1, 2, 23)
+        for i in range(20):
+            plan = self.maker.make({
+                "_type": "Plan",
+                "_id": "plan-%s" % i,
+                "schedule": {
+                    "_type": "CronSchedule",
+                    "expression": "0 1,23 * * *"
+                }
+            })
+            self.assertTrue(policy.get_window(plan, occurrence) <=
+                            2 * 60 * 60 - 60)
+            leveled = policy.level_occurrence(plan, occurrence)
+            self.assertEqual(plan.schedule.last_natural_occurrence(leveled),
+                             occurrence)
+
+    ###########################################################################
+    def test_report_flattens_load(self):
+        plans = self._make_plans(50)
+        report = load_leveling_report(plans, LoadLevelingPolicy(),
+                                      start_date=datetime(2013, 1, 1))
+
+        self.assertEqual(report["before"]["peakConcurrency"], 50)
+        self.assertTrue(report["after"]["peakConcurrency"] < 50)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from mbs.plan_heap import PlanHeap
+
+from . import BaseTest
+
+
+###############################################################################
+# PlanHeapTest
+###############################################################################
+class PlanHeapTest(BaseTest):
+
+    ###########################################################################
+    def test_pop_due(self):
+        heap = PlanHeap()
+        heap.load([
+            {"_id": 1, "nextOccurrence": datetime(2013, 1, 1, 2)},
+            {"_id": 2, "nextOccurrence": datetime(2013, 1, 1, 1)},
+            {"_id": 3}
+        ])
+
+        # plans with no next occurrence are due right away
+        self.assertEqual(heap.pop_due(datetime(2013, 1, 1)), [3])
+        self.assertEqual(heap.next_due_date(), datetime(2013, 1, 1, 1))
+
+        # updates and removals invalidate old entries
+        heap.update(2, datetime(2013, 1, 1, 3))
+        heap.remove(1)
+        self.assertEqual(heap.pop_due(datetime(2013, 1, 1, 2)), [])
+        self.assertEqual(heap.pop_due(datetime(2013, 1, 1, 3)), [2])
+        self.assertEqual(len(heap), 0)
+        self.assertEqual(heap.next_due_date(), None)
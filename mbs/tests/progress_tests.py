@@ -0,0 +1,50 @@
+from mbs.progress import TransferProgressReporter, get_active_transfers
+
+from . import BaseTest
+
+
+###############################################################################
+# ProgressTest
+###############################################################################
+class ProgressTest(BaseTest):
+
+    ###########################################################################
+    def test_multi_stream_progress(self):
+        reporter = TransferProgressReporter(name="upload")
+        reporter.expect(1000)
+        reporter.expect(1000)
+
+        stream1 = reporter.callback()
+        stream2 = reporter.callback()
+        stream1(0, 1000)
+        stream1(400, 1000)
+        stream2(500, 1000)
+        stream1(1000, 1000)
+
+        progress = reporter.get_progress()
+        self.assertEqual(progress["bytesTransferred"], 1500)
+        self.assertEqual(progress["totalBytes"], 2000)
+        self.assertEqual(self._active_transfer_names(), ["upload"])
+
+        reporter.finish()
+        self.assertEqual(self._active_transfer_names(), [])
+
+    ###########################################################################
+    def test_retried_stream_progress(self):
+        reporter = TransferProgressReporter(name="upload")
+        reporter.expect(1000)
+
+        stream = reporter.callback()
+        stream(600, 1000)
+        # the stream failed and is retried from the start
+        stream(0, 1000)
+        stream(400, 1000)
+        self.assertEqual(reporter.get_progress()["bytesTransferred"], 600)
+        stream(1000, 1000)
+        self.assertEqual(reporter.get_progress()["bytesTransferred"], 1000)
+        reporter.finish()
+
+    ###########################################################################
+    @staticmethod
+    def _active_transfer_names():
+        return [transfer.get("name") for transfer in get_active_transfers()]
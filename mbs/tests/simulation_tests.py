@@ -0,0 +1,98 @@
+from datetime import datetime
+
+import mbs.schedule as schedule
+
+from mbs.benchmark import sample_backup_document
+from mbs.simulation import (VirtualClock, virtual_time, percentile,
+                            Simulation, DurationSampler)
+
+from . import BaseTest
+
+
+###############################################################################
+# SimulationTest
+###############################################################################
+class SimulationTest(BaseTest):
+
+    ###########################################################################
+    def _make_plan_docs(self, count, frequency_in_hours):
+        plan_docs = []
+        for i in range(count):
+            plan_doc = sample_backup_document(log_count=0)["plan"]
+            plan_doc["_id"] = "plan-%s" % i
+            plan_doc["schedule"] = {
+                "_type": "Schedule",
+                "frequencyInSeconds": frequency_in_hours * 60 * 60,
+                "offset": datetime(2013, 1, 1)
+            }
+            plan_doc["nextOccurrence"] = datetime(2013, 1, 1)
+            plan_docs.append(plan_doc)
+        return plan_docs
+
+    ###########################################################################
+    def test_virtual_time(self):
+        clock = VirtualClock(datetime(2013, 1, 1))
+        real_date_now = schedule.date_now
+        with virtual_time(clock):
+            self.assertEqual(schedule.date_now(), datetime(2013, 1, 1))
+            clock.advance_to(datetime(2013, 1, 2))
+            self.assertEqual(schedule.date_now(), datetime(2013, 1, 2))
+            # the clock never goes back
+            clock.advance_to(datetime(2013, 1, 1))
+            self.assertEqual(schedule.date_now(), datetime(2013, 1, 2))
+
+        self.assertIs(schedule.date_now, real_date_now)
+
+    ###########################################################################
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), None)
+
+    ###########################################################################
+    def test_run(self):
+        # 4 plans every 6 hours, 2 single worker engines, 30 minute backups
+        plan_docs = self._make_plan_docs(4, 6)
+        engine_docs = [{"_id": "engine-1", "maxWorkers": 1},
+                       {"_id": "engine-2", "maxWorkers": 1}]
+        simulation = Simulation({}, plan_docs, engine_docs,
+                                duration_sampler=DurationSampler(
+                                    default_duration=30 * 60),
+                                start_date=datetime(2013, 1, 1))
+        report = simulation.run(days=1)
+
+        self.assertEqual(report["plans"], 4)
+        self.assertEqual(report["backupsStarted"], 16)
+        self.assertEqual(report["backupsCompleted"], 16)
+        self.assertEqual(report["backupsQueuedAtEnd"], 0)
+        self.assertEqual(report["pastDueCancellations"], 0)
+        # half of each occurrence's backups wait for a free worker
+        self.assertEqual(report["queueLatencyInMinutes"]["p50"], 0)
+        self.assertEqual(report["queueLatencyInMinutes"]["max"], 30)
+        self.assertEqual(report["workerUtilization"], 0.1667)
+        self.assertEqual([engine["workerUtilization"]
+                          for engine in report["engines"]], [0.1667, 0.1667])
+
+        # runs do not leak state (e.g. virtual time) into each other
+        simulation = Simulation({}, plan_docs, engine_docs,
+                                duration_sampler=DurationSampler(
+                                    default_duration=30 * 60),
+                                start_date=datetime(2013, 1, 1))
+        self.assertEqual(simulation.run(days=1)["backupsStarted"], 16)
+
+    ###########################################################################
+    def test_run_saturated(self):
+        # 2 hourly plans of 90 minute backups on one single worker engine
+        plan_docs = self._make_plan_docs(2, 1)
+        simulation = Simulation({}, plan_docs,
+                                [{"_id": "engine-1", "maxWorkers": 1}],
+                                duration_sampler=DurationSampler(
+                                    default_duration=90 * 60),
+                                start_date=datetime(2013, 1, 1))
+        report = simulation.run(days=1)
+
+        self.assertEqual(report["backupsStarted"], 16)
+        self.assertEqual(report["backupsCompleted"], 15)
+        self.assertEqual(report["workerUtilization"], 1)
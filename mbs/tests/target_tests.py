@@ -37,3 +37,100 @@ class TargetTest(BaseTest):
                              math.ceil(10000/1024))
             self.assertTrue(mp_upload_mock.complete_upload.called)
             self.assertEqual(hash_.hexdigest(), self.md5(dump.name))
+
+    ###########################################################################
+    def test_inventory_lookup(self):
+        listing = [('a/1.tgz', 100), ('a/2.tgz', 200)]
+        with patch.object(mbs.target.S3BucketTarget, '_list_files',
+                          Mock(return_value=listing)), \
+             patch.object(mbs.target.S3BucketTarget, '_fetch_file_info',
+                          Mock(return_value=(False, None))) as fetch_mock:
+            target = self.maker.make({'_type': 'S3BucketTarget',
+                                      'bucketName': 'inventory-test',
+                                      'useInventory': True})
+
+            self.assertTrue(target.file_exists('a/1.tgz'))
+            self.assertFalse(fetch_mock.called)
+            # misses are confirmed with a live lookup
+            self.assertFalse(target.file_exists('a/3.tgz'))
+            self.assertEqual(fetch_mock.call_count, 1)
+
+            target.inventory.file_added('a/3.tgz', 300)
+            target.inventory.file_removed('a/1.tgz')
+            self.assertEqual(target._lookup_file_info('a/3.tgz'), (True, 300))
+            self.assertFalse(target.file_exists('a/1.tgz'))
+
+            # stale inventories get re-listed
+            with patch.object(target.inventory, '_max_age', -1):
+                target.file_exists('a/1.tgz')
+            self.assertEqual(target._list_files.call_count, 2)
+
+    ###########################################################################
+    def test_inventory_per_account(self):
+        def make_target(access_key):
+            return self.maker.make({'_type': 'S3BucketTarget',
+                                    'bucketName': 'inventory-test',
+                                    'encryptedAccessKey': access_key,
+                                    'useInventory': True})
+
+        self.assertIs(make_target('key-1').inventory,
+                      make_target('key-1').inventory)
+        self.assertIsNot(make_target('key-1').inventory,
+                         make_target('key-2').inventory)
+
+    ###########################################################################
+    def test_azure_list_files(self):
+        def blob(name, size):
+            blob_mock = Mock(**{'properties.content_length': size})
+            blob_mock.name = name
+            return blob_mock
+
+        pages = [Mock(blobs=[blob('a/1.tgz', 100), blob('a/2.tgz', 200)],
+                      next_marker='marker-1'),
+                 Mock(blobs=[blob('a/3.tgz', 300)], next_marker='')]
+        blob_service = Mock(**{'list_blobs.side_effect': pages})
+        target = mbs.target.AzureContainerTarget()
+        target.container_name = 'inventory-test'
+        target.use_inventory = True
+
+        with patch.object(target, '_get_blob_service',
+                          Mock(return_value=blob_service)):
+            self.assertEqual(target._lookup_file_info('a/3.tgz'), (True, 300))
+
+        self.assertEqual([call[1]['marker'] for call in
+                          blob_service.list_blobs.call_args_list],
+                         [None, 'marker-1'])
+
+    ###########################################################################
+    def test_composite_to_document(self):
+        doc = {'_type': 'CompositeTarget',
+               'targets': [{'_type': 'S3BucketTarget',
+                            'bucketName': 'composite-test',
+                            'encryptedAccessKey': 'key-1'}],
+               'useInventory': True}
+        target = self.maker.make(doc)
+        self.assertEqual(target.to_document()['useInventory'], True)
+        self.assertTrue(self.maker.make(target.to_document()).use_inventory)
+
+    ###########################################################################
+    def test_composite_put_resume(self):
+        ref = mbs.target.FileReference(file_path='dest.tgz', file_size=0)
+        ok_target = Mock(put_file=Mock(return_value=ref))
+        bad_target = Mock(put_file=Mock(side_effect=Exception('boom')))
+        target = mbs.target.CompositeTarget()
+        target.targets = [ok_target, bad_target]
+
+        with NamedTemporaryFile() as dump:
+            try:
+                target.put_file(dump.name, destination_path='dest.tgz')
+                self.fail('expected partial upload error')
+            except mbs.target.CompositeTargetPartialUploadError, e:
+                partial = e.target_reference
+            self.assertEqual(partial.references, [ref, None])
+
+            bad_target.put_file = Mock(return_value=ref)
+            target_ref = target.put_file(dump.name,
+                                         destination_path='dest.tgz',
+                                         completed_reference=partial)
+            self.assertEqual(ok_target.put_file.call_count, 1)
+            self.assertTrue(target_ref.complete)
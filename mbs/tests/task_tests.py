@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from mbs.backup import Backup
+from mbs.task import (STATE_SCHEDULED, STATE_IN_PROGRESS, EVENT_TYPE_WARNING,
+                      MAX_RECENT_LOGS, EventLogEntry)
+
+from . import BaseTest
+
+
+###############################################################################
+# TaskTest
+###############################################################################
+class TaskTest(BaseTest):
+
+    ###########################################################################
+    def test_event_index(self):
+        backup = Backup()
+        backup.change_state(STATE_SCHEDULED)
+        self.assertFalse(backup.is_event_logged("END_EXTRACT"))
+
+        # build the index then keep logging
+        self.assertEqual(backup.get_warnings(), [])
+        backup.change_state(STATE_IN_PROGRESS)
+        for i in range(MAX_RECENT_LOGS):
+            backup.log_event(name="DUMP_ERROR", event_type=EVENT_TYPE_WARNING)
+        end_extract = backup.log_event(name="END_EXTRACT")
+
+        self.assertTrue(backup.is_event_logged(["END_UPLOAD", "END_EXTRACT"]))
+        self.assertEqual(len(backup.logs), MAX_RECENT_LOGS)
+        self.assertEqual(len(backup.get_warnings()), MAX_RECENT_LOGS)
+        self.assertEqual(backup.warning_count, MAX_RECENT_LOGS)
+        self.assertIsNotNone(backup._get_state_set_date(STATE_SCHEDULED))
+        self.assertIs(backup._get_event_index().get_last_entry("END_EXTRACT"),
+                      end_extract)
+
+        # resetting logs resets the index
+        backup.logs = []
+        self.assertEqual(backup.get_warnings(), [])
+        self.assertIsNone(backup._get_state_set_date(STATE_SCHEDULED))
+
+    ###########################################################################
+    def test_compact_log_entry(self):
+        doc = {
+            "_type": "EventLogEntry",
+            "eventType": EVENT_TYPE_WARNING,
+            "name": "DUMP_ERROR",
+            "date": datetime(2013, 1, 1),
+            "state": STATE_IN_PROGRESS,
+            "message": "boom"
+        }
+        log_entry = EventLogEntry.from_document(doc)
+        self.assertFalse(hasattr(log_entry, "__dict__"))
+        self.assertEqual(log_entry.to_document(), doc)
+        self.assertEqual(log_entry, self.maker.make(doc))
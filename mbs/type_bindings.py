@@ -25,8 +25,12 @@ TYPE_BINDINGS = {
     "S3BucketTarget": "mbs.target.S3BucketTarget",
     "EbsSnapshotTarget": "mbs.target.EbsSnapshotTarget",
     "RackspaceCloudFilesTarget": "mbs.target.RackspaceCloudFilesTarget",
+    "CompositeTarget": "mbs.target.CompositeTarget",
     "FileReference": "mbs.target.FileReference",
     "EbsSnapshotReference": "mbs.target.EbsSnapshotReference",
+    "CompositeTargetReference": "mbs.target.CompositeTargetReference",
+    "BandwidthLimiter": "mbs.bandwidth.BandwidthLimiter",
+    "LoadLevelingPolicy": "mbs.load_leveling.LoadLevelingPolicy",
     "RetainLastNPolicy": "mbs.policies.RetainLastNPolicy",
     "RetainMaxTimePolicy": "mbs.policies.RetainMaxTimePolicy",
     "PlanAuditor": "mbs.auditors.PlanAuditor",
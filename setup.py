@@ -31,6 +31,7 @@ def parse_archive(line):
 def requirements():
     inst_reqs = []
     test_reqs = []
+    sim_reqs  = []
     dep_links = []
     reqs      = inst_reqs
     setup_dir = os.path.dirname(os.path.abspath(__file__))
@@ -41,6 +42,8 @@ def requirements():
         elif line.startswith('#'):
             if 'core' in line.lower():
                 reqs = inst_reqs
+            elif 'simulation' in line.lower():
+                reqs = sim_reqs
             elif 'test' in line.lower():
                 reqs = test_reqs
             continue
@@ -52,7 +55,8 @@ def requirements():
             reqs.append(req)
         else:
             reqs.append(line)
-    return {'links': dep_links, 'core': inst_reqs, 'test': test_reqs}
+    return {'links': dep_links, 'core': inst_reqs, 'test': test_reqs,
+            'simulation': sim_reqs}
 
 
 ###############################################################################
@@ -117,7 +121,8 @@ setup(
     ],
     packages=find_packages(),
     install_requires=requirements()['core'],
-    tests_require=requirements()['test'],
+    tests_require=requirements()['test'] + requirements()['simulation'],
+    extras_require={'simulation': requirements()['simulation']},
     dependency_links=requirements()['links'],
     test_suite='nose.collector'
 )